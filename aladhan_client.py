@@ -0,0 +1,299 @@
+"""
+Connection-pooled client for api.aladhan.com.
+
+One long-lived client per process (i.e. per gunicorn worker) reuses keep-alive
+connections instead of paying a TCP handshake on every call. Transient
+failures are retried with jittered exponential backoff. Batches can be issued
+concurrently from asyncio with one global concurrency cap.
+"""
+import asyncio
+import os
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import ConnectTimeoutError, NewConnectionError, ReadTimeoutError
+from urllib3.util import Retry
+
+try:
+    import aiohttp
+except ImportError:
+    # Fallback: the async path runs the pooled session in threads
+    aiohttp = None
+
+import metrics
+import prayer_times
+
+ALADHAN_BASE_URL = os.getenv('ALADHAN_BASE_URL', 'http://api.aladhan.com')
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+# endpoint: timings or calendar; outcome: ok, error or timeout (retries included in the time)
+UPSTREAM_SECONDS = metrics.histogram('aladhan_request_duration_seconds', 'aladhan API call latency',
+                                     ('endpoint', 'outcome'))
+UPSTREAM_TIMEOUTS = metrics.counter('aladhan_timeouts', 'aladhan API calls that timed out', ('endpoint',))
+
+
+def parse_maghrib(payload):
+    """Extract Maghrib as 24-hour 'HH:MM' from a /v1/timings response (or None)"""
+    if not isinstance(payload, dict) or 'data' not in payload or 'timings' not in payload['data']:
+        return None
+    return clean_time(payload['data']['timings'].get('Maghrib'))
+
+
+def parse_calendar(payload):
+    """Extract {'YYYY-MM-DD': 'HH:MM'} from a /v1/calendar response in one pass over its days"""
+    if not isinstance(payload, dict) or not isinstance(payload.get('data'), list):
+        return {}
+    times = {}
+    for day in payload['data']:
+        try:
+            day_, month, year = day['date']['gregorian']['date'].split('-')
+            maghrib = clean_time(day['timings'].get('Maghrib'))
+        except (KeyError, TypeError, AttributeError, ValueError):
+            continue
+        if maghrib:
+            times[f"{year}-{month}-{day_}"] = maghrib
+    return times
+
+
+def clean_time(value):
+    """Normalize an aladhan time like '17:45 (EET)' or '17:45+02:00' to 'HH:MM' (or None)"""
+    if not value or value == '--:--':
+        return None
+    # Format time (remove +00:00 / timezone suffix if present)
+    value = value.split(' ')[0].split('+')[0].strip()
+    if not value or ':' not in value:
+        return None
+    return value
+
+
+def as_timeout(error):
+    """
+    requests.Timeout for a ConnectionError that wraps a timeout, or None.
+
+    Once urllib3's Retry gives up, requests reports the last read or connect
+    timeout as a ConnectionError(MaxRetryError) instead of a Timeout.
+    """
+    reason = getattr(error.args[0], 'reason', None) if error.args else None
+    if isinstance(reason, ReadTimeoutError):
+        return requests.ReadTimeout(*error.args, request=error.request, response=error.response)
+    # NewConnectionError (refused, DNS) subclasses ConnectTimeoutError but is not a timeout
+    if isinstance(reason, ConnectTimeoutError) and not isinstance(reason, NewConnectionError):
+        return requests.ConnectTimeout(*error.args, request=error.request, response=error.response)
+    return None
+
+
+def _make_retry(retries, backoff):
+    kwargs = dict(
+        total=retries,
+        connect=retries,
+        read=retries,
+        status=retries,
+        backoff_factor=backoff,
+        status_forcelist=RETRY_STATUSES,
+        allowed_methods=frozenset(['GET']),
+        respect_retry_after_header=True,
+        raise_on_status=False
+    )
+    try:
+        # urllib3 >= 2.0 supports jitter natively
+        return Retry(backoff_jitter=backoff, **kwargs)
+    except TypeError:
+        return Retry(**kwargs)
+
+
+class AladhanClient:
+    """Thread-safe pooled HTTP client with an optional asyncio batch path"""
+
+    def __init__(self, base_url=ALADHAN_BASE_URL, timeout=4, pool_size=20,
+                 retries=2, backoff=0.2, concurrency=32):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self.retries = retries
+        self.backoff = backoff
+        self.concurrency = concurrency
+        self._session = self._new_session()
+        self._lock = threading.Lock()
+        self.requests_sent = 0
+        self.errors = 0
+
+    def _new_session(self):
+        session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=4,         # distinct hosts kept in the pool
+            pool_maxsize=self.pool_size,  # connections kept alive per host
+            pool_block=True,            # never exceed pool_size connections per host
+            max_retries=_make_retry(self.retries, self.backoff)
+        )
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        session.headers.update({'Accept': 'application/json', 'Connection': 'keep-alive'})
+        return session
+
+    def _count(self, error=False):
+        with self._lock:
+            self.requests_sent += 1
+            if error:
+                self.errors += 1
+
+    def timings_params(self, lat, lng):
+        return {
+            'latitude': lat,
+            'longitude': lng,
+            'method': prayer_times.METHOD,  # Umm al-Qura, Makkah
+            'school': prayer_times.SCHOOL   # Shafi
+        }
+
+    @staticmethod
+    def _observe(endpoint, started, outcome):
+        UPSTREAM_SECONDS.observe(time.perf_counter() - started, endpoint, outcome)
+        if outcome == 'timeout':
+            UPSTREAM_TIMEOUTS.inc(endpoint)
+
+    def get_json(self, path, params):
+        """GET a JSON document through the pooled session; returns None on non-200 or non-JSON, raises requests.Timeout on timeouts"""
+        endpoint = path.split('/')[2]
+        started = time.perf_counter()
+        try:
+            response = self._session.get(f"{self.base_url}{path}", params=params, timeout=self.timeout)
+        except requests.Timeout:
+            self._observe(endpoint, started, 'timeout')
+            self._count(error=True)
+            raise
+        except requests.ConnectionError as e:
+            self._count(error=True)
+            timeout = as_timeout(e)
+            if timeout is None:
+                self._observe(endpoint, started, 'error')
+                raise
+            self._observe(endpoint, started, 'timeout')
+            raise timeout from e
+        except requests.RequestException:
+            self._observe(endpoint, started, 'error')
+            self._count(error=True)
+            raise
+        if response.status_code != 200:
+            self._observe(endpoint, started, 'error')
+            self._count(error=True)
+            return None
+        try:
+            payload = response.json()
+        except ValueError:
+            # An HTML error page or a truncated body behind a 200
+            self._observe(endpoint, started, 'error')
+            self._count(error=True)
+            return None
+        self._observe(endpoint, started, 'ok')
+        self._count()
+        return payload
+
+    def maghrib(self, lat, lng, date_str):
+        """Maghrib for one location/date as 24-hour 'HH:MM' (or None)"""
+        return parse_maghrib(self.get_json(f"/v1/timings/{date_str}", self.timings_params(lat, lng)))
+
+    def maghrib_calendar(self, lat, lng, year, month):
+        """
+        Maghrib for every day of a month in one call to /v1/calendar.
+
+        Returns {'YYYY-MM-DD': 'HH:MM'}; days without a usable value are left out.
+        """
+        payload = self.get_json(f"/v1/calendar/{year}/{month}", self.timings_params(lat, lng))
+        return parse_calendar(payload)
+
+    def maghrib_range(self, lat, lng, dates):
+        """
+        Maghrib for a list of 'YYYY-MM-DD' dates using one calendar call per month.
+
+        Dates missing from the calendar responses (or whose month failed) are
+        fetched one by one. Returns {'YYYY-MM-DD': 'HH:MM' or None}.
+        """
+        months = {}
+        for date_str in dates:
+            months.setdefault((int(date_str[:4]), int(date_str[5:7])), []).append(date_str)
+
+        results = {}
+        for (year, month), month_dates in months.items():
+            try:
+                calendar = self.maghrib_calendar(lat, lng, year, month)
+            except (requests.RequestException, ValueError):
+                calendar = {}
+            for date_str in month_dates:
+                results[date_str] = calendar.get(date_str)
+
+        for date_str, value in results.items():
+            if value is None:
+                try:
+                    results[date_str] = self.maghrib(lat, lng, date_str)
+                except (requests.RequestException, ValueError):
+                    results[date_str] = None
+        return results
+
+    async def _maghrib_async(self, http, semaphore, lat, lng, date_str):
+        async with semaphore:
+            if http is None:
+                try:
+                    return await asyncio.to_thread(self.maghrib, lat, lng, date_str)
+                except (requests.RequestException, ValueError):
+                    self._count(error=True)
+                    return None
+            url = f"{self.base_url}/v1/timings/{date_str}"
+            started = time.perf_counter()
+            for attempt in range(self.retries + 1):
+                try:
+                    async with http.get(url, params=self.timings_params(lat, lng)) as response:
+                        if response.status in RETRY_STATUSES and attempt < self.retries:
+                            await asyncio.sleep(self._backoff_delay(attempt))
+                            continue
+                        if response.status != 200:
+                            self._observe('timings', started, 'error')
+                            self._count(error=True)
+                            return None
+                        self._observe('timings', started, 'ok')
+                        self._count()
+                        return parse_maghrib(await response.json(content_type=None))
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    if attempt >= self.retries:
+                        self._observe('timings', started, 'timeout' if isinstance(e, asyncio.TimeoutError) else 'error')
+                        self._count(error=True)
+                        return None
+                    await asyncio.sleep(self._backoff_delay(attempt))
+            return None
+
+    def _backoff_delay(self, attempt):
+        return self.backoff * (2 ** attempt) + random.uniform(0, self.backoff)
+
+    async def maghrib_many_async(self, items):
+        """
+        Fetch Maghrib for many (lat, lng, date_str) items concurrently.
+
+        At most ``concurrency`` requests are in flight at once. Results are
+        returned in the same order as ``items``; failures are None.
+        """
+        semaphore = asyncio.Semaphore(self.concurrency)
+        if aiohttp is None:
+            tasks = [self._maghrib_async(None, semaphore, *item) for item in items]
+            return await asyncio.gather(*tasks)
+        connector = aiohttp.TCPConnector(limit=self.concurrency, limit_per_host=self.pool_size)
+        timeout = aiohttp.ClientTimeout(total=self.timeout)
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout) as http:
+            tasks = [self._maghrib_async(http, semaphore, *item) for item in items]
+            return await asyncio.gather(*tasks)
+
+    def maghrib_many(self, items):
+        """Blocking wrapper around maghrib_many_async for use from Flask views"""
+        return asyncio.run(self.maghrib_many_async(list(items)))
+
+    def stats(self):
+        with self._lock:
+            return {
+                'base_url': self.base_url,
+                'pool_size': self.pool_size,
+                'concurrency': self.concurrency,
+                'requests_sent': self.requests_sent,
+                'errors': self.errors,
+                'async_backend': 'aiohttp' if aiohttp is not None else 'threads'
+            }
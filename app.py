@@ -1,46 +1,103 @@
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, render_template, request, jsonify, url_for, g, send_file, send_from_directory, abort
 from flask_cors import CORS
-import mysql.connector
-from mysql.connector import Error
-from datetime import datetime
+from markupsafe import Markup
+from mysql.connector import Error, DataError, IntegrityError
+from datetime import datetime, date, timedelta
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
 import os
 import re
-import html
+import time
+import threading
+import logging
+import json
+import hashlib
+import hmac
+import click
 import requests
+import concurrent.futures
+import mimetypes
 from dotenv import load_dotenv
 from functools import wraps
-try:
-    from flask_limiter import Limiter
-    from flask_limiter.util import get_remote_address
-except ImportError:
-    # Fallback if flask-limiter is not installed
-    Limiter = None
-    get_remote_address = lambda: '127.0.0.1'
+import logs
+import metrics
+import prayer_times
+import hijri
+import timetable
+from cache import TTLCache, SQLiteStore
+from aladhan_client import AladhanClient
+from db import ConnectionPool
+from gallery import GalleryCache, GALLERY_SIZE, is_local_image
+from prompt_cache import prompt_key
+from validation import prompt_validator, sanitize
+from prefetch import PrefetchScheduler, SQLiteLease
+from assets import AssetManifest, build_assets
+from images import ImagePipeline, FORMATS as IMAGE_FORMATS
+from catalog import CharacterCatalog
+from jobs import JobQueue, JobError, QueueFullError, MemoryJobStore, SQLiteJobStore, MySQLJobStore
+from ratelimit import Limiter, MemoryStore, create_store
+from writebehind import WriteBehindBuffer
+from imagestore import ImageStore
+from pagecache import PageCache
 
 # Load environment variables
 load_dotenv()
 
+# Structured logs: LOG_FORMAT=text (key=value) or json
+logs.configure(os.getenv('LOG_FORMAT', 'text'), os.getenv('LOG_LEVEL', 'INFO'))
+logger = logging.getLogger('app')
+
 app = Flask(__name__)
 app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', os.urandom(32).hex())
 app.config['SESSION_COOKIE_SECURE'] = True  # HTTPS only in production
 app.config['SESSION_COOKIE_HTTPONLY'] = True
 app.config['SESSION_COOKIE_SAMESITE'] = 'Lax'
 
-# Rate Limiting
-if Limiter:
-    limiter = Limiter(
-        app=app,
-        key_func=get_remote_address,
-        default_limits=["200 per day", "50 per hour"],
-        storage_uri="memory://"
-    )
-else:
-    # Fallback decorator if flask-limiter is not installed
-    def limiter_limit(limit_str):
-        def decorator(f):
-            return f
-        return decorator
-    limiter = type('Limiter', (), {'limit': lambda self, limit_str: limiter_limit(limit_str)})()
+# Latency metrics (served on /metrics)
+REQUEST_SECONDS = metrics.histogram('http_request_duration_seconds', 'Request latency until the response is returned',
+                                    ('endpoint', 'method', 'status'))
+DB_ACQUIRE_SECONDS = metrics.histogram('db_acquire_seconds', 'Time to check out a pooled database connection',
+                                       ('outcome',))
+DB_QUERY_SECONDS = metrics.histogram('db_query_seconds', 'Database query time including fetch', ('query',))
+IMAGE_GENERATION_SECONDS = metrics.histogram('image_generation_seconds', 'Image generation API call duration',
+                                             ('outcome',), buckets=(0.1, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120))
+
+# Workers on this host publish their numbers here, so /metrics sums all of them (empty: per-worker numbers)
+METRICS_DB = os.getenv('METRICS_DB',
+                       os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'metrics.sqlite3'))
+if METRICS_DB:
+    metrics.REGISTRY.share(metrics.SQLiteShare(METRICS_DB))
+
+# Registered before any other request hook so rejected (429) requests are timed too
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_latency(response):
+    """Runs after every other after_request hook"""
+    started = g.pop('request_started', None)
+    if started is not None:
+        # Unmatched URLs share one label so 404 scans cannot blow up the series count
+        REQUEST_SECONDS.observe(time.perf_counter() - started, request.endpoint or 'unmatched',
+                                request.method, str(response.status_code))
+    return response
+
+# Rate Limiting - counters live in a store shared by all gunicorn workers (sqlite:// by default,
+# redis:// across hosts), so a limit means the same thing whatever the worker count
+RATELIMIT_STORAGE_URI = os.getenv('RATELIMIT_STORAGE_URI') or \
+    'sqlite://' + os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'ratelimit.db')
+try:
+    ratelimit_store = create_store(RATELIMIT_STORAGE_URI)
+except Exception as e:
+    logger.warning("Rate limit storage unavailable - using per-process counters",
+                   extra={'storage': RATELIMIT_STORAGE_URI, 'error': str(e)})
+    ratelimit_store = MemoryStore()
+limiter = Limiter(
+    app=app,
+    default_limits=["200 per day", "50 per hour"],
+    store=ratelimit_store,
+    enabled=(os.getenv('RATELIMIT_ENABLED') or '1') == '1'
+)
 
 CORS(app, resources={
     r"/api/*": {
@@ -79,6 +136,9 @@ def after_request(response):
     # Cache control for static files
     if request.endpoint == 'static':
         response.headers["Cache-Control"] = "public, max-age=3600"
+    elif "Cache-Control" in response.headers:
+        # The view set its own caching policy (e.g. ETag-backed API responses)
+        pass
     else:
         response.headers["Cache-Control"] = "no-cache, no-store, must-revalidate"
         response.headers["Pragma"] = "no-cache"
@@ -96,16 +156,76 @@ DB_CONFIG = {
     'collation': 'utf8mb4_unicode_ci'
 }
 
+# Connection pool - connections are reused across requests instead of a new handshake per page view
+db_pool = ConnectionPool(
+    DB_CONFIG,
+    size=int(os.getenv('DB_POOL_SIZE', '5')),
+    timeout=float(os.getenv('DB_POOL_TIMEOUT', '2')),
+    recycle=int(os.getenv('DB_POOL_RECYCLE', '3600')),
+    ping_interval=int(os.getenv('DB_POOL_PING_INTERVAL', '30')),
+    retry_interval=int(os.getenv('DB_RETRY_INTERVAL', '5'))
+)
+
+# Server-side prepared statements (prepared once per pooled connection)
+# Both gallery queries are served by idx_gallery (is_local, id)
+GALLERY_QUERY = """
+    SELECT id, prompt, image_url, created_at 
+    FROM generations 
+    WHERE is_local = 1
+    ORDER BY id DESC 
+    LIMIT 12
+"""
+GALLERY_PAGE_QUERY = """
+    SELECT id, prompt, image_url, created_at 
+    FROM generations 
+    WHERE is_local = 1 AND id < %s
+    ORDER BY id DESC 
+    LIMIT %s
+"""
+# Multi-row insert used by the write-behind buffer (one "(...)" group per row)
+INSERT_GENERATIONS_QUERY = """
+    INSERT INTO generations (prompt, image_url, prompt_hash, created_at) 
+    VALUES {rows}
+"""
+EXISTING_GENERATIONS_QUERY = """
+    SELECT prompt_hash, image_url 
+    FROM generations 
+    WHERE prompt_hash IN ({hashes})
+"""
+FIND_GENERATION_QUERY = """
+    SELECT id, image_url 
+    FROM generations 
+    WHERE prompt_hash = %s AND image_url != '' 
+    ORDER BY id DESC 
+    LIMIT 1
+"""
+
+# Settings that change the generated image - part of the prompt cache key
+IMAGE_GENERATION_SETTINGS = {
+    'provider': os.getenv('IMAGE_PROVIDER', 'placeholder'),
+    'size': os.getenv('IMAGE_SIZE', '512x512')
+}
+
+# Generated image results keyed on the normalized prompt + settings (size and age bounded)
+IMAGE_CACHE_DB = os.getenv('IMAGE_CACHE_DB', '')
+image_result_cache = TTLCache(
+    max_size=int(os.getenv('IMAGE_CACHE_SIZE', '500')),
+    ttl=int(os.getenv('IMAGE_CACHE_TTL', str(7 * 24 * 3600))),
+    store=SQLiteStore(IMAGE_CACHE_DB, table='image_results') if IMAGE_CACHE_DB else None,
+    name='image_results'
+)
+
+# In-process cache of the newest gallery rows
+gallery_cache = GalleryCache(size=GALLERY_SIZE, ttl=int(os.getenv('GALLERY_CACHE_TTL', '60')))
+
 def get_db_connection():
-    """Create and return a database connection"""
-    try:
-        connection = mysql.connector.connect(**DB_CONFIG)
-        return connection
-    except Error as e:
-        print(f"Error connecting to MySQL: {e}")
-        return None
+    """Check out a pooled database connection (close() returns it to the pool), or None"""
+    started = time.perf_counter()
+    connection = db_pool.acquire()
+    DB_ACQUIRE_SECONDS.observe(time.perf_counter() - started, 'ok' if connection else 'unavailable')
+    return connection
 
-def call_ai_image_api(prompt):
+def call_ai_image_api(prompt, timeout=None):
     """
     Placeholder function for AI image generation.
     
@@ -113,9 +233,12 @@ def call_ai_image_api(prompt):
     
     Args:
         prompt (str): Text prompt describing the character styling
+        timeout (float): Seconds left before the job times out - pass it to the HTTP client
+            (None = no limit)
         
     Returns:
-        str: URL of the generated image (placeholder for now)
+        str or bytes: URL of the generated image (placeholder for now), or the image itself;
+        images at an http(s) URL and raw bytes are copied into the image store
     """
     # TODO: Integrate your AI image generation API here
     # For now, return a placeholder URL
@@ -142,10 +265,192 @@ def favicon():
         # Return 204 No Content if favicon doesn't exist to prevent 404 errors
         return '', 204
 
+# Fingerprinted static assets (built by `flask --app app build-assets`)
+ASSET_MAX_AGE = 365 * 24 * 3600
+asset_manifest = AssetManifest(app.static_folder, static_url_path=app.static_url_path)
+
+def asset_url(filename):
+    """URL of a static file - fingerprinted when the asset build has run, plain /static otherwise"""
+    fingerprinted = asset_manifest.resolve(filename)
+    if fingerprinted is None:
+        return url_for('static', filename=filename)
+    return url_for('assets', filename=fingerprinted)
+
+app.jinja_env.globals['asset_url'] = asset_url
+
+@app.route('/assets/<path:filename>')
+@limiter.exempt  # static files, like /static
+def assets(filename):
+    """Immutable fingerprinted assets, precompressed variants chosen by Accept-Encoding"""
+    entry = asset_manifest.entry_for(filename)
+    if entry is None:
+        abort(404)
+    stored, encoding = asset_manifest.variant(filename, lambda e: request.accept_encodings[e] > 0)
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    response = send_from_directory(asset_manifest.dist_dir, stored, mimetype=mimetype, conditional=True)
+    response.headers['Cache-Control'] = f"public, max-age={ASSET_MAX_AGE}, immutable"
+    if entry['encodings']:
+        response.vary.add('Accept-Encoding')
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    return response
+
+@app.cli.command('build-assets')
+def build_assets_command():
+    """Fingerprint and precompress static files into static/dist"""
+    manifest = build_assets(app.static_folder)
+    asset_manifest.load()
+    compressed = sum(1 for entry in manifest.values() if entry['encodings'])
+    click.echo(f"{len(manifest)} assets -> {asset_manifest.dist_dir} ({compressed} precompressed)")
+
+# Responsive image derivatives (widths x AVIF/WebP/JPEG), generated on first request
+IMAGE_DERIVATIVE_DIR = os.getenv('IMAGE_DERIVATIVE_DIR') or \
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'images')
+image_pipeline = ImagePipeline(app.static_folder, IMAGE_DERIVATIVE_DIR)
+
+def static_image_name(image_url):
+    """Path under static/ for a /static/... or fingerprinted /assets/... URL, or None"""
+    if not image_url:
+        return None
+    static_prefix = app.static_url_path + '/'
+    if image_url.startswith(static_prefix):
+        return image_url[len(static_prefix):]
+    asset_prefix = asset_manifest.url_path + '/'
+    if image_url.startswith(asset_prefix):
+        return asset_manifest.original(image_url[len(asset_prefix):])
+    return None
+
+def image_source(image_url):
+    """(pipeline, name, derivative URL builder) for a local image URL, or None"""
+    if image_url and image_url.startswith(MEDIA_URL_PREFIX):
+        key = image_url[len(MEDIA_URL_PREFIX):]
+        # Keys never change content, so their derivatives need no version
+        return media_pipeline, key, lambda width, fmt, version: url_for('media_derivative', width=width, fmt=fmt, key=key)
+    name = static_image_name(image_url)
+    if name is None:
+        return None
+    return image_pipeline, name, lambda width, fmt, version: url_for('image_derivative', width=width, fmt=fmt,
+                                                                     name=name, v=version)
+
+def responsive_image(image_url, fallback_width=640):
+    """
+    srcset data for a local /static/images/..., /assets/images/... or /media/... URL, or None to use the URL as is.
+
+    Returns {'src', 'srcset', 'sources': [{'type', 'srcset'}], 'width', 'height', 'placeholder', 'original'}.
+    """
+    source = image_source(image_url)
+    if not image_pipeline.available or source is None:
+        return None
+    pipeline, name, derivative_url = source
+    try:
+        version = pipeline.version(name)
+        if version is None:
+            return None
+        width, height = pipeline.dimensions(name)
+        widths = pipeline.widths_for(name)
+        placeholder = pipeline.placeholder(name)
+    except (OSError, ValueError) as e:
+        logger.warning("Responsive image unavailable", extra={'image': name, 'error': str(e)})
+        return None
+    
+    def srcset(fmt):
+        return ', '.join(f"{derivative_url(w, fmt, version)} {min(w, width)}w" for w in widths)
+    
+    fallback_fmt = pipeline.formats[-1]
+    fallback = max([w for w in widths if w <= fallback_width] or widths[:1])
+    return {
+        'src': derivative_url(fallback, fallback_fmt, version),
+        'srcset': srcset(fallback_fmt),
+        'sources': [{'type': IMAGE_FORMATS[fmt][1], 'srcset': srcset(fmt)} for fmt in pipeline.formats[:-1]],
+        'width': width,
+        'height': height,
+        'placeholder': placeholder,
+        'original': image_url
+    }
+
+app.jinja_env.globals['responsive_image'] = responsive_image
+
+@app.route('/images/<int:width>/<fmt>/<path:name>')
+@limiter.exempt  # static files, like /static
+def image_derivative(width, fmt, name):
+    """Resized/re-encoded image; immutable when ?v= matches the current source"""
+    try:
+        path = image_pipeline.derivative(name, width, fmt)
+    except (OSError, ValueError) as e:
+        logger.warning("Image derivative failed", extra={'image': name, 'error': str(e)})
+        path = None
+    if path is None:
+        abort(404)
+    response = send_file(path, mimetype=IMAGE_FORMATS[fmt][1], conditional=True)
+    if request.args.get('v') == image_pipeline.version(name):
+        response.headers['Cache-Control'] = f"public, max-age={ASSET_MAX_AGE}, immutable"
+    else:
+        response.headers['Cache-Control'] = "public, max-age=3600"
+    return response
+
+@app.route('/api/images/responsive', methods=['GET'])
+@limiter.limit("120 per minute")
+def responsive_image_info():
+    """srcset data for one local image (?src=/static/images/... or /media/...)"""
+    info = responsive_image(request.args.get('src', ''))
+    if info is None:
+        return jsonify({'success': False, 'error': 'الصورة غير متوفرة'}), 404
+    response = jsonify({'success': True, **info})
+    response.headers['Cache-Control'] = "public, max-age=3600"
+    return response
+
+@app.cli.command('build-images')
+def build_images_command():
+    """Generate every responsive image derivative and placeholder ahead of time"""
+    if not image_pipeline.available:
+        click.echo("Pillow is not installed - responsive images are disabled")
+        return
+    written = image_pipeline.build_all()
+    click.echo(f"{written} derivatives written to {IMAGE_DERIVATIVE_DIR} ({', '.join(image_pipeline.formats)})")
+
+# Ready-made character designs - indexed at startup, rescanned when the directory changes
+character_catalog = CharacterCatalog(app.static_folder, asset_manifest)
+CATALOG_MAX_AGE = int(os.getenv('CATALOG_MAX_AGE', '300'))
+
+app.jinja_env.globals['character_categories'] = character_catalog.categories
+
+@app.route('/api/characters', methods=['GET'])
+@limiter.limit("60 per minute")
+def list_characters():
+    """Catalog of character images that exist on disk, with size and content hash"""
+    body, etag = character_catalog.manifest()
+    return cacheable_response(body, etag, 'application/json', CATALOG_MAX_AGE)
+
+# Rendered pages: /loading, the /home shell and its gallery fragment (PAGE_CACHE_SIZE=0 renders every request)
+page_cache = PageCache(
+    name='pages',
+    max_size=int(os.getenv('PAGE_CACHE_SIZE', '32')),
+    ttl=int(os.getenv('PAGE_CACHE_TTL', '300'))
+)
+# Where the gallery fragment goes in the cached /home shell
+GALLERY_SLOT = '<!-- gallery -->'
+
+def page_response(page):
+    """HTML response for a cached page, compressed for the client and revalidated by ETag"""
+    if page_cache.max_size:
+        body, encoding = page.variant(lambda e: request.accept_encodings[e] > 0)
+    else:
+        # Not cached - compressing on every request would cost more than it saves
+        body, encoding = page.body, None
+    response = app.response_class(body, mimetype='text/html')
+    response.set_etag(f"{page.etag}-{encoding}" if encoding else page.etag)
+    response.headers['Cache-Control'] = "no-cache"
+    response.vary.add('Accept-Encoding')
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    return response.make_conditional(request)
+
 @app.route('/loading')
 def loading():
     """Loading page with video animation - redirects to main page after 3 seconds"""
-    return render_template('loading.html')
+    page = page_cache.get(('loading', asset_manifest.version),
+                          lambda: render_template('loading.html').encode('utf-8'))
+    return page_response(page)
 
 @app.route('/')
 def index():
@@ -154,83 +459,479 @@ def index():
     # Always redirect to loading - JavaScript will handle showing it only once
     return redirect(url_for('loading'))
 
+def load_gallery():
+    """Fetch the newest local generations from the database (None if unavailable)"""
+    connection = get_db_connection()
+    if not connection:
+        return None
+    try:
+        # Optimized query - only fetch valid images
+        with DB_QUERY_SECONDS.time('gallery'):
+            cursor = connection.prepared(GALLERY_QUERY, dictionary=True)
+            cursor.execute(GALLERY_QUERY)
+            return cursor.fetchall()
+    except Exception as e:
+        logger.error("Error fetching generations", extra={'error': str(e)})
+        return None
+    finally:
+        try:
+            connection.close()
+        except:
+            pass
+
 @app.route('/home')
 def home():
     """Render the main page and fetch recent generations for gallery"""
-    # Check if user should see loading (via JavaScript)
-    connection = get_db_connection()
-    recent_generations = []
+    # Served from the in-process gallery cache; the database is only hit on a miss
+    recent_generations, gallery_version = gallery_cache.snapshot(load_gallery)
+    # Everything else on the page comes from the asset manifest and the catalog
+    shell_key = (asset_manifest.version, tuple(character_catalog.categories()))
+    
+    def render():
+        shell = page_cache.get(('home-shell', shell_key), lambda: render_template(
+            'index.html', gallery_html=Markup(GALLERY_SLOT)).encode('utf-8'))
+        # A saved generation changes gallery_version, so the fragment is rendered again
+        fragment = page_cache.get(('gallery', gallery_version), lambda: render_template(
+            '_gallery.html', recent_generations=recent_generations).encode('utf-8'))
+        head, tail = shell.body.split(GALLERY_SLOT.encode('utf-8'), 1)
+        return head + fragment.body + tail
+    
+    return page_response(page_cache.get(('home', shell_key, gallery_version), render))
+
+@app.route('/api/generations', methods=['GET'])
+@limiter.limit("60 per minute")
+def list_generations():
+    """Page through older gallery images with keyset pagination (?before_id=&limit=)"""
+    before_id = request.args.get('before_id', type=int)
+    limit = min(max(request.args.get('limit', GALLERY_SIZE, type=int), 1), 50)
     
-    if connection:
+    if before_id is None and limit <= GALLERY_SIZE:
+        rows = gallery_cache.get(load_gallery)[:limit]
+    else:
+        connection = get_db_connection()
+        if not connection:
+            return jsonify({
+                'success': False,
+                'error': 'قاعدة البيانات غير متاحة حالياً'
+            }), 503
         try:
-            cursor = connection.cursor(dictionary=True)
-            # Optimized query - only fetch valid images
-            query = """
-                SELECT id, prompt, image_url, created_at 
-                FROM generations 
-                WHERE image_url IS NOT NULL AND image_url != '' AND image_url NOT LIKE 'http://%' AND image_url NOT LIKE 'https://%'
-                ORDER BY created_at DESC 
-                LIMIT 12
-            """
-            cursor.execute(query)
-            recent_generations = cursor.fetchall()
-            cursor.close()
-        except Exception as e:
-            print(f"Error fetching generations: {e}")
+            with DB_QUERY_SECONDS.time('gallery_page'):
+                cursor = connection.prepared(GALLERY_PAGE_QUERY, dictionary=True)
+                cursor.execute(GALLERY_PAGE_QUERY, (before_id if before_id is not None else 2 ** 31 - 1, limit))
+                rows = cursor.fetchall()
+        except Error as e:
+            logger.error("Error fetching generations page", extra={'error': str(e)})
+            return jsonify({
+                'success': False,
+                'error': 'حدث خطأ في تحميل الصور'
+            }), 500
         finally:
             try:
-                if connection and connection.is_connected():
-                    connection.close()
+                connection.close()
             except:
                 pass
     
-    return render_template('index.html', recent_generations=recent_generations)
+    return jsonify({
+        'success': True,
+        'generations': [
+            {
+                'id': row['id'],
+                'prompt': row['prompt'],
+                'image_url': row['image_url'],
+                'created_at': row['created_at'].isoformat() if row['created_at'] else None
+            }
+            for row in rows
+        ],
+        'next_before_id': rows[-1]['id'] if len(rows) == limit else None
+    })
 
 def sanitize_input(text, max_length=1000):
     """Sanitize user input to prevent XSS and SQL Injection"""
-    if not text:
-        return ""
-    
-    # Remove null bytes
-    text = text.replace('\x00', '')
-    
-    # Limit length
-    if len(text) > max_length:
-        text = text[:max_length]
-    
-    # Remove potentially dangerous characters
-    text = re.sub(r'[<>"\']', '', text)
-    
-    # Escape HTML
-    text = html.escape(text)
-    
-    return text.strip()
+    return sanitize(text, max_length=max_length)
 
 def validate_prompt(prompt):
     """Validate prompt input"""
-    if not prompt or len(prompt.strip()) == 0:
-        return False, "الرجاء إدخال نص الوصف"
-    
-    if len(prompt) > 1000:
-        return False, "النص طويل جداً (الحد الأقصى 1000 حرف)"
-    
-    # Check for SQL injection patterns
-    sql_patterns = [
-        r'(\b(SELECT|INSERT|UPDATE|DELETE|DROP|CREATE|ALTER|EXEC|EXECUTE|UNION|SCRIPT)\b)',
-        r'(\b(OR|AND)\s+\d+\s*=\s*\d+)',
-        r'(\'|\"|;|--|\/\*|\*\/)',
-    ]
+    result = prompt_validator.check(prompt)
+    if not result.valid:
+        if result.hits:
+            hit = result.hits[0]
+            logger.info("Rejected prompt", extra={'rule': hit.rule, 'at': hit.start})
+        return False, result.error
+    return True, None
+
+def saved_generation_keys(connection, records):
+    """(prompt_hash, image_url) pairs of these records that are already in the table"""
+    hashes = sorted({r['prompt_hash'] for r in records if r.get('prompt_hash')})
+    if not hashes:
+        return set()
+    query = EXISTING_GENERATIONS_QUERY.format(hashes=', '.join(['%s'] * len(hashes)))
+    cursor = connection.cursor()
+    try:
+        cursor.execute(query, hashes)
+        return {(row[0], row[1]) for row in cursor.fetchall()}
+    finally:
+        cursor.close()
+
+def write_generations(records):
+    """Write-behind flush: insert a batch of generation records with one multi-row INSERT"""
+    connection = get_db_connection()
+    if not connection:
+        # The buffer keeps the records and retries
+        raise Error(msg='database unavailable')
+    try:
+        if any(r.get('replayed') for r in records):
+            # Replayed after a crash - some may have been committed just before it
+            saved = saved_generation_keys(connection, records)
+            records = [r for r in records
+                       if not r.get('replayed') or (r.get('prompt_hash'), r['image_url']) not in saved]
+            if not records:
+                return
+        rows = [(r['prompt'], r['image_url'], r.get('prompt_hash'), datetime.fromtimestamp(r['created_at']))
+                for r in records]
+        query = INSERT_GENERATIONS_QUERY.format(rows=', '.join(['(%s, %s, %s, %s)'] * len(rows)))
+        with DB_QUERY_SECONDS.time('insert_generations'):
+            cursor = connection.cursor()
+            cursor.execute(query, [value for row in rows for value in row])
+            connection.commit()
+        cursor.close()
+    finally:
+        connection.close()
+
+    # The ids of a multi-row INSERT are not guaranteed to be consecutive
+    # (innodb_autoinc_lock_mode=2), so reload the gallery instead of guessing them
+    if any(is_local_image(image_url) for _, image_url, _, _ in rows):
+        gallery_cache.invalidate()
+
+def is_rejected_generation(error):
+    """MySQL refused the rows themselves (bad value, constraint) - retrying the same batch cannot succeed"""
+    return isinstance(error, (DataError, IntegrityError))
+
+# Generation rows are written in batches off the request path; anything not yet
+# written is kept in an append-only spill file and replayed after a restart
+generation_writer = WriteBehindBuffer(
+    write_generations,
+    os.getenv('GENERATION_SPILL_DIR') or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'spill'),
+    name='generations',
+    batch_size=int(os.getenv('GENERATION_BATCH_SIZE', '100')),
+    flush_interval=float(os.getenv('GENERATION_FLUSH_INTERVAL', '1')),
+    retry_interval=int(os.getenv('DB_RETRY_INTERVAL', '5')),
+    fsync=os.getenv('GENERATION_SPILL_FSYNC', '0') == '1',
+    permanent=is_rejected_generation
+)
+
+@app.before_request
+def start_generation_writer():
+    """Replay rows spilled by a previous process and start flushing (after gunicorn has forked)"""
+    generation_writer.start()
+
+def save_generation(prompt, image_url, prompt_hash=None):
+    """Queue a generation row for the write-behind buffer; returns a warning if it could not be kept"""
+    try:
+        generation_writer.submit({
+            'prompt': prompt,
+            # Ensure image_url is safe
+            'image_url': sanitize_input(image_url, max_length=500),
+            'prompt_hash': prompt_hash,
+            'created_at': time.time()
+        })
+    except OSError as e:
+        logger.error("Error spilling generation", extra={'error': str(e)})
+        # حتى لو فشل الحفظ، نرجع الصورة
+        return 'تم توليد الصورة لكن فشل حفظها في قاعدة البيانات'
+    return None
+
+def find_generation(prompt_hash):
+    """Existing generation for a prompt hash as (generation_id, image_url), or None"""
+    connection = get_db_connection()
+    if not connection:
+        return None
+    try:
+        with DB_QUERY_SECONDS.time('find_generation'):
+            cursor = connection.prepared(FIND_GENERATION_QUERY)
+            cursor.execute(FIND_GENERATION_QUERY, (prompt_hash,))
+            # Read the result to the end - a pending result fails the ping when the connection is returned
+            rows = cursor.fetchall()
+        return (rows[0][0], rows[0][1]) if rows else None
+    except Error as e:
+        logger.error("Error looking up generation", extra={'error': str(e)})
+        return None
+    finally:
+        try:
+            connection.close()
+        except:
+            pass
+
+# Generated images copied into a content-addressed store and served from /media/<key>
+MEDIA_URL_PREFIX = '/media/'
+IMAGE_STORE_DIR = os.getenv('IMAGE_STORE_DIR') or \
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'media')
+image_store = ImageStore(
+    IMAGE_STORE_DIR,
+    max_bytes=int(os.getenv('IMAGE_STORE_MAX_BYTES', str(2 << 30))),
+    max_file_bytes=int(os.getenv('IMAGE_STORE_MAX_FILE_BYTES', str(20 << 20))),
+    collect_interval=int(os.getenv('IMAGE_STORE_GC_INTERVAL', '3600'))
+)
+IMAGE_STORE_GC_GRACE = int(os.getenv('IMAGE_STORE_GC_GRACE', '3600'))
+# Responsive derivatives of stored images share the cache of the static ones (both keyed by content hash)
+media_pipeline = ImagePipeline(IMAGE_STORE_DIR, IMAGE_DERIVATIVE_DIR, locate=image_store.path)
+IMAGE_DOWNLOAD_TIMEOUT = float(os.getenv('IMAGE_DOWNLOAD_TIMEOUT', '30'))
+# Internal nginx location that maps to IMAGE_STORE_DIR (e.g. /_media/); empty = Flask sends the file
+IMAGE_STORE_ACCEL_PREFIX = os.getenv('IMAGE_STORE_ACCEL_PREFIX', '')
+
+MEDIA_URLS_QUERY = """
+    SELECT id, image_url 
+    FROM generations 
+    WHERE id > %s AND image_url LIKE %s 
+    ORDER BY id 
+    LIMIT %s
+"""
+IMAGE_PROMPT_HASHES_QUERY = """
+    SELECT DISTINCT prompt_hash 
+    FROM generations 
+    WHERE image_url IN ({urls}) AND prompt_hash IS NOT NULL
+"""
+FORGET_IMAGES_QUERY = """
+    UPDATE generations 
+    SET image_url = '' 
+    WHERE image_url IN ({urls})
+"""
+
+def store_generated_image(image, timeout=None):
+    """
+    URL to save for what call_ai_image_api returned.
+
+    Image bytes and images at a provider URL are copied into the image store;
+    if the download fails the provider URL is kept. Local paths are kept as is.
+    timeout caps the download below IMAGE_DOWNLOAD_TIMEOUT.
+    """
+    if isinstance(image, (bytes, bytearray)):
+        key = image_store.put_bytes(image)
+    elif image.startswith(('http://', 'https://')):
+        if IMAGE_GENERATION_SETTINGS['provider'] == 'placeholder':
+            # Not a generated image - nothing worth keeping
+            return image
+        try:
+            download_timeout = IMAGE_DOWNLOAD_TIMEOUT if timeout is None else min(IMAGE_DOWNLOAD_TIMEOUT, timeout)
+            with requests.get(image, stream=True, timeout=download_timeout) as response:
+                response.raise_for_status()
+                key = image_store.put(response.iter_content(64 * 1024))
+        except (requests.RequestException, OSError, ValueError) as e:
+            logger.warning("Could not store generated image", extra={'image_url': image, 'error': str(e)})
+            return image
+    else:
+        # تنظيف المسار من الـ double slashes
+        return re.sub(r'/{2,}', '/', image)
+    if image_store.collect_due():
+        threading.Thread(target=collect_images, name='image-gc', daemon=True).start()
+    return MEDIA_URL_PREFIX + key
+
+@app.route('/media/<key>')
+@limiter.exempt  # static files, like /static
+def media(key):
+    """Stored generated image: immutable, with conditional and Range requests"""
+    path = image_store.path(key)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+    if IMAGE_STORE_ACCEL_PREFIX:
+        # nginx serves the file itself (sendfile, Range) from its internal location
+        response = app.response_class(mimetype=image_store.mimetype(key))
+        response.headers['X-Accel-Redirect'] = IMAGE_STORE_ACCEL_PREFIX + os.path.relpath(path, IMAGE_STORE_DIR).replace(os.sep, '/')
+    else:
+        # Full responses go out through wsgi.file_wrapper (sendfile(2) under gunicorn)
+        response = send_file(path, mimetype=image_store.mimetype(key), conditional=True, etag=key.split('.')[0])
+    response.headers['Cache-Control'] = f"public, max-age={ASSET_MAX_AGE}, immutable"
+    return response
+
+@app.route('/media/<int:width>/<fmt>/<key>')
+@limiter.exempt  # static files, like /static
+def media_derivative(width, fmt, key):
+    """Resized/re-encoded stored image; immutable like the original"""
+    try:
+        path = media_pipeline.derivative(key, width, fmt)
+    except (OSError, ValueError) as e:
+        logger.warning("Image derivative failed", extra={'image': key, 'error': str(e)})
+        path = None
+    if path is None:
+        abort(404)
+    response = send_file(path, mimetype=IMAGE_FORMATS[fmt][1], conditional=True)
+    response.headers['Cache-Control'] = f"public, max-age={ASSET_MAX_AGE}, immutable"
+    return response
+
+def referenced_media_keys(batch_size=5000):
+    """Store keys referenced by generations rows, or None if the database is unavailable"""
+    connection = get_db_connection()
+    if not connection:
+        return None
+    keys = set()
+    last_id = 0
+    try:
+        cursor = connection.prepared(MEDIA_URLS_QUERY)
+        while True:
+            cursor.execute(MEDIA_URLS_QUERY, (last_id, MEDIA_URL_PREFIX + '%', batch_size))
+            rows = cursor.fetchall()
+            for row_id, image_url in rows:
+                keys.add(image_url[len(MEDIA_URL_PREFIX):])
+                last_id = row_id
+            if len(rows) < batch_size:
+                return keys
+    except Error as e:
+        logger.error("Error reading generation images", extra={'error': str(e)})
+        return None
+    finally:
+        connection.close()
+
+def forget_images(keys):
+    """Clear image_url on rows whose stored image is gone (hidden from the gallery, regenerated on request)"""
+    keys = sorted(keys)
+    connection = get_db_connection()
+    if not connection:
+        return False
+    prompt_hashes = set()
+    try:
+        cursor = connection.cursor()
+        for i in range(0, len(keys), 500):
+            urls = [MEDIA_URL_PREFIX + key for key in keys[i:i + 500]]
+            placeholders = ', '.join(['%s'] * len(urls))
+            cursor.execute(IMAGE_PROMPT_HASHES_QUERY.format(urls=placeholders), urls)
+            prompt_hashes.update(row[0] for row in cursor.fetchall())
+            cursor.execute(FORGET_IMAGES_QUERY.format(urls=placeholders), urls)
+        connection.commit()
+        cursor.close()
+    except Error as e:
+        logger.error("Error clearing evicted images", extra={'error': str(e)})
+        return False
+    finally:
+        connection.close()
+    # Cached results are keyed on the same prompt hash - do not hand out the old URL
+    for prompt_hash in prompt_hashes:
+        image_result_cache.delete(prompt_hash)
+    gallery_cache.invalidate()
+    return True
+
+def collect_images():
+    """Reconcile the image store with the generations table; returns the summary or None if skipped"""
+    referenced = referenced_media_keys()
+    if referenced is None:
+        logger.warning("Image store collection skipped - database unavailable")
+        return None
+    summary = image_store.collect(referenced, grace=IMAGE_STORE_GC_GRACE)
+    if summary is None:
+        return None
+    # Rows whose file was evicted now, or went missing earlier
+    missing = {key for key in referenced if not os.path.isfile(image_store.path(key) or '')}
+    if missing:
+        forget_images(missing)
+    summary['forgotten'] = len(missing)
+    logger.info("Image store collected", extra={k: v for k, v in summary.items() if k != 'evicted'})
+    return summary
+
+@app.cli.command('gc-images')
+def gc_images_command():
+    """Delete unreferenced stored images and enforce IMAGE_STORE_MAX_BYTES"""
+    summary = collect_images()
+    if summary is None:
+        click.echo("Skipped: database unavailable or another process is collecting")
+        return
+    click.echo(f"{summary['files']} images, {summary['bytes']} B kept; {summary['orphans']} orphans and "
+               f"{len(summary['evicted'])} evicted ({summary['freed']} B freed); {summary['forgotten']} rows cleared")
+
+def generate_image(prompt, prompt_hash, timeout=None):
+    """Generate (or reuse from the database) the image for a prompt and save it within timeout seconds"""
+    pending = generation_writer.find('prompt_hash', prompt_hash)
+    if pending:
+        # Saved but not flushed yet - no id until it is
+        return {
+            'image_url': pending['image_url'],
+            'generation_id': None,
+            'prompt': prompt
+        }
+    existing = find_generation(prompt_hash)
+    if existing:
+        generation_id, image_url = existing
+        return {
+            'image_url': image_url,
+            'generation_id': generation_id,
+            'prompt': prompt
+        }
     
-    for pattern in sql_patterns:
-        if re.search(pattern, prompt, re.IGNORECASE):
-            return False, "النص المدخل غير صالح"
+    # Call AI image generation API
+    logger.info("Generating image", extra={'prompt_hash': prompt_hash, 'prompt_length': len(prompt)})
+    started = time.perf_counter()
+    outcome = 'error'
+    try:
+        image = call_ai_image_api(prompt, timeout=timeout)
+        
+        # التأكد من أن URL صحيح (يقبل المسارات المحلية والمسارات الخارجية)
+        if not image:
+            raise ValueError("لم يتم إرجاع URL للصورة")
+        
+        # The image exists now - keep it even if the job runs out of time while copying it
+        remaining = None if timeout is None else max(1.0, timeout - (time.perf_counter() - started))
+        image_url = store_generated_image(image, timeout=remaining)
+        logger.info("Generated image", extra={'prompt_hash': prompt_hash, 'image_url': image_url,
+                                              'duration_ms': round((time.perf_counter() - started) * 1000, 1)})
+        outcome = 'ok'
+            
+    except Exception as api_error:
+        logger.error("Image generation API error", extra={'prompt_hash': prompt_hash, 'error': str(api_error)})
+        error_message = str(api_error)
+        
+        # معالجة Rate Limit بشكل خاص
+        if "تم تجاوز الحد" in error_message or "rate limit" in error_message.lower():
+            raise JobError(error_message, error_type='rate_limit')
+        raise JobError(error_message, error_type='api_error')
+    finally:
+        IMAGE_GENERATION_SECONDS.observe(time.perf_counter() - started, outcome)
     
-    return True, None
+    warning = save_generation(prompt, image_url, prompt_hash)
+    result = {
+        'image_url': image_url,
+        # Assigned when the write-behind buffer flushes the row
+        'generation_id': None,
+        'prompt': prompt
+    }
+    if warning:
+        result['warning'] = warning
+    return result
+
+def run_generation_job(job):
+    """
+    Job runner: serve identical prompts from the result cache.
+
+    Concurrent jobs for the same normalized prompt share one in-flight
+    generation, which completes (and is saved) even if one of them is cancelled.
+    """
+    job.check()
+    prompt_hash = prompt_key(job.prompt, IMAGE_GENERATION_SETTINGS)
+    result = image_result_cache.get_or_load(
+        prompt_hash, lambda: generate_image(job.prompt, prompt_hash, timeout=job.remaining()))
+    return {**result, 'prompt': job.prompt}
+
+# Image generation queue - /generate returns a job id immediately
+# sqlite by default: with several gunicorn workers a status poll can reach any of them
+JOB_QUEUE_BACKEND = os.getenv('JOB_QUEUE_BACKEND', 'sqlite').lower()
+
+def create_job_store():
+    """Job store for JOB_QUEUE_BACKEND (sqlite, mysql or memory)"""
+    if JOB_QUEUE_BACKEND == 'memory':
+        return MemoryJobStore()
+    if JOB_QUEUE_BACKEND == 'mysql':
+        return MySQLJobStore(get_db_connection)
+    return SQLiteJobStore(os.getenv('JOB_QUEUE_DB') or
+                          os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'jobs.sqlite3'))
+
+job_queue = JobQueue(
+    run_generation_job,
+    store=create_job_store(),
+    workers=int(os.getenv('JOB_WORKERS', '2')),
+    max_queued=int(os.getenv('JOB_QUEUE_MAX', '100')),
+    default_timeout=float(os.getenv('JOB_TIMEOUT', '120'))
+)
 
 @app.route('/generate', methods=['POST'])
 @limiter.limit("10 per minute")  # Rate limiting: 10 requests per minute
 def generate():
-    """Handle image generation request"""
+    """Queue an image generation request and return its job id"""
     try:
         data = request.get_json()
         if not data:
@@ -252,95 +953,153 @@ def generate():
         # Sanitize prompt
         prompt = sanitize_input(prompt, max_length=1000)
         
-            # Call AI image generation API
-        print(f"Generating image for prompt: {prompt}")
+        # Priority 0 (lowest) - 9 (highest)
         try:
-            image_url = call_ai_image_api(prompt)
-            print(f"Generated image URL: {image_url}")
-            
-            # التأكد من أن URL صحيح (يقبل المسارات المحلية والمسارات الخارجية)
-            if not image_url:
-                raise ValueError("لم يتم إرجاع URL للصورة")
-            
-            # تنظيف المسار من الـ double slashes
-            image_url = image_url.replace('//', '/')
-                
-        except Exception as api_error:
-            print(f"API Error: {api_error}")
-            error_message = str(api_error)
-            
-            # معالجة Rate Limit بشكل خاص
-            if "تم تجاوز الحد" in error_message or "rate limit" in error_message.lower():
-                return jsonify({
-                    'success': False,
-                    'error': error_message,
-                    'error_type': 'rate_limit'
-                }), 429
-            else:
-                return jsonify({
-                    'success': False,
-                    'error': error_message,
-                    'error_type': 'api_error'
-                }), 500
-        
-        # Save to database
-        connection = get_db_connection()
-        if not connection:
-            # حتى لو قاعدة البيانات فشلت، نرجع الصورة
-            return jsonify({
-                'success': True,
-                'image_url': image_url,
-                'generation_id': None,
-                'prompt': prompt,
-                'warning': 'تم توليد الصورة لكن فشل حفظها في قاعدة البيانات'
-            })
+            priority = min(max(int(data.get('priority', 5)), 0), 9)
+        except (TypeError, ValueError):
+            priority = 5
         
         try:
-            cursor = connection.cursor()
-            # Use parameterized query to prevent SQL Injection
-            insert_query = """
-                INSERT INTO generations (prompt, image_url) 
-                VALUES (%s, %s)
-            """
-            # Ensure image_url is safe
-            safe_image_url = sanitize_input(image_url, max_length=500)
-            cursor.execute(insert_query, (prompt, safe_image_url))
-            connection.commit()
-            generation_id = cursor.lastrowid
-            cursor.close()
-            
-            return jsonify({
-                'success': True,
-                'image_url': image_url,
-                'generation_id': generation_id,
-                'prompt': prompt
-            })
-        except Error as e:
-            print(f"Error saving to database: {e}")
-            # حتى لو قاعدة البيانات فشلت، نرجع الصورة
+            job = job_queue.submit(prompt, priority=priority)
+        except QueueFullError:
             return jsonify({
-                'success': True,
-                'image_url': image_url,
-                'generation_id': None,
-                'prompt': prompt,
-                'warning': 'تم توليد الصورة لكن فشل حفظها في قاعدة البيانات'
-            })
-        finally:
-            try:
-                if connection and connection.is_connected():
-                    connection.close()
-            except:
-                pass
+                'success': False,
+                'error': 'الخادم مشغول حالياً، حاول مرة أخرى بعد قليل',
+                'error_type': 'queue_full'
+            }), 503
+        
+        return jsonify({
+            'success': True,
+            'job_id': job.id,
+            'status': job.status,
+            'prompt': prompt,
+            'status_url': url_for('get_job', job_id=job.id),
+            'events_url': url_for('job_events', job_id=job.id)
+        }), 202
             
     except Exception as e:
-        print(f"Error in generate route: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Error in generate route")
         return jsonify({
             'success': False,
             'error': f'حدث خطأ غير متوقع: {str(e)}'
         }), 500
 
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """Poll the status (and result) of a generation job"""
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({'success': False, 'error': 'المهمة غير موجودة'}), 404
+    return jsonify({'success': True, **job.to_dict()})
+
+@app.route('/api/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    """Cancel a queued or running generation job"""
+    job = job_queue.cancel(job_id)
+    if job is None:
+        return jsonify({'success': False, 'error': 'المهمة غير موجودة'}), 404
+    return jsonify({'success': True, **job.to_dict()})
+
+@app.route('/api/jobs/<job_id>/events', methods=['GET'])
+def job_events(job_id):
+    """Server-Sent Events stream of a job's status until it finishes"""
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({'success': False, 'error': 'المهمة غير موجودة'}), 404
+    
+    def stream():
+        last = None
+        deadline = time.monotonic() + job_queue.default_timeout + 30
+        heartbeat = time.monotonic()
+        while time.monotonic() < deadline:
+            current = job_queue.get(job_id)
+            if current is None:
+                break
+            state = (current.status, current.version)
+            if state != last:
+                last = state
+                payload = json.dumps(current.to_dict(), ensure_ascii=False)
+                yield f"event: {current.status}\ndata: {payload}\n\n"
+                if current.done:
+                    break
+            elif time.monotonic() - heartbeat > 15:
+                heartbeat = time.monotonic()
+                yield ": keep-alive\n\n"
+            job_queue.wait(1.0)
+    
+    return app.response_class(stream(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+# Prayer times source:
+#   local      - in-process solar calculation (default, no network)
+#   aladhan    - remote api.aladhan.com, one call per date
+#   crosscheck - serve local times, verify them against aladhan and log differences
+PRAYER_TIMES_SOURCE = os.getenv('PRAYER_TIMES_SOURCE', 'local').lower()
+
+# Long-lived aladhan client (keep-alive pool + retries) and worker pool shared by all requests
+aladhan_client = AladhanClient(
+    timeout=float(os.getenv('ALADHAN_TIMEOUT', '4')),
+    pool_size=int(os.getenv('ALADHAN_POOL_SIZE', '20')),
+    retries=int(os.getenv('ALADHAN_RETRIES', '2')),
+    concurrency=int(os.getenv('ALADHAN_CONCURRENCY', '32'))
+)
+upstream_executor = concurrent.futures.ThreadPoolExecutor(
+    max_workers=int(os.getenv('ALADHAN_WORKERS', '25')),
+    thread_name_prefix='aladhan'
+)
+
+# calendar - one /v1/calendar call per country and month (default)
+# daily    - one /v1/timings call per country and date
+ALADHAN_FETCH_MODE = os.getenv('ALADHAN_FETCH_MODE', 'calendar').lower()
+
+# Precomputed timetable artifacts (built by `flask --app app build-timetable`)
+TIMETABLE_DIR = os.getenv('TIMETABLE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data'))
+TIMETABLE_MAX_AGE = int(os.getenv('TIMETABLE_MAX_AGE', '3600'))
+timetable_cache = TTLCache(max_size=8, name='timetable')
+timetable_response_cache = TTLCache(max_size=64, ttl=24 * 3600, name='timetable_responses')
+
+# Background prefetch of upstream times ahead of the pre-iftar peak (on by default with aladhan)
+PREFETCH_ENABLED = (os.getenv('PREFETCH_ENABLED') or ('1' if PRAYER_TIMES_SOURCE == 'aladhan' else '0')) == '1'
+
+# Cache for upstream Maghrib lookups - values for a (lat, lng, date, method) never change.
+# Set PRAYER_CACHE_DB to a file path to share the cache between workers and survive restarts
+# (the prefetch scheduler needs it so every worker sees what the leader fetched).
+PRAYER_CACHE_DB = os.getenv('PRAYER_CACHE_DB') or (os.path.join(TIMETABLE_DIR, 'prayer_cache.db') if PREFETCH_ENABLED else '')
+prayer_cache = TTLCache(
+    max_size=int(os.getenv('PRAYER_CACHE_SIZE', '10000')),
+    ttl=int(os.getenv('PRAYER_CACHE_TTL', str(30 * 24 * 3600))),
+    store=SQLiteStore(PRAYER_CACHE_DB, table='prayer_times') if PRAYER_CACHE_DB else None,
+    name='prayer_times'
+)
+
+# Arab countries with their coordinates (latitude, longitude) and IANA timezone
+ARAB_COUNTRIES = {
+    'مصر': {'lat': 30.0444, 'lng': 31.2357, 'city': 'Cairo', 'tz': 'Africa/Cairo'},
+    'السعودية': {'lat': 24.7136, 'lng': 46.6753, 'city': 'Riyadh', 'tz': 'Asia/Riyadh'},
+    'الإمارات': {'lat': 24.4539, 'lng': 54.3773, 'city': 'Abu Dhabi', 'tz': 'Asia/Dubai'},
+    'الكويت': {'lat': 29.3759, 'lng': 47.9774, 'city': 'Kuwait City', 'tz': 'Asia/Kuwait'},
+    'قطر': {'lat': 25.2854, 'lng': 51.5310, 'city': 'Doha', 'tz': 'Asia/Qatar'},
+    'البحرين': {'lat': 26.0667, 'lng': 50.5577, 'city': 'Manama', 'tz': 'Asia/Bahrain'},
+    'عمان': {'lat': 23.5859, 'lng': 58.4059, 'city': 'Muscat', 'tz': 'Asia/Muscat'},
+    'اليمن': {'lat': 15.3694, 'lng': 44.1910, 'city': 'Sanaa', 'tz': 'Asia/Aden'},
+    'الأردن': {'lat': 31.9539, 'lng': 35.9106, 'city': 'Amman', 'tz': 'Asia/Amman'},
+    'لبنان': {'lat': 33.8938, 'lng': 35.5018, 'city': 'Beirut', 'tz': 'Asia/Beirut'},
+    'سوريا': {'lat': 33.5138, 'lng': 36.2765, 'city': 'Damascus', 'tz': 'Asia/Damascus'},
+    'العراق': {'lat': 33.3152, 'lng': 44.3661, 'city': 'Baghdad', 'tz': 'Asia/Baghdad'},
+    'فلسطين': {'lat': 31.9522, 'lng': 35.2332, 'city': 'Jerusalem', 'tz': 'Asia/Hebron'},
+    'السودان': {'lat': 15.5007, 'lng': 32.5599, 'city': 'Khartoum', 'tz': 'Africa/Khartoum'},
+    'ليبيا': {'lat': 32.8872, 'lng': 13.1913, 'city': 'Tripoli', 'tz': 'Africa/Tripoli'},
+    'تونس': {'lat': 36.8065, 'lng': 10.1815, 'city': 'Tunis', 'tz': 'Africa/Tunis'},
+    'الجزائر': {'lat': 36.7538, 'lng': 3.0588, 'city': 'Algiers', 'tz': 'Africa/Algiers'},
+    'المغرب': {'lat': 33.9716, 'lng': -6.8498, 'city': 'Rabat', 'tz': 'Africa/Casablanca'},
+    'موريتانيا': {'lat': 18.0735, 'lng': -15.9582, 'city': 'Nouakchott', 'tz': 'Africa/Nouakchott'},
+    'جيبوتي': {'lat': 11.8251, 'lng': 42.5903, 'city': 'Djibouti', 'tz': 'Africa/Djibouti'},
+    'الصومال': {'lat': 2.0469, 'lng': 45.3182, 'city': 'Mogadishu', 'tz': 'Africa/Mogadishu'},
+    'جزر القمر': {'lat': -11.6455, 'lng': 43.3333, 'city': 'Moroni', 'tz': 'Indian/Comoro'}
+}
+
 def convert_to_12_hour(time_24h):
     """Convert 24-hour time format to 12-hour format with AM/PM"""
     if not time_24h or time_24h == '--:--':
@@ -367,219 +1126,619 @@ def convert_to_12_hour(time_24h):
     except:
         return time_24h
 
+def fetch_maghrib_remote(coords, date_str):
+    """Fetch Maghrib for one location/date from api.aladhan.com as 24-hour 'HH:MM' (or None), cached"""
+    key = TTLCache.make_key(coords['lat'], coords['lng'], date_str, prayer_times.METHOD, prayer_times.SCHOOL)
+    return prayer_cache.get_or_load(key, lambda: _fetch_maghrib_aladhan(coords, date_str))
+
+def _fetch_maghrib_aladhan(coords, date_str):
+    """Single uncached call to api.aladhan.com"""
+    return aladhan_client.maghrib(coords['lat'], coords['lng'], date_str)
+
+def fetch_maghrib_batch(pairs):
+    """
+    Fetch Maghrib for many (coords, date_str) pairs, issuing all cache misses
+    concurrently through the async client. Returns {(lat, lng, date_str): 'HH:MM' or None}.
+    """
+    results = {}
+    missing = []
+    for coords, date_str in pairs:
+        key = TTLCache.make_key(coords['lat'], coords['lng'], date_str, prayer_times.METHOD, prayer_times.SCHOOL)
+        value = prayer_cache.get(key)
+        if value is not None:
+            results[(coords['lat'], coords['lng'], date_str)] = value
+        else:
+            missing.append((key, coords['lat'], coords['lng'], date_str))
+    if missing:
+        fetched = aladhan_client.maghrib_many([(lat, lng, d) for _, lat, lng, d in missing])
+        for (key, lat, lng, date_str), value in zip(missing, fetched):
+            if value is not None:
+                prayer_cache.set(key, value)
+            results[(lat, lng, date_str)] = value
+    return results
+
+COUNTRY_FETCH_SECONDS = metrics.histogram('iftar_country_fetch_seconds',
+                                          "Time to collect one country's Maghrib times (cache + upstream)", ('mode',))
+
+def get_prayer_times_for_country(country_name, coords, dates_list):
+    """Get prayer times for a country - one calendar call per month, per-day calls only for gaps"""
+    country_times = {}
+    
+    if not dates_list:
+        return (country_name, country_times)
+    
+    # Each upstream call is also timed by the client (aladhan_request_duration_seconds)
+    with COUNTRY_FETCH_SECONDS.time(ALADHAN_FETCH_MODE):
+        if ALADHAN_FETCH_MODE == 'calendar':
+            maghrib_times = fetch_maghrib_range(coords, dates_list)
+            for date_str in dates_list:
+                maghrib_time = maghrib_times.get(date_str)
+                # Convert to 12-hour format
+                country_times[date_str] = convert_to_12_hour(maghrib_time) if maghrib_time else '--:--'
+            return (country_name, country_times)
+        
+        # Use individual requests for each date
+        for date_str in dates_list:
+            try:
+                maghrib_time = fetch_maghrib_remote(coords, date_str)
+                # Convert to 12-hour format
+                country_times[date_str] = convert_to_12_hour(maghrib_time) if maghrib_time else '--:--'
+            except requests.exceptions.Timeout:
+                # Counted in aladhan_timeouts_total
+                country_times[date_str] = '--:--'
+            except Exception as e:
+                logger.warning("Prayer time fetch failed",
+                               extra={'country': country_name, 'date': date_str, 'error': str(e)[:50]})
+                country_times[date_str] = '--:--'
+    
+    return (country_name, country_times)
+
+def fetch_maghrib_range(coords, dates_list):
+    """
+    Cached Maghrib for many dates of one location. Cache misses are grouped by
+    month and fetched with aladhan's calendar endpoint; results are stored per day.
+    """
+    results = {}
+    missing = []
+    for date_str in dates_list:
+        key = TTLCache.make_key(coords['lat'], coords['lng'], date_str, prayer_times.METHOD, prayer_times.SCHOOL)
+        value = prayer_cache.get(key)
+        if value is not None:
+            results[date_str] = value
+        else:
+            missing.append(date_str)
+    
+    if missing:
+        fetched = aladhan_client.maghrib_range(coords['lat'], coords['lng'], missing)
+        for date_str, value in fetched.items():
+            if value is not None:
+                key = TTLCache.make_key(coords['lat'], coords['lng'], date_str, prayer_times.METHOD, prayer_times.SCHOOL)
+                prayer_cache.set(key, value)
+            results[date_str] = value
+    return results
+
+def prefetch_dates(today=None):
+    """Dates /api/iftar-times will ask upstream for, capped at PREFETCH_DAYS"""
+    today = today or datetime.now().date()
+    ramadan_start, ramadan_end = current_ramadan_window(today)
+    dates, _ = live_fetch_plan(max(today, ramadan_start), ramadan_end)
+    return dates[:PREFETCH_DAYS]
+
+def prefetch_country(country_name, coords):
+    """Warm the shared prayer cache for one country; True when every date is cached"""
+    dates_list = prefetch_dates()
+    if not dates_list:
+        return True
+    if ALADHAN_FETCH_MODE == 'calendar':
+        values = fetch_maghrib_range(coords, dates_list).values()
+    else:
+        values = fetch_maghrib_batch([(coords, date_str) for date_str in dates_list]).values()
+    return all(value is not None for value in values)
+
+PREFETCH_DAYS = int(os.getenv('PREFETCH_DAYS', '30'))
+prefetch_scheduler = PrefetchScheduler(
+    prefetch_country,
+    ARAB_COUNTRIES,
+    lease=SQLiteLease(os.getenv('PREFETCH_LEASE_DB') or os.path.join(TIMETABLE_DIR, 'prefetch.db')),
+    lead_minutes=int(os.getenv('PREFETCH_LEAD_MINUTES', '90')),
+    retry_interval=int(os.getenv('PREFETCH_RETRY_INTERVAL', '300'))
+) if PREFETCH_ENABLED else None
+
+@app.before_request
+def start_prefetch():
+    """Start the prefetch scheduler in this worker (after gunicorn has forked it)"""
+    if prefetch_scheduler is not None:
+        prefetch_scheduler.start()
+
+def crosscheck_prayer_times(countries, dates_list, local_times, tolerance_minutes=1):
+    """Compare locally computed times with aladhan and log any difference above the tolerance"""
+    mismatches = []
+    checked = 0
+    
+    if ALADHAN_FETCH_MODE == 'calendar':
+        remote_times = {}
+        coords_list = list(countries.values())
+        for coords, times in zip(coords_list, upstream_executor.map(
+                lambda c: fetch_maghrib_range(c, dates_list), coords_list)):
+            for date_str, value in times.items():
+                remote_times[(coords['lat'], coords['lng'], date_str)] = value
+    else:
+        pairs = [(countries[name], date_str) for name in countries for date_str in dates_list]
+        remote_times = fetch_maghrib_batch(pairs)
+    
+    for country_name, coords in countries.items():
+        for date_str in dates_list:
+            remote = remote_times.get((coords['lat'], coords['lng'], date_str))
+            if not remote:
+                continue
+            checked += 1
+            local = local_times[country_name].get(date_str)
+            rh, rm = (int(x) for x in remote.split(':'))
+            lh, lm = (int(x) for x in local.split(':'))
+            diff = abs((rh * 60 + rm) - (lh * 60 + lm))
+            if diff > tolerance_minutes:
+                mismatches.append({
+                    'country': country_name,
+                    'date': date_str,
+                    'local': local,
+                    'remote': remote,
+                    'diff_minutes': diff
+                })
+    
+    if mismatches:
+        logger.warning("Prayer times crosscheck mismatches", extra={'mismatches': len(mismatches), 'checked': checked})
+    return {'checked': checked, 'mismatches': mismatches}
+
+def get_ramadan_window(year):
+    """Return (start, end) dates of the first Ramadan that starts in a Gregorian year (Umm al-Qura, memoized)"""
+    return hijri.ramadan_window(year)
+
+def current_ramadan_window(today):
+    """Return (start, end) dates of the Ramadan in progress on today, or the next one"""
+    return hijri.current_ramadan(today)
+
+def get_timetable(year, window=None):
+    """
+    Load the prebuilt timetable for a year, building it in memory if the artifact is missing.
+
+    window is the (start, end) to cover - by default the first Ramadan of the year, which
+    is not the current one in years with two (the second is then built in memory).
+    """
+    ramadan_start, ramadan_end = window or get_ramadan_window(year)
+    def load():
+        table = timetable.load_timetable(TIMETABLE_DIR, year)
+        if table is None or table.start != ramadan_start or table.end != ramadan_end \
+                or len(table.countries) != len(ARAB_COUNTRIES):
+            table = timetable.build_timetable(year, ramadan_start, ramadan_end, ARAB_COUNTRIES)
+        return table
+    return timetable_cache.get_or_load((year, ramadan_start), load)
+
+def render_timetable_slice(table, start, end):
+    """Serialize a timetable slice in the /api/iftar-times format; returns (body, etag)"""
+    def render():
+        date_keys = [d.isoformat() for d in table.slice(start, end)[0]]
+        countries = dict(iter_iftar_times_timetable(table, start, end))
+        payload = {
+            'success': True,
+            'dates': date_keys,
+            'countries': countries,
+            'start_date': start.isoformat(),
+            'end_date': end.isoformat(),
+            'total_days': len(date_keys),
+            'source': PRAYER_TIMES_SOURCE,
+            'version': table.version
+        }
+        body = json.dumps(payload, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        return body, hashlib.sha256(body).hexdigest()[:32]
+    return timetable_response_cache.get_or_load((table.version, start, end), render)
+
+def cacheable_response(body, etag, mimetype, max_age):
+    """Response with a strong ETag that answers If-None-Match with 304"""
+    response = app.response_class(body, mimetype=mimetype)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = f"public, max-age={max_age}"
+    return response.make_conditional(request)
+
 @app.route('/api/iftar-times', methods=['GET'])
 @limiter.limit("30 per minute")  # Rate limiting: 30 requests per minute
 def get_iftar_times():
     """Get Iftar times (Maghrib prayer) for all Arab countries from today until end of Ramadan"""
-    from datetime import timedelta
-    import calendar
-    
     try:
-        # Calculate Ramadan dates for current year
+        # Current Ramadan, or the next one between Ramadans
         today = datetime.now()
-        current_year = today.year
-        
-        # Ramadan 2025: March 1 - March 30 (adjust based on actual Islamic calendar)
-        # Ramadan 2026: February 18 - March 19
-        # We'll calculate based on year
-        ramadan_dates = {
-            2025: {'start': (3, 1), 'end': (3, 30)},
-            2026: {'start': (2, 18), 'end': (3, 19)},
-            2027: {'start': (2, 7), 'end': (3, 8)},
-            2024: {'start': (3, 11), 'end': (4, 9)}
-        }
-        
-        # Get Ramadan dates for current year, default to 2025 if not found
-        if current_year in ramadan_dates:
-            ramadan_info = ramadan_dates[current_year]
-            ramadan_start = datetime(current_year, ramadan_info['start'][0], ramadan_info['start'][1])
-            ramadan_end = datetime(current_year, ramadan_info['end'][0], ramadan_info['end'][1])
-        else:
-            # Default to March 1-30 for unknown years
-            ramadan_start = datetime(current_year, 3, 1)
-            ramadan_end = datetime(current_year, 3, 30)
+        ramadan_start, ramadan_end = current_ramadan_window(today.date())
         
         # If today is before Ramadan, use Ramadan start
-        if today.date() < ramadan_start.date():
-            start_date = ramadan_start
-        else:
-            start_date = today
-        
-        # If today is after Ramadan, use Ramadan end
-        if today.date() > ramadan_end.date():
-            end_date = ramadan_end
-        else:
-            end_date = ramadan_end
-        
-        # Arab countries with their coordinates (latitude, longitude)
-        arab_countries = {
-            'مصر': {'lat': 30.0444, 'lng': 31.2357, 'city': 'Cairo'},
-            'السعودية': {'lat': 24.7136, 'lng': 46.6753, 'city': 'Riyadh'},
-            'الإمارات': {'lat': 24.4539, 'lng': 54.3773, 'city': 'Abu Dhabi'},
-            'الكويت': {'lat': 29.3759, 'lng': 47.9774, 'city': 'Kuwait City'},
-            'قطر': {'lat': 25.2854, 'lng': 51.5310, 'city': 'Doha'},
-            'البحرين': {'lat': 26.0667, 'lng': 50.5577, 'city': 'Manama'},
-            'عمان': {'lat': 23.5859, 'lng': 58.4059, 'city': 'Muscat'},
-            'اليمن': {'lat': 15.3694, 'lng': 44.1910, 'city': 'Sanaa'},
-            'الأردن': {'lat': 31.9539, 'lng': 35.9106, 'city': 'Amman'},
-            'لبنان': {'lat': 33.8938, 'lng': 35.5018, 'city': 'Beirut'},
-            'سوريا': {'lat': 33.5138, 'lng': 36.2765, 'city': 'Damascus'},
-            'العراق': {'lat': 33.3152, 'lng': 44.3661, 'city': 'Baghdad'},
-            'فلسطين': {'lat': 31.9522, 'lng': 35.2332, 'city': 'Jerusalem'},
-            'السودان': {'lat': 15.5007, 'lng': 32.5599, 'city': 'Khartoum'},
-            'ليبيا': {'lat': 32.8872, 'lng': 13.1913, 'city': 'Tripoli'},
-            'تونس': {'lat': 36.8065, 'lng': 10.1815, 'city': 'Tunis'},
-            'الجزائر': {'lat': 36.7538, 'lng': 3.0588, 'city': 'Algiers'},
-            'المغرب': {'lat': 33.9716, 'lng': -6.8498, 'city': 'Rabat'},
-            'موريتانيا': {'lat': 18.0735, 'lng': -15.9582, 'city': 'Nouakchott'},
-            'جيبوتي': {'lat': 11.8251, 'lng': 42.5903, 'city': 'Djibouti'},
-            'الصومال': {'lat': 2.0469, 'lng': 45.3182, 'city': 'Mogadishu'},
-            'جزر القمر': {'lat': -11.6455, 'lng': 43.3333, 'city': 'Moroni'}
-        }
-        
-        iftar_times = {}
-        current_date = start_date
-        
-        # Generate dates from start to end
-        dates = []
-        while current_date <= end_date:
-            dates.append(current_date.strftime('%Y-%m-%d'))
-            current_date += timedelta(days=1)
-        
-        # Get prayer times for each country and date
-        # Limit dates to 7 days for faster loading
-        max_days = 7
-        dates_to_fetch = dates[:max_days] if len(dates) > max_days else dates
-        
-        # Select most important countries for faster loading
-        important_countries = {
-            'مصر': arab_countries['مصر'],
-            'السعودية': arab_countries['السعودية'],
-            'الإمارات': arab_countries['الإمارات'],
-            'الكويت': arab_countries['الكويت'],
-            'قطر': arab_countries['قطر'],
-            'البحرين': arab_countries['البحرين'],
-            'عمان': arab_countries['عمان'],
-            'الأردن': arab_countries['الأردن'],
-            'لبنان': arab_countries['لبنان'],
-            'سوريا': arab_countries['سوريا'],
-            'العراق': arab_countries['العراق'],
-            'فلسطين': arab_countries['فلسطين'],
-            'السودان': arab_countries['السودان'],
-            'ليبيا': arab_countries['ليبيا'],
-            'تونس': arab_countries['تونس'],
-            'الجزائر': arab_countries['الجزائر'],
-            'المغرب': arab_countries['المغرب']
-        }
-        
-        import concurrent.futures
+        start_date = max(today.date(), ramadan_start)
+        end_date = ramadan_end
         
-        def get_prayer_times_for_country(country_name, coords, dates_list):
-            """Get prayer times for a country - use individual requests for reliability"""
-            country_times = {}
-            
-            if not dates_list:
-                return (country_name, country_times)
-            
-            # Use individual requests for each date (more reliable)
-            for date_str in dates_list:
-                try:
-                    url = f"http://api.aladhan.com/v1/timings/{date_str}"
-                    params = {
-                        'latitude': coords['lat'],
-                        'longitude': coords['lng'],
-                        'method': 4,  # Umm al-Qura, Makkah
-                        'school': 0   # Shafi
-                    }
-                    
-                    response = requests.get(url, params=params, timeout=4)
-                    if response.status_code == 200:
-                        data = response.json()
-                        if 'data' in data and 'timings' in data['data']:
-                            maghrib_time = data['data']['timings'].get('Maghrib', '--:--')
-                            if maghrib_time and maghrib_time != '--:--' and maghrib_time != '':
-                                # Format time (remove +00:00 if present)
-                                maghrib_time = maghrib_time.split(' ')[0].split('+')[0].strip()
-                                # Convert to 12-hour format
-                                if maghrib_time and ':' in maghrib_time:
-                                    maghrib_time_12h = convert_to_12_hour(maghrib_time)
-                                    country_times[date_str] = maghrib_time_12h
-                                else:
-                                    country_times[date_str] = '--:--'
-                            else:
-                                country_times[date_str] = '--:--'
-                        else:
-                            country_times[date_str] = '--:--'
-                    else:
-                        country_times[date_str] = '--:--'
-                except requests.exceptions.Timeout:
-                    country_times[date_str] = '--:--'
-                except Exception as e:
-                    print(f"Error for {country_name} on {date_str}: {str(e)[:50]}")
-                    country_times[date_str] = '--:--'
-            
-            return (country_name, country_times)
+        # Opt-in streaming: ?stream=ndjson or ?stream=sse
+        stream = request.args.get('stream')
+        if stream and stream not in ('ndjson', 'sse'):
+            return jsonify({'success': False, 'error': 'stream must be ndjson or sse'}), 400
         
-        # Use thread pool with more workers for faster parallel requests
-        with concurrent.futures.ThreadPoolExecutor(max_workers=25) as executor:
-            futures = []
-            for country_name, coords in important_countries.items():
-                future = executor.submit(get_prayer_times_for_country, country_name, coords, dates_to_fetch)
-                futures.append(future)
-            
-            # Collect results as they complete
-            for future in concurrent.futures.as_completed(futures):
-                try:
-                    country_name, country_times = future.result()
-                    if country_name and country_times:
-                        iftar_times[country_name] = {
-                            'times': country_times,
-                            'city': important_countries[country_name]['city']
-                        }
-                except Exception as e:
-                    pass  # Skip failed countries
-        
-        # Ensure all countries have entries (even if empty)
-        for country_name in important_countries.keys():
-            if country_name not in iftar_times:
-                iftar_times[country_name] = {
-                    'times': {},
-                    'city': important_countries[country_name]['city']
-                }
-            # Fill missing dates
-            for date_str in dates_to_fetch:
-                if date_str not in iftar_times[country_name]['times']:
-                    iftar_times[country_name]['times'][date_str] = '--:--'
-        
-        # Check if we have any data
-        if not iftar_times:
-            return jsonify({
-                'success': False,
-                'error': 'لم يتم الحصول على أي مواعيد'
-            }), 500
+        if stream:
+            if PRAYER_TIMES_SOURCE == 'aladhan':
+                dates, countries = live_fetch_plan(start_date, end_date)
+                return stream_iftar_times(stream, dates, iter_iftar_times_live(dates, countries),
+                                          start_date, end_date)
+            table = get_timetable(ramadan_start.year, (ramadan_start, ramadan_end))
+            dates = [d.isoformat() for d in table.slice(start_date, end_date)[0]]
+            return stream_iftar_times(stream, dates, iter_iftar_times_timetable(table, start_date, end_date),
+                                      start_date, end_date, version=table.version)
         
-        # Debug: Check if we have times
-        total_times = sum(len(country_data.get('times', {})) for country_data in iftar_times.values())
-        print(f"Total times collected: {total_times} for {len(iftar_times)} countries")
+        if PRAYER_TIMES_SOURCE == 'aladhan':
+            return get_iftar_times_live(start_date, end_date)
         
-        # Return only the dates we fetched
-        return jsonify({
-            'success': True,
-            'dates': dates_to_fetch,
-            'countries': iftar_times,
-            'start_date': start_date.strftime('%Y-%m-%d'),
-            'end_date': end_date.strftime('%Y-%m-%d'),
-            'total_days': len(dates_to_fetch)
-        })
+        # Serve a slice of the precomputed timetable - the body only changes once a day
+        table = get_timetable(ramadan_start.year, (ramadan_start, ramadan_end))
+        body, etag = render_timetable_slice(table, start_date, end_date)
+        return cacheable_response(body, etag, 'application/json', TIMETABLE_MAX_AGE)
         
     except Exception as e:
-        print(f"Error in get_iftar_times: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Error in get_iftar_times")
         return jsonify({
             'success': False,
             'error': str(e)
         }), 500
 
+def live_fetch_plan(start_date, end_date):
+    """Return (dates_to_fetch, countries) for a live aladhan fetch"""
+    current_date = start_date
+    
+    # Generate dates from start to end
+    dates = []
+    while current_date <= end_date:
+        dates.append(current_date.strftime('%Y-%m-%d'))
+        current_date += timedelta(days=1)
+    
+    if ALADHAN_FETCH_MODE == 'calendar':
+        # One or two calendar calls per country cover the whole range
+        return dates, ARAB_COUNTRIES
+    
+    # Get prayer times for each country and date
+    # Limit dates to 7 days for faster loading
+    max_days = 7
+    dates_to_fetch = dates[:max_days] if len(dates) > max_days else dates
+    
+    # Select most important countries for faster loading
+    important_countries = {
+        name: ARAB_COUNTRIES[name]
+        for name in ['مصر', 'السعودية', 'الإمارات', 'الكويت', 'قطر', 'البحرين', 'عمان',
+                     'الأردن', 'لبنان', 'سوريا', 'العراق', 'فلسطين', 'السودان', 'ليبيا',
+                     'تونس', 'الجزائر', 'المغرب']
+    }
+    return dates_to_fetch, important_countries
+
+def iter_iftar_times_live(dates_to_fetch, countries):
+    """
+    Yield (country_name, {'times', 'city'}) as each country's fetch completes.
+
+    Countries whose fetch failed are yielded last with every date set to '--:--'.
+    """
+    # Shared worker pool - the HTTP connections behind it are pooled and kept alive
+    futures = []
+    for country_name, coords in countries.items():
+        future = upstream_executor.submit(get_prayer_times_for_country, country_name, coords, dates_to_fetch)
+        futures.append(future)
+    
+    resolved = set()
+    # Collect results as they complete
+    for future in concurrent.futures.as_completed(futures):
+        try:
+            country_name, country_times = future.result()
+        except Exception as e:
+            continue  # Skip failed countries
+        if not country_name or not country_times:
+            continue
+        # Fill missing dates
+        for date_str in dates_to_fetch:
+            country_times.setdefault(date_str, '--:--')
+        resolved.add(country_name)
+        yield country_name, {'times': country_times, 'city': countries[country_name]['city']}
+    
+    # Ensure all countries have entries (even if empty)
+    for country_name in countries.keys():
+        if country_name not in resolved:
+            yield country_name, {
+                'times': {date_str: '--:--' for date_str in dates_to_fetch},
+                'city': countries[country_name]['city']
+            }
+
+def get_iftar_times_live(start_date, end_date):
+    """Fetch Iftar times from api.aladhan.com (PRAYER_TIMES_SOURCE=aladhan)"""
+    dates_to_fetch, countries = live_fetch_plan(start_date, end_date)
+    iftar_times = dict(iter_iftar_times_live(dates_to_fetch, countries))
+    
+    # Check if we have any data
+    if not iftar_times:
+        return jsonify({
+            'success': False,
+            'error': 'لم يتم الحصول على أي مواعيد'
+        }), 500
+    
+    total_times = sum(len(country_data.get('times', {})) for country_data in iftar_times.values())
+    logger.info("Iftar times collected", extra={'total_times': total_times, 'countries': len(iftar_times)})
+    
+    # Return only the dates we fetched
+    return jsonify({
+        'success': True,
+        'dates': dates_to_fetch,
+        'countries': iftar_times,
+        'start_date': start_date.strftime('%Y-%m-%d'),
+        'end_date': end_date.strftime('%Y-%m-%d'),
+        'total_days': len(dates_to_fetch),
+        'source': PRAYER_TIMES_SOURCE
+    })
+
+def iter_iftar_times_timetable(table, start_date, end_date):
+    """Yield (country_name, {'times', 'city'}) from the precomputed timetable"""
+    dates, rows = table.slice(start_date, end_date)
+    date_keys = [d.isoformat() for d in dates]
+    for name, minutes in rows.items():
+        yield name, {
+            'times': {
+                d: convert_to_12_hour(prayer_times.format_minutes(m))
+                for d, m in zip(date_keys, minutes)
+            },
+            'city': table.country(name)['city']
+        }
+
+def stream_iftar_times(fmt, dates, countries, start_date, end_date, version=None):
+    """
+    Stream Iftar times as NDJSON or Server-Sent Events.
+
+    Records: one 'meta' record with the dates, one 'country' record per country
+    as soon as it is available, then a 'summary' record.
+    """
+    def encode(record):
+        payload = json.dumps(record, ensure_ascii=False, separators=(',', ':'))
+        if fmt == 'sse':
+            return f"event: {record['type']}\ndata: {payload}\n\n"
+        return payload + "\n"
+    
+    def generate():
+        started = time.monotonic()
+        meta = {
+            'type': 'meta',
+            'dates': dates,
+            'start_date': start_date.strftime('%Y-%m-%d'),
+            'end_date': end_date.strftime('%Y-%m-%d'),
+            'total_days': len(dates),
+            'source': PRAYER_TIMES_SOURCE
+        }
+        if version:
+            meta['version'] = version
+        yield encode(meta)
+        
+        count = 0
+        total_times = 0
+        try:
+            for name, entry in countries:
+                count += 1
+                total_times += sum(1 for t in entry['times'].values() if t != '--:--')
+                yield encode({'type': 'country', 'name': name, **entry})
+        except Exception as e:
+            logger.exception("Error streaming iftar times")
+            yield encode({'type': 'summary', 'success': False, 'error': str(e), 'countries': count})
+            return
+        yield encode({
+            'type': 'summary',
+            'success': count > 0,
+            'countries': count,
+            'total_times': total_times,
+            'elapsed_ms': round((time.monotonic() - started) * 1000, 1)
+        })
+    
+    mimetype = 'text/event-stream' if fmt == 'sse' else 'application/x-ndjson'
+    return app.response_class(generate(), mimetype=mimetype, headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+# Columnar query API: /api/iftar-times/query
+QUERY_MAX_DAYS = int(os.getenv('QUERY_MAX_DAYS', '62'))
+QUERY_MAX_CITIES = int(os.getenv('QUERY_MAX_CITIES', '10'))
+query_response_cache = TTLCache(
+    max_size=int(os.getenv('QUERY_CACHE_SIZE', '512')),
+    ttl=24 * 3600,
+    name='query_responses'
+)
+
+def parse_city(value):
+    """Parse 'lat,lng,Area/Zone' into (lat, lng, tz); raises ValueError"""
+    parts = [p.strip() for p in value.split(',')]
+    if len(parts) != 3:
+        raise ValueError(value)
+    # ~11 m precision keeps the number of distinct query shapes bounded
+    lat, lng, tz = round(float(parts[0]), 4), round(float(parts[1]), 4), parts[2]
+    if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+        raise ValueError(value)
+    try:
+        ZoneInfo(tz)
+    except (ZoneInfoNotFoundError, ValueError):
+        raise ValueError(value)
+    return lat, lng, tz
+
+def render_iftar_query(names, cities, start, end):
+    """
+    Serialize a columnar query result; returns (body, etag, complete).
+
+    Values are minutes since local midnight (null when unavailable), aligned
+    with ``dates``. Arbitrary cities are always computed locally.
+    """
+    dates = prayer_times.date_range(start, end)
+    date_keys = [d.isoformat() for d in dates]
+    complete = True
+    if PRAYER_TIMES_SOURCE == 'aladhan':
+        rows = []
+        for name in names:
+            times = fetch_maghrib_range(ARAB_COUNTRIES[name], date_keys)
+            row = [prayer_times.parse_minutes(times.get(d)) for d in date_keys]
+            complete = complete and None not in row
+            rows.append(row)
+    else:
+        locations = [(ARAB_COUNTRIES[n]['lat'], ARAB_COUNTRIES[n]['lng'], ARAB_COUNTRIES[n]['tz']) for n in names]
+        rows = prayer_times.maghrib_matrix(locations, dates)
+    city_rows = prayer_times.maghrib_matrix(cities, dates) if cities else []
+    payload = {
+        'success': True,
+        'dates': date_keys,
+        'countries': dict(zip(names, rows)),
+        'cities': {f"{lat},{lng},{tz}": row for (lat, lng, tz), row in zip(cities, city_rows)},
+        'source': PRAYER_TIMES_SOURCE,
+        'method': prayer_times.METHOD,
+        'school': prayer_times.SCHOOL
+    }
+    body = json.dumps(payload, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    return body, hashlib.sha256(body).hexdigest()[:32], complete
+
+@app.route('/api/iftar-times/query', methods=['GET'])
+@limiter.limit("60 per minute")
+def query_iftar_times():
+    """
+    Maghrib as minutes since local midnight for selected countries, cities and dates.
+
+    ?countries=مصر,قطر            country names (default: all, unless cities are given)
+    ?city=30.04,31.23,Africa/Cairo  any location, repeatable
+    ?start=YYYY-MM-DD&end=YYYY-MM-DD  (default: today until the end of Ramadan)
+    """
+    names = [n.strip() for n in request.args.get('countries', '').split(',') if n.strip()]
+    unknown = [n for n in names if n not in ARAB_COUNTRIES]
+    if unknown:
+        return jsonify({'success': False, 'error': f"unknown countries: {', '.join(unknown)}"}), 400
+    
+    try:
+        cities = sorted(set(parse_city(value) for value in request.args.getlist('city')))
+    except ValueError as e:
+        return jsonify({'success': False, 'error': f"city must be lat,lng,Area/Zone: {e}"}), 400
+    if len(cities) > QUERY_MAX_CITIES:
+        return jsonify({'success': False, 'error': f"at most {QUERY_MAX_CITIES} cities"}), 400
+    
+    # Same order for every spelling of the same query - one cache entry per shape
+    if names:
+        names = [n for n in ARAB_COUNTRIES if n in set(names)]
+    elif not cities:
+        names = list(ARAB_COUNTRIES)
+    
+    try:
+        today = datetime.now().date()
+        ramadan_start, ramadan_end = current_ramadan_window(today)
+        start = date.fromisoformat(request.args['start']) if 'start' in request.args else max(today, ramadan_start)
+        end = date.fromisoformat(request.args['end']) if 'end' in request.args else ramadan_end
+        if start > end or start.year < hijri.MIN_YEAR or end.year > hijri.MAX_YEAR:
+            raise ValueError(f"{start} - {end}")
+    except ValueError:
+        return jsonify({'success': False, 'error': f"start and end must be YYYY-MM-DD, start <= end, "
+                                                   f"within {hijri.MIN_YEAR}-{hijri.MAX_YEAR}"}), 400
+    if (end - start).days + 1 > QUERY_MAX_DAYS:
+        return jsonify({'success': False, 'error': f"at most {QUERY_MAX_DAYS} days per query"}), 400
+    
+    key = (tuple(names), tuple(cities), start, end, PRAYER_TIMES_SOURCE)
+    cached = query_response_cache.get(key)
+    if cached is None:
+        body, etag, complete = render_iftar_query(names, cities, start, end)
+        cached = (body, etag)
+        if complete:
+            query_response_cache.set(key, cached)
+    return cacheable_response(cached[0], cached[1], 'application/json', TIMETABLE_MAX_AGE)
+
+@app.route('/api/iftar-timetable', methods=['GET'])
+@limiter.limit("30 per minute")
+def get_iftar_timetable():
+    """Full precomputed Ramadan timetable (?format=json|bin, ?year=YYYY)"""
+    year = request.args.get('year', type=int) or datetime.now().year
+    if not hijri.MIN_YEAR <= year <= hijri.MAX_YEAR:
+        return jsonify({'success': False, 'error': f"year must be {hijri.MIN_YEAR}-{hijri.MAX_YEAR}"}), 400
+    fmt = request.args.get('format', 'json')
+    if fmt not in ('json', 'bin'):
+        return jsonify({'success': False, 'error': 'format must be json or bin'}), 400
+    table = get_timetable(year)
+    if fmt == 'bin':
+        return cacheable_response(table.to_binary(), f"{table.version}-bin",
+                                  'application/octet-stream', 86400)
+    return cacheable_response(table.to_json(), f"{table.version}-json", 'application/json', 86400)
+
+@app.cli.command('build-timetable')
+@click.option('--year', 'years', type=int, multiple=True, help='Year(s) to build (default: this year and next)')
+def build_timetable_command(years):
+    """Precompute the Ramadan iftar timetable artifacts (JSON + binary)"""
+    this_year = datetime.now().year
+    for year in years or (this_year, this_year + 1):
+        ramadan_start, ramadan_end = get_ramadan_window(year)
+        table = timetable.build_timetable(year, ramadan_start, ramadan_end, ARAB_COUNTRIES)
+        if PRAYER_TIMES_SOURCE == 'crosscheck':
+            dates, rows = table.slice()
+            date_keys = [d.isoformat() for d in dates]
+            local = {
+                name: {d: prayer_times.format_minutes(m) for d, m in zip(date_keys, minutes)}
+                for name, minutes in rows.items()
+            }
+            table.meta['crosscheck'] = crosscheck_prayer_times(ARAB_COUNTRIES, date_keys, local)
+        json_path, bin_path = timetable.save_timetable(table, TIMETABLE_DIR)
+        click.echo(f"{year}: {table.days} days x {len(table.countries)} countries -> "
+                   f"{json_path} ({os.path.getsize(json_path)} B), {bin_path} ({os.path.getsize(bin_path)} B)")
+
+@app.cli.command('purge-cache')
+def purge_cache_command():
+    """Delete expired entries from the persistent prayer and image caches"""
+    for cache in (prayer_cache, image_result_cache):
+        if cache.store is not None:
+            click.echo(f"{cache.name}: {cache.purge_expired()} expired rows deleted from {cache.store.path}")
+
+def cache_stats():
+    return [cache.stats() for cache in (prayer_cache, timetable_cache, timetable_response_cache,
+                                        gallery_cache, image_result_cache, query_response_cache, page_cache)]
+
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+
+def requires_metrics_token(view):
+    """Only for 'Authorization: Bearer <METRICS_TOKEN>'; closed while METRICS_TOKEN is unset"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        expected = f"Bearer {METRICS_TOKEN}".encode('utf-8')
+        supplied = request.headers.get('Authorization', '').encode('utf-8')
+        if not METRICS_TOKEN or not hmac.compare_digest(supplied, expected):
+            return jsonify({'success': False, 'error': 'unauthorized'}), 401
+        return view(*args, **kwargs)
+    return wrapper
+
+@app.route('/api/stats', methods=['GET'])
+@requires_metrics_token
+def stats():
+    """Cache, upstream client and database pool counters"""
+    return jsonify({
+        'success': True,
+        'caches': cache_stats(),
+        'aladhan': aladhan_client.stats(),
+        'db_pool': db_pool.stats(),
+        'jobs': job_queue.stats(),
+        'generation_writer': generation_writer.stats(),
+        'images': image_pipeline.stats(),
+        'image_store': image_store.stats(),
+        'catalog': character_catalog.stats(),
+        'rate_limit': limiter.stats(),
+        'prefetch': prefetch_scheduler.stats() if prefetch_scheduler is not None else None
+    })
+
+# Point-in-time values read when /metrics is scraped
+metrics.gauge('db_pool_connections', 'Pooled MySQL connections by state',
+              lambda: {(state,): db_pool.stats()[state] for state in ('in_use', 'idle')}, ('state',))
+metrics.gauge('job_queue_jobs', 'Image generation jobs by state',
+              lambda: {(state,): job_queue.stats()[state] for state in ('queued', 'running')}, ('state',))
+metrics.gauge('generation_writer_buffered', 'Generation rows waiting to be written to MySQL',
+              lambda: generation_writer.stats()['buffered'])
+metrics.gauge('cache_entries', 'Entries held by each in-process cache',
+              lambda: {(c['name'],): c['size'] for c in cache_stats()}, ('cache',))
+metrics.gauge('cache_hit_ratio', 'Hit ratio of each in-process cache since start',
+              lambda: {(c['name'],): c.get('hit_ratio') for c in cache_stats()}, ('cache',))
+
+@app.route('/metrics', methods=['GET'])
+@limiter.exempt  # scraped every few seconds
+@requires_metrics_token
+def metrics_endpoint():
+    """Prometheus text format"""
+    return app.response_class(metrics.REGISTRY.render(), content_type=metrics.CONTENT_TYPE)
+
 if __name__ == '__main__':
     app.run(debug=True, host='0.0.0.0', port=5000)
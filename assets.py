@@ -0,0 +1,186 @@
+"""
+Fingerprinted, precompressed static assets.
+
+The build step (``flask --app app build-assets``) copies every file under
+static/ into static/dist/ with a content hash in its name, e.g.
+``css/style.css`` -> ``css/style.3f2a1b9c0d1e.css``. Text assets also get
+gzip (and, when the brotli package is installed, brotli) variants next to
+them. A manifest.json maps original names to fingerprinted ones.
+
+A fingerprinted file never changes, so it can be cached for a year as
+immutable. Files from earlier builds are kept, so pages cached before a
+deploy keep working.
+"""
+import gzip
+import hashlib
+import json
+import logging
+import os
+import shutil
+
+try:
+    import brotli
+except ImportError:
+    # gzip variants only
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+DIST_DIRNAME = 'dist'
+MANIFEST_NAME = 'manifest.json'
+
+# Text-like assets worth precompressing (favicons are uncompressed bitmaps)
+COMPRESSIBLE = ('.css', '.js', '.svg', '.json', '.html', '.ico')
+MIN_COMPRESS_SIZE = 256
+# Notes and lists kept next to the assets are not served
+SKIP_SUFFIXES = ('.txt', '.md')
+
+# Preferred first
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+
+def file_hash(path, length=12):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()[:length]
+
+
+def fingerprint(name, digest):
+    """'css/style.css' -> 'css/style.<digest>.css'"""
+    root, ext = os.path.splitext(name)
+    return f"{root}.{digest}{ext}"
+
+
+def _write_atomic(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def _link_or_copy(src, dst):
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    tmp_path = dst + '.tmp'
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    try:
+        # Hard link - large media is not duplicated on disk
+        os.link(src, tmp_path)
+    except OSError:
+        shutil.copy2(src, tmp_path)
+    os.replace(tmp_path, dst)
+
+
+def _compressors():
+    compressors = {'gzip': lambda data: gzip.compress(data, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        compressors['br'] = lambda data: brotli.compress(data, quality=11)
+    return compressors
+
+
+def build_assets(static_dir):
+    """Fingerprint and precompress everything under static_dir; returns the manifest"""
+    dist_dir = os.path.join(static_dir, DIST_DIRNAME)
+    compressors = _compressors()
+    manifest = {}
+    for root, dirs, files in os.walk(static_dir):
+        if os.path.abspath(root) == os.path.abspath(static_dir):
+            dirs[:] = [d for d in dirs if d != DIST_DIRNAME]
+        for filename in sorted(files):
+            if filename.endswith(SKIP_SUFFIXES):
+                continue
+            src = os.path.join(root, filename)
+            name = os.path.relpath(src, static_dir).replace(os.sep, '/')
+            target = fingerprint(name, file_hash(src))
+            dst = os.path.join(dist_dir, target)
+            if not os.path.exists(dst):
+                _link_or_copy(src, dst)
+
+            entry = {'file': target, 'size': os.path.getsize(src), 'encodings': []}
+            if name.lower().endswith(COMPRESSIBLE) and entry['size'] >= MIN_COMPRESS_SIZE:
+                data = None
+                for encoding, suffix in ENCODINGS:
+                    variant = dst + suffix
+                    if not os.path.exists(variant) and encoding in compressors:
+                        if data is None:
+                            with open(src, 'rb') as f:
+                                data = f.read()
+                        compressed = compressors[encoding](data)
+                        # Not worth a variant if it barely shrinks
+                        if len(compressed) < len(data) * 0.95:
+                            _write_atomic(variant, compressed)
+                    if os.path.exists(variant):
+                        entry['encodings'].append(encoding)
+            manifest[name] = entry
+
+    payload = json.dumps(manifest, ensure_ascii=False, indent=2, sort_keys=True).encode('utf-8')
+    _write_atomic(os.path.join(dist_dir, MANIFEST_NAME), payload)
+    return manifest
+
+
+class AssetManifest:
+    """Lookup of fingerprinted names written by build_assets()"""
+
+    def __init__(self, static_dir, url_path='/assets', static_url_path='/static'):
+        self.static_dir = static_dir
+        self.dist_dir = os.path.join(static_dir, DIST_DIRNAME)
+        self.url_path = url_path
+        self.static_url_path = static_url_path
+        self._entries = {}
+        self._by_file = {}
+        self._names = {}
+        # Bumped on every load - part of the key of pages rendered with asset URLs
+        self.version = 0
+        self.load()
+
+    def load(self):
+        path = os.path.join(self.dist_dir, MANIFEST_NAME)
+        try:
+            with open(path, 'rb') as f:
+                entries = json.loads(f.read())
+        except FileNotFoundError:
+            entries = {}
+        except (OSError, ValueError) as e:
+            logger.warning("Ignoring asset manifest", extra={'path': path, 'error': str(e)})
+            entries = {}
+        self._entries = entries
+        self._by_file = {entry['file']: entry for entry in entries.values()}
+        self._names = {entry['file']: name for name, entry in entries.items()}
+        self.version += 1
+
+    def __len__(self):
+        return len(self._entries)
+
+    def resolve(self, name):
+        """Fingerprinted name for an original static path, or None if not built"""
+        entry = self._entries.get(name)
+        return entry['file'] if entry else None
+
+    def url(self, name):
+        """URL path of a static file: fingerprinted under url_path when built, static_url_path otherwise"""
+        fingerprinted = self.resolve(name)
+        if fingerprinted is None:
+            return f"{self.static_url_path}/{name}"
+        return f"{self.url_path}/{fingerprinted}"
+
+    def original(self, fingerprinted):
+        """Original static path of a fingerprinted name, or None"""
+        return self._names.get(fingerprinted)
+
+    def entry_for(self, fingerprinted):
+        return self._by_file.get(fingerprinted)
+
+    def variant(self, fingerprinted, accepts):
+        """
+        Pick the stored file to send: returns (filename, encoding or None).
+
+        ``accepts(encoding)`` tells whether the client accepts an encoding.
+        """
+        entry = self._by_file.get(fingerprinted)
+        for encoding, suffix in ENCODINGS:
+            if entry and encoding in entry['encodings'] and accepts(encoding):
+                return fingerprinted + suffix, encoding
+        return fingerprinted, None
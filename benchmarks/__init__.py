@@ -0,0 +1,7 @@
+"""
+Benchmarks and local stand-in services.
+
+Run modules from the project root, e.g.::
+
+    python -m benchmarks.bench_aladhan_client
+"""
@@ -0,0 +1,126 @@
+"""
+Compare the original per-request aladhan fan-out with the pooled client.
+
+Each round fetches 17 countries x 7 dates (119 calls) from a local fake
+aladhan server, the same shape as the original /api/iftar-times handler:
+
+    legacy   new ThreadPoolExecutor(25) per round, bare requests.get per call
+    pooled   shared executor + AladhanClient (keep-alive connection pool)
+    async    AladhanClient.maghrib_many with one global concurrency cap
+    calendar one /v1/calendar call per country and month (maghrib_range)
+
+    python -m benchmarks.bench_aladhan_client --rounds 5 --latency-ms 50
+"""
+import argparse
+import concurrent.futures
+import json
+import statistics
+import time
+from datetime import date, timedelta
+
+import requests
+
+from aladhan_client import AladhanClient, parse_maghrib
+from benchmarks.fake_aladhan import start_server
+
+COUNTRIES = 17
+DAYS = 7
+
+
+def make_items(start=date(2026, 2, 18)):
+    items = []
+    for i in range(COUNTRIES):
+        lat, lng = 15.0 + i, 30.0 + i
+        for d in range(DAYS):
+            items.append((lat, lng, (start + timedelta(days=d)).isoformat()))
+    return items
+
+
+def run_legacy(base_url, items):
+    def fetch(item):
+        lat, lng, date_str = item
+        params = {'latitude': lat, 'longitude': lng, 'method': 4, 'school': 0}
+        response = requests.get(f"{base_url}/v1/timings/{date_str}", params=params, timeout=4)
+        return parse_maghrib(response.json()) if response.status_code == 200 else None
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=25) as executor:
+        return list(executor.map(fetch, items))
+
+
+def run_pooled(client, executor, items):
+    return list(executor.map(lambda item: client.maghrib(*item), items))
+
+
+def run_async(client, items):
+    return client.maghrib_many(items)
+
+
+def run_calendar(client, executor, items):
+    by_location = {}
+    for lat, lng, date_str in items:
+        by_location.setdefault((lat, lng), []).append(date_str)
+    results = []
+    for times in executor.map(lambda loc: client.maghrib_range(loc[0], loc[1], by_location[loc]), by_location):
+        results.extend(times.values())
+    return results
+
+
+def measure(name, fn, rounds, server):
+    server.reset_counters()
+    timings = []
+    failures = 0
+    for _ in range(rounds):
+        started = time.perf_counter()
+        results = fn()
+        timings.append(time.perf_counter() - started)
+        failures += sum(1 for r in results if r is None)
+    counters = server.counters()
+    return {
+        'mode': name,
+        'rounds': rounds,
+        'calls_per_round': COUNTRIES * DAYS,
+        'mean_ms': round(statistics.mean(timings) * 1000, 1),
+        'min_ms': round(min(timings) * 1000, 1),
+        'max_ms': round(max(timings) * 1000, 1),
+        'failures': failures,
+        'connections_opened': counters['connections'],
+        'upstream_requests': counters['requests']
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rounds', type=int, default=5)
+    parser.add_argument('--latency-ms', type=float, default=50)
+    parser.add_argument('--jitter-ms', type=float, default=10)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--json', action='store_true', help='print machine-readable results')
+    args = parser.parse_args()
+
+    server = start_server(latency_ms=args.latency_ms, jitter_ms=args.jitter_ms, error_rate=args.error_rate)
+    items = make_items()
+    client = AladhanClient(base_url=server.base_url, pool_size=25, concurrency=args.concurrency)
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=25)
+    try:
+        results = [
+            measure('legacy', lambda: run_legacy(server.base_url, items), args.rounds, server),
+            measure('pooled', lambda: run_pooled(client, executor, items), args.rounds, server),
+            measure('async', lambda: run_async(client, items), args.rounds, server),
+            measure('calendar', lambda: run_calendar(client, executor, items), args.rounds, server)
+        ]
+    finally:
+        executor.shutdown()
+        server.shutdown()
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{'mode':<9} {'mean ms':>9} {'min ms':>9} {'max ms':>9} {'reqs':>6} {'conns':>7} {'fail':>6}")
+    for r in results:
+        print(f"{r['mode']:<9} {r['mean_ms']:>9} {r['min_ms']:>9} {r['max_ms']:>9} "
+              f"{r['upstream_requests']:>6} {r['connections_opened']:>7} {r['failures']:>6}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+"""
+Per-check overhead of the rate limit stores under multi-process contention.
+
+Each run starts ``--processes`` worker processes (like gunicorn workers), each
+doing ``--number`` checks from ``--threads`` threads:
+
+    hot      every check hits the same key (one busy client)
+    spread   keys are spread over 1000 clients
+
+and reports the per-check latency percentiles and the total checks per second.
+A final accounting run has every process try to use up the same
+"100 per hour" limit: a shared store admits 100 requests in total, the
+per-process memory store admits 100 per process.
+
+    python -m benchmarks.bench_ratelimit --processes 4
+    python -m benchmarks.bench_ratelimit --storage redis://localhost:6379/15
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import tempfile
+import threading
+import time
+
+from ratelimit import create_store, parse_limit
+
+LIMIT = parse_limit('1000000 per minute')  # never rejects - measures the store, not the policy
+ACCOUNTING_LIMIT = parse_limit('100 per hour')
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def _worker(uri, scenario, number, threads, seed, results):
+    store = create_store(uri)
+    rng = random.Random(seed)
+    latencies = []
+    lock = threading.Lock()
+
+    def run(count):
+        local = []
+        for _ in range(count):
+            key = 'hot' if scenario == 'hot' else f"client-{rng.randrange(1000)}"
+            started = time.perf_counter()
+            store.hit(key, LIMIT, time.time())
+            local.append(time.perf_counter() - started)
+        with lock:
+            latencies.extend(local)
+
+    pool = [threading.Thread(target=run, args=(number // threads,)) for _ in range(threads)]
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    results.put(latencies)
+
+
+def _accounting_worker(uri, key, attempts, results):
+    store = create_store(uri)
+    results.put(sum(store.hit(key, ACCOUNTING_LIMIT, time.time()).allowed for _ in range(attempts)))
+
+
+def run_processes(target, args_for, processes):
+    results = multiprocessing.Queue()
+    procs = [multiprocessing.Process(target=target, args=args_for(i) + (results,)) for i in range(processes)]
+    started = time.perf_counter()
+    for p in procs:
+        p.start()
+    collected = [results.get() for _ in procs]
+    for p in procs:
+        p.join()
+    return collected, time.perf_counter() - started
+
+
+def bench(uri, scenario, processes, threads, number):
+    collected, elapsed = run_processes(
+        _worker, lambda i: (uri, scenario, number, threads, i), processes
+    )
+    latencies = [x for chunk in collected for x in chunk]
+    return {
+        'storage': uri.split('://')[0],
+        'scenario': scenario,
+        'processes': processes,
+        'threads': threads,
+        'checks': len(latencies),
+        'p50_us': round(percentile(latencies, 50) * 1e6, 1),
+        'p99_us': round(percentile(latencies, 99) * 1e6, 1),
+        'checks_per_s': round(len(latencies) / elapsed)
+    }
+
+
+def accounting(uri, processes):
+    key = f"accounting-{os.getpid()}-{time.time()}"
+    collected, _ = run_processes(
+        _accounting_worker, lambda i: (uri, key, ACCOUNTING_LIMIT.amount), processes
+    )
+    return sum(collected)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--processes', type=int, default=4)
+    parser.add_argument('--threads', type=int, default=2, help='threads per process')
+    parser.add_argument('--number', type=int, default=5000, help='checks per process')
+    parser.add_argument('--storage', action='append', help='storage URI(s) (default: memory:// and a temp sqlite file)')
+    parser.add_argument('--json', action='store_true', help='print machine-readable results')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        uris = args.storage or ['memory://', 'sqlite://' + os.path.join(tmp, 'ratelimit.db')]
+        results = []
+        for uri in uris:
+            for scenario in ('hot', 'spread'):
+                results.append(bench(uri, scenario, args.processes, args.threads, args.number))
+            admitted = accounting(uri, args.processes)
+            for row in results[-2:]:
+                row['admitted_of_100'] = admitted
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{'storage':<8} {'scenario':<8} {'procs':>5} {'p50 us':>8} {'p99 us':>8} {'checks/s':>10} {'admitted/100':>13}")
+    for r in results:
+        print(f"{r['storage']:<8} {r['scenario']:<8} {r['processes']:>5} {r['p50_us']:>8} {r['p99_us']:>8} "
+              f"{r['checks_per_s']:>10} {r['admitted_of_100']:>13}")
+
+
+if __name__ == '__main__':
+    main()
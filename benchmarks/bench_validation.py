@@ -0,0 +1,113 @@
+"""
+Compare the original prompt validation/sanitization with the validation engine.
+
+Each case validates and sanitizes one prompt, the work /generate does per
+request. Prompts are typical Arabic and English descriptions, clean and with
+an injection attempt near the end, at several lengths up to the 1000-char
+limit:
+
+    legacy   three re.search calls per prompt + re.sub + html.escape
+    engine   validation.prompt_validator (one combined regex) + sanitize()
+
+Results of both paths are compared before timing.
+
+    python -m benchmarks.bench_validation --number 2000
+"""
+import argparse
+import html
+import json
+import re
+import timeit
+
+from validation import MAX_PROMPT_LENGTH, prompt_validator, sanitize
+
+LENGTHS = (40, 200, 500, 1000)
+
+SAMPLES = {
+    'arabic': "فانوس رمضان مضيء فوق مسجد قديم في ليلة هادئة مع هلال ونجوم ذهبية وزينة ملونة ",
+    'english': "A glowing Ramadan lantern above an old mosque on a calm night, crescent moon, golden stars ",
+}
+INJECTION = " OR 1=1"
+
+
+def legacy_sanitize(text, max_length=1000):
+    if not text:
+        return ""
+    text = text.replace('\x00', '')
+    if len(text) > max_length:
+        text = text[:max_length]
+    text = re.sub(r'[<>"\']', '', text)
+    text = html.escape(text)
+    return text.strip()
+
+
+def legacy_validate(prompt):
+    if not prompt or len(prompt.strip()) == 0:
+        return False, "الرجاء إدخال نص الوصف"
+    if len(prompt) > 1000:
+        return False, "النص طويل جداً (الحد الأقصى 1000 حرف)"
+    sql_patterns = [
+        r'(\b(SELECT|INSERT|UPDATE|DELETE|DROP|CREATE|ALTER|EXEC|EXECUTE|UNION|SCRIPT)\b)',
+        r'(\b(OR|AND)\s+\d+\s*=\s*\d+)',
+        r'(\'|\"|;|--|\/\*|\*\/)',
+    ]
+    for pattern in sql_patterns:
+        if re.search(pattern, prompt, re.IGNORECASE):
+            return False, "النص المدخل غير صالح"
+    return True, None
+
+
+def run_legacy(prompt):
+    valid, error = legacy_validate(prompt)
+    return (valid, error, legacy_sanitize(prompt) if valid else None)
+
+
+def run_engine(prompt):
+    result = prompt_validator.check(prompt)
+    return (result.valid, result.error, sanitize(prompt) if result.valid else None)
+
+
+def make_prompt(text, length, attack=False):
+    tail = INJECTION if attack else ''
+    body = (text * (length // len(text) + 1))[:length - len(tail)]
+    return (body + tail)[:MAX_PROMPT_LENGTH]
+
+
+def make_cases():
+    cases = []
+    for language, text in SAMPLES.items():
+        for length in LENGTHS:
+            for attack in (False, True):
+                name = f"{language}-{length}{'-attack' if attack else ''}"
+                cases.append((name, make_prompt(text, length, attack)))
+    return cases
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--number', type=int, default=2000, help='calls per case and mode')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--json', action='store_true', help='print machine-readable results')
+    args = parser.parse_args()
+
+    results = []
+    for name, prompt in make_cases():
+        if run_legacy(prompt) != run_engine(prompt):
+            raise SystemExit(f"Result mismatch for case {name}")
+        row = {'case': name, 'length': len(prompt)}
+        for mode, fn in (('legacy', run_legacy), ('engine', run_engine)):
+            best = min(timeit.repeat(lambda: fn(prompt), number=args.number, repeat=args.repeat))
+            row[f'{mode}_us'] = round(best / args.number * 1e6, 2)
+        row['speedup'] = round(row['legacy_us'] / row['engine_us'], 2)
+        results.append(row)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{'case':<22} {'chars':>6} {'legacy us':>10} {'engine us':>10} {'speedup':>8}")
+    for r in results:
+        print(f"{r['case']:<22} {r['length']:>6} {r['legacy_us']:>10} {r['engine_us']:>10} {r['speedup']:>8}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,189 @@
+"""
+Local stand-in for api.aladhan.com.
+
+Serves /v1/timings/<DD-MM-YYYY or YYYY-MM-DD> and /v1/calendar/<year>/<month>
+with Maghrib computed by the local engine, after a configurable latency. Error and timeout rates let
+benchmarks exercise retries and timeouts without touching the real API.
+
+    python -m benchmarks.fake_aladhan --port 8765 --latency-ms 80
+"""
+import argparse
+import calendar
+import json
+import random
+import re
+import threading
+import time
+from datetime import date, datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import prayer_times
+
+TIMINGS_PATH = re.compile(r'^/v1/timings/([0-9-]+)$')
+CALENDAR_PATH = re.compile(r'^/v1/calendar/(\d{4})/(\d{1,2})$')
+
+
+def parse_date(value):
+    """Accept both YYYY-MM-DD and aladhan's DD-MM-YYYY"""
+    for fmt in ('%Y-%m-%d', '%d-%m-%Y'):
+        try:
+            return datetime.strptime(value, fmt).date()
+        except ValueError:
+            continue
+    raise ValueError(value)
+
+
+class FakeAladhanServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 256
+
+    def __init__(self, address, latency_ms=50, jitter_ms=0, error_rate=0.0,
+                 timeout_rate=0.0, timeout_s=10.0, tz='UTC'):
+        super().__init__(address, FakeAladhanHandler)
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.timeout_rate = timeout_rate
+        self.timeout_s = timeout_s
+        self.tz = tz
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.connections = 0
+        self.errors = 0
+        self.timeouts = 0
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def count(self, field):
+        with self.lock:
+            setattr(self, field, getattr(self, field) + 1)
+
+    def reset_counters(self):
+        with self.lock:
+            self.requests = self.connections = self.errors = self.timeouts = 0
+
+    def counters(self):
+        with self.lock:
+            return {
+                'requests': self.requests,
+                'connections': self.connections,
+                'errors': self.errors,
+                'timeouts': self.timeouts
+            }
+
+
+class FakeAladhanHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1 so clients can keep connections alive
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        super().setup()
+        self.server.count('connections')
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, payload):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def simulate_upstream(self):
+        """Sleep for the configured latency; returns False if the request should fail"""
+        server = self.server
+        server.count('requests')
+        roll = random.random()
+        if roll < server.timeout_rate:
+            server.count('timeouts')
+            time.sleep(server.timeout_s)
+            return False
+        delay = server.latency_ms + random.uniform(0, server.jitter_ms)
+        time.sleep(delay / 1000.0)
+        if roll < server.timeout_rate + server.error_rate:
+            server.count('errors')
+            self.send_json(503, {'code': 503, 'status': 'Service Unavailable'})
+            return False
+        return True
+
+    def timings_payload(self, day, lat, lng):
+        maghrib = prayer_times.get_maghrib(lat, lng, day, self.server.tz)
+        return {
+            'code': 200,
+            'status': 'OK',
+            'data': {
+                'timings': {'Maghrib': maghrib},
+                'date': {'gregorian': {'date': day.strftime('%d-%m-%Y')}}
+            }
+        }
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        try:
+            lat = float(query['latitude'][0])
+            lng = float(query['longitude'][0])
+        except (KeyError, ValueError):
+            self.send_json(400, {'code': 400, 'status': 'Bad Request'})
+            return
+
+        calendar_match = CALENDAR_PATH.match(url.path)
+        if calendar_match:
+            if not self.simulate_upstream():
+                return
+            year, month = int(calendar_match.group(1)), int(calendar_match.group(2))
+            days = calendar.monthrange(year, month)[1]
+            data = [self.timings_payload(date(year, month, d), lat, lng)['data'] for d in range(1, days + 1)]
+            self.send_json(200, {'code': 200, 'status': 'OK', 'data': data})
+            return
+
+        match = TIMINGS_PATH.match(url.path)
+        if not match:
+            self.send_json(404, {'code': 404, 'status': 'Not Found'})
+            return
+        if not self.simulate_upstream():
+            return
+        try:
+            day = parse_date(match.group(1))
+        except ValueError:
+            self.send_json(400, {'code': 400, 'status': 'Bad Request'})
+            return
+        self.send_json(200, self.timings_payload(day, lat, lng))
+
+
+def start_server(host='127.0.0.1', port=0, **options):
+    """Start a fake server on a background thread; returns the server (call shutdown() to stop)"""
+    server = FakeAladhanServer((host, port), **options)
+    thread = threading.Thread(target=server.serve_forever, name='fake-aladhan', daemon=True)
+    thread.start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local stand-in for api.aladhan.com')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency-ms', type=float, default=50)
+    parser.add_argument('--jitter-ms', type=float, default=0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--timeout-rate', type=float, default=0.0)
+    args = parser.parse_args()
+    server = FakeAladhanServer(
+        (args.host, args.port), latency_ms=args.latency_ms, jitter_ms=args.jitter_ms,
+        error_rate=args.error_rate, timeout_rate=args.timeout_rate
+    )
+    print(f"Fake aladhan listening on {server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
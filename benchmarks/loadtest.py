@@ -0,0 +1,360 @@
+"""
+Load test for /home, /loading, /generate and /api/iftar-times.
+
+By default the app runs in this process on a local threaded server with
+stand-ins for its dependencies, so runs are reproducible on any machine:
+
+    aladhan     benchmarks.fake_aladhan (latency, jitter, error and timeout rates)
+    MySQL       benchmarks.sqlite_mysql (SQLite file seeded with gallery rows)
+    image API   a fake provider that sleeps --image-latency-ms
+    today       fixed with --today (inside Ramadan 1447 by default)
+
+Rate limiting and background prefetch are off. ``--prayer-cache-size 0``
+disables the upstream cache, so every /api/iftar-times request does the full
+fan-out, and ``--page-cache-size 0`` renders /home and /loading on every
+request without compression. Closed-loop workers send a weighted mix of requests (``--mix``) for
+``--duration`` seconds after ``--warmup``. After the run, /generate jobs are
+polled until they finish, and their queue-to-done time is reported as
+``generate_job``.
+
+The report is JSON (``--output``) with throughput and p50/p95/p99 per
+scenario. ``--compare`` checks it against an earlier report and exits with
+status 1 when a p95 grew by more than ``--max-regression`` percent:
+
+    python -m benchmarks.loadtest --duration 20 --concurrency 16 --output base.json
+    python -m benchmarks.loadtest --duration 20 --concurrency 16 --compare base.json
+
+``--url`` drives an already running server instead; the stand-ins are not
+used then.
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+import requests
+
+SCENARIOS = ('home', 'loading', 'iftar', 'generate')
+PROMPT_WORDS = ('فانوس', 'رمضان', 'هلال', 'مسجد', 'نجوم', 'ذهبي', 'lantern', 'crescent', 'night', 'mosque')
+
+
+def percentile(values, p):
+    """Nearest-rank percentile of a non-empty list"""
+    values = sorted(values)
+    return values[max(0, min(len(values) - 1, int(round(p / 100 * len(values) + 0.5)) - 1))]
+
+
+def summarize(latencies, errors, statuses, elapsed):
+    row = {
+        'requests': len(latencies) + errors,
+        'errors': errors,
+        'statuses': dict(sorted(statuses.items())),
+        'throughput_rps': round(len(latencies) / elapsed, 1) if elapsed else 0.0
+    }
+    if latencies:
+        row.update({
+            'mean_ms': round(sum(latencies) / len(latencies) * 1000, 2),
+            'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+            'p95_ms': round(percentile(latencies, 95) * 1000, 2),
+            'p99_ms': round(percentile(latencies, 99) * 1000, 2),
+            'max_ms': round(max(latencies) * 1000, 2)
+        })
+    return row
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        if name not in SCENARIOS:
+            raise argparse.ArgumentTypeError(f"unknown scenario {name!r} (choose from {', '.join(SCENARIOS)})")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+class Recorder:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = {name: [] for name in SCENARIOS}
+        self.errors = {name: 0 for name in SCENARIOS}
+        self.statuses = {name: {} for name in SCENARIOS}
+        self.job_ids = []
+
+    def record(self, name, latency, status, ok):
+        with self.lock:
+            statuses = self.statuses[name]
+            statuses[str(status)] = statuses.get(str(status), 0) + 1
+            if ok:
+                self.latencies[name].append(latency)
+            else:
+                self.errors[name] += 1
+
+
+def send(session, base_url, name, rng, timeout):
+    """One request of a scenario; returns (status, ok, job id or None)"""
+    if name in ('home', 'loading'):
+        response = session.get(f"{base_url}/{name}", timeout=timeout)
+        return response.status_code, response.status_code == 200, None
+    if name == 'iftar':
+        response = session.get(f"{base_url}/api/iftar-times", timeout=timeout)
+        ok = response.status_code == 200 and response.json().get('success', False)
+        return response.status_code, ok, None
+    # Distinct prompts, so every job reaches the image API and the database
+    prompt = ' '.join(rng.choice(PROMPT_WORDS) for _ in range(6)) + f" {rng.getrandbits(32):08x}"
+    response = session.post(f"{base_url}/generate", json={'prompt': prompt}, timeout=timeout)
+    job_id = response.json().get('job_id') if response.status_code == 202 else None
+    return response.status_code, response.status_code == 202, job_id
+
+
+def run_load(base_url, mix, concurrency, duration, warmup, seed, timeout):
+    recorder = Recorder()
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    started = time.perf_counter()
+    measure_from = started + warmup
+    stop_at = measure_from + duration
+
+    def worker(index):
+        rng = random.Random(seed * 1000 + index)
+        session = requests.Session()
+        while True:
+            now = time.perf_counter()
+            if now >= stop_at:
+                break
+            name = rng.choices(names, weights)[0]
+            t0 = time.perf_counter()
+            try:
+                status, ok, job_id = send(session, base_url, name, rng, timeout)
+            except (requests.RequestException, ValueError) as e:
+                status, ok, job_id = type(e).__name__, False, None
+            latency = time.perf_counter() - t0
+            if t0 >= measure_from:
+                recorder.record(name, latency, status, ok)
+                if job_id:
+                    with recorder.lock:
+                        recorder.job_ids.append(job_id)
+        session.close()
+
+    threads = [threading.Thread(target=worker, args=(i,), daemon=True) for i in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return recorder
+
+
+def wait_for_jobs(base_url, job_ids, timeout):
+    """Poll every job until it finishes; returns (durations, statuses)"""
+    durations = []
+    statuses = {}
+    session = requests.Session()
+    deadline = time.monotonic() + timeout
+    pending = list(job_ids)
+    while pending and time.monotonic() < deadline:
+        still_pending = []
+        for job_id in pending:
+            job = session.get(f"{base_url}/api/jobs/{job_id}", timeout=10).json()
+            if job.get('status') in ('queued', 'running'):
+                still_pending.append(job_id)
+                continue
+            statuses[job.get('status')] = statuses.get(job.get('status'), 0) + 1
+            if job.get('finished_at') and job.get('created_at'):
+                durations.append(job['finished_at'] - job['created_at'])
+        pending = still_pending
+        if pending:
+            time.sleep(0.2)
+    if pending:
+        statuses['unfinished'] = len(pending)
+    return durations, statuses
+
+
+class LocalStack:
+    """The app plus its stand-ins, served on a local port"""
+
+    def __init__(self, args, workdir):
+        from benchmarks import fake_aladhan, sqlite_mysql
+
+        self.aladhan = fake_aladhan.start_server(
+            latency_ms=args.upstream_latency_ms, jitter_ms=args.upstream_jitter_ms,
+            error_rate=args.upstream_error_rate, timeout_rate=args.upstream_timeout_rate,
+            timeout_s=args.upstream_timeout_s
+        )
+        # Read by app.py at import time (load_dotenv does not override them)
+        os.environ.update({
+            'PRAYER_TIMES_SOURCE': 'aladhan',
+            'ALADHAN_BASE_URL': self.aladhan.base_url,
+            'ALADHAN_TIMEOUT': str(args.client_timeout_s),
+            'ALADHAN_FETCH_MODE': args.fetch_mode,
+            'PRAYER_CACHE_SIZE': str(args.prayer_cache_size),
+            'PRAYER_CACHE_DB': '',
+            'PREFETCH_ENABLED': '0',
+            'RATELIMIT_ENABLED': '0',
+            'RATELIMIT_STORAGE_URI': 'memory://',
+            'GALLERY_CACHE_TTL': str(args.gallery_cache_ttl),
+            'PAGE_CACHE_SIZE': str(args.page_cache_size),
+            'IMAGE_CACHE_DB': '',
+            'JOB_QUEUE_BACKEND': 'memory',
+            'GENERATION_SPILL_DIR': os.path.join(workdir, 'spill'),
+            'IMAGE_STORE_DIR': os.path.join(workdir, 'media'),
+            'TIMETABLE_DIR': os.path.join(workdir, 'data'),
+            'IMAGE_DERIVATIVE_DIR': os.path.join(workdir, 'images'),
+            'METRICS_DB': os.path.join(workdir, 'metrics.sqlite3'),
+            'LOG_LEVEL': os.environ.get('LOG_LEVEL', 'WARNING'),
+        })
+        import app as app_module
+        from db import ConnectionPool
+        # One access-log line per request would dominate the run
+        logging.getLogger('werkzeug').setLevel(logging.WARNING)
+        from werkzeug.serving import make_server
+
+        db_path = os.path.join(workdir, 'generations.db')
+        connect = sqlite_mysql.connector(db_path, latency_ms=args.db_latency_ms,
+                                         connect_latency_ms=args.db_connect_latency_ms)
+        sqlite_mysql.seed_generations(db_path, args.seed_rows)
+        app_module.db_pool = ConnectionPool({}, size=args.db_pool_size, connect=connect)
+
+        image_latency = args.image_latency_ms / 1000.0
+        counter = iter(range(1, 1 << 62))
+
+        def fake_image_api(prompt, timeout=None):
+            time.sleep(image_latency)
+            return f"/static/images/generated/loadtest-{next(counter)}.jpg"
+        app_module.call_ai_image_api = fake_image_api
+
+        today = datetime.strptime(args.today, '%Y-%m-%d')
+
+        class FixedDateTime(datetime):
+            @classmethod
+            def now(cls, tz=None):
+                return today if tz is None else today.replace(tzinfo=tz)
+
+            @classmethod
+            def fromtimestamp(cls, t, tz=None):
+                # A plain datetime, so it can be bound as a query parameter
+                return datetime.fromtimestamp(t, tz)
+        app_module.datetime = FixedDateTime
+
+        self.app = app_module
+        self.server = make_server('127.0.0.1', 0, app_module.app, threaded=True)
+        threading.Thread(target=self.server.serve_forever, name='loadtest-app', daemon=True).start()
+        self.base_url = f"http://127.0.0.1:{self.server.server_port}"
+
+    def stats(self):
+        return {
+            'aladhan': self.aladhan.counters(),
+            'db_pool': self.app.db_pool.stats(),
+            'generation_writer': self.app.generation_writer.stats(),
+            'caches': self.app.cache_stats()
+        }
+
+    def close(self):
+        self.server.shutdown()
+        self.aladhan.shutdown()
+
+
+def compare(report, baseline, max_regression):
+    """Rows of (scenario, old p95, new p95, change %, regressed)"""
+    rows = []
+    for name, new in report['scenarios'].items():
+        old = baseline.get('scenarios', {}).get(name)
+        if not old or 'p95_ms' not in old or 'p95_ms' not in new:
+            continue
+        change = (new['p95_ms'] - old['p95_ms']) / old['p95_ms'] * 100 if old['p95_ms'] else 0.0
+        rows.append((name, old['p95_ms'], new['p95_ms'], round(change, 1), change > max_regression))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', help='drive this running server instead of an in-process one')
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix('home=4,iftar=4,generate=1'),
+                        help='weighted scenarios, e.g. home=4,loading=2,iftar=4,generate=1')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=10, help='measured seconds')
+    parser.add_argument('--warmup', type=float, default=2, help='unmeasured seconds before the run')
+    parser.add_argument('--timeout', type=float, default=30, help='client timeout per request')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--today', default='2026-02-20', help='date the in-process app sees')
+    stack = parser.add_argument_group('in-process stand-ins')
+    stack.add_argument('--upstream-latency-ms', type=float, default=50)
+    stack.add_argument('--upstream-jitter-ms', type=float, default=20)
+    stack.add_argument('--upstream-error-rate', type=float, default=0.0)
+    stack.add_argument('--upstream-timeout-rate', type=float, default=0.0)
+    stack.add_argument('--upstream-timeout-s', type=float, default=10.0, help='how long a timed-out call hangs')
+    stack.add_argument('--client-timeout-s', type=float, default=4.0, help='ALADHAN_TIMEOUT for the app')
+    stack.add_argument('--fetch-mode', choices=('calendar', 'daily'), default='calendar')
+    stack.add_argument('--prayer-cache-size', type=int, default=10000, help='0 = every request fans out')
+    stack.add_argument('--gallery-cache-ttl', type=int, default=60, help='0 = every /home queries the DB')
+    stack.add_argument('--page-cache-size', type=int, default=32, help='0 = render /home and /loading every request')
+    stack.add_argument('--db-latency-ms', type=float, default=1.0, help='added to every query')
+    stack.add_argument('--db-connect-latency-ms', type=float, default=20.0)
+    stack.add_argument('--db-pool-size', type=int, default=5)
+    stack.add_argument('--seed-rows', type=int, default=200, help='gallery rows inserted before the run')
+    stack.add_argument('--image-latency-ms', type=float, default=200)
+    output = parser.add_argument_group('output')
+    output.add_argument('--output', help='write the JSON report here (default: stdout)')
+    output.add_argument('--compare', help='earlier JSON report to compare p95 against')
+    output.add_argument('--max-regression', type=float, default=10.0, help='allowed p95 growth in percent')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        local = None if args.url else LocalStack(args, workdir)
+        base_url = (args.url or local.base_url).rstrip('/')
+        try:
+            started = time.perf_counter()
+            recorder = run_load(base_url, args.mix, args.concurrency, args.duration, args.warmup,
+                                args.seed, args.timeout)
+            elapsed = time.perf_counter() - started - args.warmup
+            scenarios = {
+                name: summarize(recorder.latencies[name], recorder.errors[name], recorder.statuses[name], elapsed)
+                for name in args.mix
+            }
+            if recorder.job_ids:
+                durations, statuses = wait_for_jobs(base_url, recorder.job_ids, timeout=120)
+                scenarios['generate_job'] = summarize(durations, 0, statuses, elapsed)
+                scenarios['generate_job']['throughput_rps'] = round(len(durations) / elapsed, 1)
+            all_latencies = [x for name in args.mix for x in recorder.latencies[name]]
+            report = {
+                'created_at': datetime.utcnow().isoformat(timespec='seconds') + 'Z',
+                'config': {key: value for key, value in vars(args).items() if key not in ('output', 'compare')},
+                'total': summarize(all_latencies, sum(recorder.errors.values()), {}, elapsed),
+                'scenarios': scenarios
+            }
+            if local is not None:
+                report['stack'] = local.stats()
+        finally:
+            if local is not None:
+                local.close()
+
+    payload = json.dumps(report, indent=2, ensure_ascii=False, default=str)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(payload + '\n')
+    else:
+        print(payload)
+
+    print(f"{'scenario':<14} {'requests':>8} {'errors':>6} {'rps':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}",
+          file=sys.stderr)
+    for name, row in list(report['scenarios'].items()) + [('total', report['total'])]:
+        print(f"{name:<14} {row['requests']:>8} {row['errors']:>6} {row['throughput_rps']:>8} "
+              f"{row.get('p50_ms', '-'):>9} {row.get('p95_ms', '-'):>9} {row.get('p99_ms', '-'):>9}", file=sys.stderr)
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressed = False
+        for name, old, new, change, bad in compare(report, baseline, args.max_regression):
+            regressed = regressed or bad
+            print(f"{name:<14} p95 {old} -> {new} ms ({change:+}%){'  REGRESSION' if bad else ''}", file=sys.stderr)
+        if regressed:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
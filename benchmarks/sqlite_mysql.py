@@ -0,0 +1,148 @@
+"""
+SQLite stand-in for the MySQL connections the app uses.
+
+Implements the small part of mysql.connector the app touches (prepared and
+dictionary cursors, commit, ping, is_connected) on top of a SQLite file with
+the ``generations`` table from schema.sql, plus an optional per-query
+latency to model the network round trip to a real MySQL server. Errors are
+raised as mysql.connector.Error, so the app's error handling runs unchanged.
+
+    pool = ConnectionPool({}, connect=sqlite_mysql.connector(path, latency_ms=1))
+"""
+import os
+import re
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+from mysql.connector import Error
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS generations (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    prompt TEXT NOT NULL,
+    image_url TEXT NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    is_local INTEGER GENERATED ALWAYS AS (
+        image_url != '' AND image_url NOT LIKE 'http://%' AND image_url NOT LIKE 'https://%'
+    ) STORED,
+    prompt_hash TEXT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_created_at ON generations (created_at);
+CREATE INDEX IF NOT EXISTS idx_gallery ON generations (is_local, id);
+CREATE INDEX IF NOT EXISTS idx_prompt_hash ON generations (prompt_hash);
+"""
+
+_PLACEHOLDER = re.compile(r'%s')
+
+
+def _timestamp(value):
+    return datetime.fromisoformat(value.decode())
+
+
+class Cursor:
+    def __init__(self, connection, dictionary=False):
+        self._connection = connection
+        self._dictionary = dictionary
+        self._cursor = None
+        self.lastrowid = None
+        self.rowcount = -1
+
+    def execute(self, sql, params=()):
+        self._connection.simulate_latency()
+        try:
+            self._cursor = self._connection.raw.execute(_PLACEHOLDER.sub('?', sql), tuple(params or ()))
+        except sqlite3.Error as e:
+            raise Error(msg=str(e))
+        self.rowcount = self._cursor.rowcount
+        self.lastrowid = self._cursor.lastrowid
+        if self.rowcount > 1 and sql.lstrip().upper().startswith('INSERT'):
+            # MySQL reports the first id of a multi-row INSERT, SQLite the last
+            self.lastrowid -= self.rowcount - 1
+
+    def _row(self, row):
+        if row is None or not self._dictionary:
+            return row
+        return {column[0]: value for column, value in zip(self._cursor.description, row)}
+
+    def fetchone(self):
+        return self._row(self._cursor.fetchone())
+
+    def fetchall(self):
+        return [self._row(row) for row in self._cursor.fetchall()]
+
+    def close(self):
+        pass
+
+
+class Connection:
+    def __init__(self, path, latency_ms=0.0):
+        self.raw = sqlite3.connect(path, timeout=10, check_same_thread=False,
+                                   detect_types=sqlite3.PARSE_DECLTYPES)
+        self.raw.execute("PRAGMA journal_mode=WAL")
+        self.latency = latency_ms / 1000.0
+        self._open = True
+
+    @property
+    def in_transaction(self):
+        return self.raw.in_transaction
+
+    def simulate_latency(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+    def cursor(self, prepared=False, dictionary=False):
+        return Cursor(self, dictionary=dictionary)
+
+    def commit(self):
+        self.simulate_latency()
+        self.raw.commit()
+
+    def rollback(self):
+        self.raw.rollback()
+
+    def ping(self, reconnect=False, attempts=1, delay=0):
+        self.simulate_latency()
+
+    def is_connected(self):
+        return self._open
+
+    def close(self):
+        self._open = False
+        self.raw.close()
+
+
+_schema_lock = threading.Lock()
+
+
+def create_database(path):
+    """Create the SQLite file with the generations table"""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    sqlite3.register_converter('TIMESTAMP', _timestamp)
+    with _schema_lock:
+        conn = sqlite3.connect(path)
+        conn.executescript(SCHEMA)
+        conn.close()
+
+
+def connector(path, latency_ms=0.0, connect_latency_ms=0.0):
+    """Connection factory for ConnectionPool(connect=...); the MySQL config is ignored"""
+    create_database(path)
+
+    def connect(**config):
+        if connect_latency_ms:
+            time.sleep(connect_latency_ms / 1000.0)
+        return Connection(path, latency_ms)
+    return connect
+
+
+def seed_generations(path, count, local_url='/static/images/original-character.jpg'):
+    """Insert ``count`` gallery rows so /home has something to render"""
+    conn = sqlite3.connect(path)
+    conn.executemany(
+        "INSERT INTO generations (prompt, image_url, prompt_hash) VALUES (?, ?, NULL)",
+        [(f"seed prompt {i}", local_url) for i in range(count)]
+    )
+    conn.commit()
+    conn.close()
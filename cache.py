@@ -0,0 +1,278 @@
+"""
+In-process TTL cache with LRU eviction, single-flight loading and an optional
+SQLite backing store shared between gunicorn workers.
+"""
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class SQLiteStore:
+    """Persistent key/value store used as a second-level cache across workers and restarts"""
+
+    def __init__(self, path, table='cache', purge_interval=3600):
+        self.path = path
+        self.table = table
+        # Expired rows are deleted by set() at most once per interval (0 = only by purge_expired())
+        self.purge_interval = purge_interval
+        self._next_purge = time.monotonic() + purge_interval
+        self._purge_lock = threading.Lock()
+        self._local = threading.local()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        conn = self._connection()
+        conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {self.table} ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL)"
+        )
+        conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{self.table}_expires_at ON {self.table} (expires_at)")
+        conn.commit()
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        """Return (value, expires_at) or None if missing/expired"""
+        row = self._connection().execute(
+            f"SELECT value, expires_at FROM {self.table} WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        value, expires_at = row
+        if expires_at is not None and expires_at <= time.time():
+            return None
+        return json.loads(value), expires_at
+
+    def set(self, key, value, expires_at):
+        conn = self._connection()
+        conn.execute(
+            f"INSERT OR REPLACE INTO {self.table} (key, value, expires_at) VALUES (?, ?, ?)",
+            (key, json.dumps(value, ensure_ascii=False), expires_at)
+        )
+        conn.commit()
+        if self._purge_due():
+            self.purge_expired()
+
+    def _purge_due(self):
+        if not self.purge_interval:
+            return False
+        with self._purge_lock:
+            now = time.monotonic()
+            if now < self._next_purge:
+                return False
+            self._next_purge = now + self.purge_interval
+            return True
+
+    def delete(self, key):
+        conn = self._connection()
+        conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+        conn.commit()
+
+    def purge_expired(self):
+        conn = self._connection()
+        cursor = conn.execute(
+            f"DELETE FROM {self.table} WHERE expires_at IS NOT NULL AND expires_at <= ?", (time.time(),)
+        )
+        conn.commit()
+        return cursor.rowcount
+
+
+class _InFlight:
+    """A load in progress that other callers for the same key wait on"""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class TTLCache:
+    """
+    Bounded LRU cache whose entries expire after a TTL.
+
+    ``get_or_load`` coalesces concurrent misses for the same key so the loader
+    runs exactly once; the other callers wait for its result.
+    """
+
+    def __init__(self, max_size=1024, ttl=None, store=None, name='cache'):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.store = store
+        self.name = name
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self._inflight = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.store_hits = 0
+        self.loads = 0
+        self.coalesced = 0
+
+    @staticmethod
+    def make_key(*parts):
+        """Build a string key from hashable parts (needed for the SQLite store)"""
+        return '|'.join(str(p) for p in parts)
+
+    def _expires_at(self, ttl):
+        ttl = self.ttl if ttl is None else ttl
+        return time.time() + ttl if ttl else None
+
+    def _get_local(self, key):
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at is not None and expires_at <= time.time():
+            del self._data[key]
+            self.expirations += 1
+            return None
+        self._data.move_to_end(key)
+        return entry
+
+    def _set_local(self, key, value, expires_at):
+        self._data[key] = (value, expires_at)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._get_local(key)
+            if entry is not None:
+                self.hits += 1
+                return entry[0]
+        if self.store is not None:
+            try:
+                stored = self.store.get(key)
+            except sqlite3.Error as e:
+                logger.warning("Cache store read error", extra={'cache': self.name, 'error': str(e)})
+                stored = None
+            if stored is not None:
+                with self._lock:
+                    self.hits += 1
+                    self.store_hits += 1
+                    self._set_local(key, stored[0], stored[1])
+                return stored[0]
+        with self._lock:
+            self.misses += 1
+        return default
+
+    def set(self, key, value, ttl=None):
+        expires_at = self._expires_at(ttl)
+        with self._lock:
+            self._set_local(key, value, expires_at)
+        if self.store is not None:
+            try:
+                self.store.set(key, value, expires_at)
+            except sqlite3.Error as e:
+                logger.warning("Cache store write error", extra={'cache': self.name, 'error': str(e)})
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+        if self.store is not None:
+            try:
+                self.store.delete(key)
+            except sqlite3.Error as e:
+                logger.warning("Cache store delete error", extra={'cache': self.name, 'error': str(e)})
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def purge_expired(self):
+        """Drop expired entries here and in the store; returns how many store rows were deleted"""
+        now = time.time()
+        with self._lock:
+            for key in [k for k, (_, expires_at) in self._data.items() if expires_at is not None and expires_at <= now]:
+                del self._data[key]
+                self.expirations += 1
+        if self.store is None:
+            return 0
+        try:
+            return self.store.purge_expired()
+        except sqlite3.Error as e:
+            logger.warning("Cache store purge error", extra={'cache': self.name, 'error': str(e)})
+            return 0
+
+    def get_or_load(self, key, loader, ttl=None):
+        """
+        Return the cached value for key, calling loader() once on a miss.
+
+        Concurrent callers missing the same key share a single loader call.
+        A loader result of None is returned but not cached.
+        """
+        _missing = object()
+        value = self.get(key, _missing)
+        if value is not _missing:
+            return value
+
+        with self._lock:
+            # A load may have finished since the miss above. It stores its value
+            # before leaving _inflight, so checking both under one lock cannot
+            # start a second load
+            entry = self._get_local(key)
+            if entry is not None:
+                return entry[0]
+            call = self._inflight.get(key)
+            leader = call is None
+            if leader:
+                call = _InFlight()
+                self._inflight[key] = call
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.value
+
+        try:
+            with self._lock:
+                self.loads += 1
+            call.value = loader()
+            if call.value is not None:
+                self.set(key, call.value, ttl)
+            return call.value
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            call.event.set()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'name': self.name,
+                'size': len(self._data),
+                'max_size': self.max_size,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'store_hits': self.store_hits,
+                'loads': self.loads,
+                'coalesced': self.coalesced,
+                'persistent': self.store is not None
+            }
@@ -0,0 +1,270 @@
+"""
+Character catalog manifest.
+
+The ready-made character images (nationalities, jobs, football clubs) live in
+static/images/generated/. ``CATALOG`` lists every design the UI knows about;
+``CharacterCatalog`` scans the directory once at startup and records, for each
+design, whether its file exists plus its real format, pixel size and content
+hash. Only designs whose file exists are offered to the browser, so the page
+no longer probes each image before loading it.
+
+Image URLs come from the asset manifest, so after ``build-assets`` they are
+fingerprinted /assets/ URLs served as immutable. The scan is repeated only
+when the directory changes (its mtime moves) and the manifest is rebuilt
+when the asset build is reloaded; content hashes are reused for files whose
+size and mtime are unchanged.
+Image headers are parsed directly, so Pillow is not needed.
+"""
+import hashlib
+import json
+import logging
+import os
+import struct
+import threading
+
+from assets import file_hash
+
+logger = logging.getLogger(__name__)
+
+CATALOG_ROOT = 'images/generated'
+
+# (category key, label, ((item id, display name, file name), ...))
+CATALOG = (
+    ('arabCharacters', 'شخصيات عربية', (
+        ('egyptian', 'Egyptian / مصري', 'arab-egyptian.jpg'),
+        ('saudi', 'Saudi / سعودي', 'arab-saudi.jpg'),
+        ('moroccan', 'Moroccan / مغربي', 'arab-moroccan.jpg'),
+        ('emirati', 'Emirati / إماراتي', 'arab-emirati.jpg'),
+        ('syrian', 'Syrian / سوري', 'arab-syrian.jpg'),
+        ('sudanese', 'Sudanese / سوداني', 'arab-sudanese.jpg'),
+        ('palestinian', 'Palestinian / فلسطيني', 'arab-palestinian.jpg'),
+        ('iraqi', 'Iraqi / عراقي', 'arab-iraqi.jpg'),
+        ('yemeni', 'Yemeni / يمني', 'arab-yemeni.jpg'),
+        ('lebanese', 'Lebanese / لبناني', 'arab-lebanese.jpg'),
+    )),
+    ('foreignCharacters', 'شخصيات أجنبية', (
+        ('italian', 'Italian / إيطالي', 'foreign-italian.jpg'),
+        ('american_cowboy', 'American (Cowboy) / أمريكي (راعي بقر)', 'foreign-american-cowboy.jpg'),
+        ('japanese', 'Japanese / ياباني', 'foreign-japanese.jpg'),
+        ('mexican', 'Mexican / مكسيكي', 'foreign-mexican.jpg'),
+        ('french', 'French / فرنسي', 'foreign-french.jpg'),
+        ('indian', 'Indian / هندي', 'foreign-indian.jpg'),
+        ('british', 'British / بريطاني', 'foreign-british.jpg'),
+        ('spanish', 'Spanish / إسباني', 'foreign-spanish.jpg'),
+        ('russian', 'Russian / روسي', 'foreign-russian.jpg'),
+        ('brazilian', 'Brazilian / برازيلي', 'foreign-brazilian.jpg'),
+    )),
+    ('jobs', 'وظائف ومهن', (
+        ('doctor', 'Doctor / طبيب', 'job-doctor.jpg'),
+        ('chef', 'Chef / طباخ (شيف)', 'job-chef.jpg'),
+        ('police_officer', 'Police Officer / ضابط شرطة', 'job-police-officer.jpg'),
+        ('astronaut', 'Astronaut / رائد فضاء', 'job-astronaut.jpg'),
+        ('firefighter', 'Firefighter / رجل إطفاء', 'job-firefighter.jpg'),
+        ('construction_engineer', 'Construction Engineer / مهندس بناء', 'job-construction-engineer.jpg'),
+        ('pilot', 'Pilot / طيار', 'job-pilot.jpg'),
+        ('farmer', 'Farmer / فلاح (مزارع)', 'job-farmer.jpg'),
+        ('judge', 'Judge / قاضي', 'job-judge.jpg'),
+        ('delivery_rider', 'Delivery Rider / عامل توصيل (دليفري)', 'job-delivery-rider.jpg'),
+    )),
+    ('clubs', 'أندية كرة قدم', (
+        ('alahly', 'Al Ahly SC / النادي الأهلي المصري', 'club-alahly.jpg'),
+        ('zamalek', 'Zamalek SC / نادي الزمالك', 'club-zamalek.jpg'),
+        ('alhilal', 'Al Hilal SFC / نادي الهلال السعودي', 'club-alhilal.jpg'),
+        ('real_madrid', 'Real Madrid / ريال مدريد', 'club-real-madrid.jpg'),
+        ('barcelona', 'FC Barcelona / برشلونة', 'club-barcelona.jpg'),
+        ('man_utd', 'Manchester United / مانشستر يونايتد', 'club-man-utd.jpg'),
+        ('liverpool', 'Liverpool FC / ليفربول', 'club-liverpool.jpg'),
+        ('bayern', 'Bayern Munich / بايرن ميونخ', 'club-bayern.jpg'),
+        ('juventus', 'Juventus FC / يوفنتوس', 'club-juventus.jpg'),
+        ('psg', 'Paris Saint-Germain (PSG) / باريس سان جيرمان', 'club-psg.jpg'),
+    )),
+)
+
+IMAGE_SUFFIXES = ('.jpg', '.jpeg', '.png', '.webp', '.gif')
+
+# JPEG start-of-frame markers (baseline, progressive, lossless, ...) carry the size
+_JPEG_SOF = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+
+def _jpeg_size(f):
+    f.seek(2)
+    while True:
+        marker = f.read(2)
+        if len(marker) < 2 or marker[0] != 0xFF:
+            return None
+        if marker[1] == 0xFF:
+            # Fill byte - the marker code follows
+            f.seek(-1, os.SEEK_CUR)
+            continue
+        length = struct.unpack('>H', f.read(2))[0]
+        if marker[1] in _JPEG_SOF:
+            height, width = struct.unpack('>xHH', f.read(5))
+            return width, height
+        f.seek(length - 2, os.SEEK_CUR)
+
+
+def image_info(path):
+    """(format, width, height) read from the file header, or (None, None, None) if unrecognised"""
+    with open(path, 'rb') as f:
+        head = f.read(32)
+        if head.startswith(b'\x89PNG\r\n\x1a\n') and head[12:16] == b'IHDR':
+            return ('png',) + struct.unpack('>II', head[16:24])
+        if head.startswith(b'\xff\xd8'):
+            size = _jpeg_size(f)
+            return ('jpeg',) + size if size else (None, None, None)
+        if head.startswith((b'GIF87a', b'GIF89a')):
+            return ('gif',) + struct.unpack('<HH', head[6:10])
+        if head.startswith(b'RIFF') and head[8:12] == b'WEBP':
+            chunk = head[12:16]
+            if chunk == b'VP8 ':
+                width, height = struct.unpack('<HH', head[26:30])
+                return 'webp', width & 0x3FFF, height & 0x3FFF
+            if chunk == b'VP8L':
+                bits = int.from_bytes(head[21:25], 'little')
+                return 'webp', (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+            if chunk == b'VP8X':
+                return 'webp', int.from_bytes(head[24:27], 'little') + 1, int.from_bytes(head[27:30], 'little') + 1
+    return None, None, None
+
+
+def _stem(filename):
+    """'foreign-french.jpg.png' -> 'foreign-french' (every image extension removed)"""
+    while filename.lower().endswith(IMAGE_SUFFIXES):
+        filename = os.path.splitext(filename)[0]
+    return filename
+
+
+class CharacterCatalog:
+    """Existence/size/hash index of the catalog images, served as one cached JSON document"""
+
+    def __init__(self, static_dir, assets, root=CATALOG_ROOT, catalog=CATALOG):
+        self.static_dir = static_dir
+        self.assets = assets  # AssetManifest - builds the image URLs
+        self.root = root
+        self.catalog = catalog
+        self.directory = os.path.join(static_dir, *root.split('/'))
+        self._lock = threading.Lock()
+        self._files = {}  # filename -> {'key', 'format', 'width', 'height', 'size', 'hash'}
+        self._dir_mtime = None
+        self._assets_version = None
+        self._payload = None
+        self.scans = 0
+        self.load()
+
+    def _dir_version(self):
+        try:
+            return os.stat(self.directory).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def _scan(self):
+        """Index every image in the directory, rehashing only changed files"""
+        files = {}
+        try:
+            entries = list(os.scandir(self.directory))
+        except FileNotFoundError:
+            entries = []
+        for entry in entries:
+            if not entry.is_file() or not entry.name.lower().endswith(IMAGE_SUFFIXES):
+                continue
+            stat = entry.stat()
+            key = (stat.st_mtime_ns, stat.st_size)
+            previous = self._files.get(entry.name)
+            if previous is not None and previous['key'] == key:
+                files[entry.name] = previous
+                continue
+            try:
+                fmt, width, height = image_info(entry.path)
+                digest = file_hash(entry.path, length=16)
+            except (OSError, struct.error) as e:
+                logger.warning("Skipping catalog image", extra={'file': entry.name, 'error': str(e)})
+                continue
+            if fmt is None:
+                logger.warning("Skipping catalog image", extra={'file': entry.name, 'error': 'unknown format'})
+                continue
+            files[entry.name] = {'key': key, 'format': fmt, 'width': width, 'height': height,
+                                 'size': stat.st_size, 'hash': digest}
+        return files
+
+    def _resolve(self, filename, by_stem):
+        """File on disk for a catalog file name - exact match first, then e.g. 'x.jpg.png' for 'x.jpg'"""
+        if filename in self._files:
+            return filename
+        candidates = by_stem.get(_stem(filename))
+        return candidates[0] if candidates else None
+
+    def _build(self):
+        by_stem = {}
+        for name in sorted(self._files):
+            by_stem.setdefault(_stem(name), []).append(name)
+
+        categories = []
+        missing = []
+        used = set()
+        for key, label, items in self.catalog:
+            available = []
+            for item_id, name, filename in items:
+                found = self._resolve(filename, by_stem)
+                if found is None:
+                    missing.append(f"{self.root}/{filename}")
+                    continue
+                used.add(found)
+                info = self._files[found]
+                available.append({
+                    'id': item_id,
+                    'name': name,
+                    'imageUrl': self.assets.url(f"{self.root}/{found}"),
+                    'width': info['width'],
+                    'height': info['height'],
+                    'format': info['format'],
+                    'size': info['size'],
+                    'hash': info['hash']
+                })
+            categories.append({'key': key, 'label': label, 'items': available})
+
+        payload = {
+            'success': True,
+            'categories': categories,
+            'available': sum(len(c['items']) for c in categories),
+            'missing': missing,
+            'unlisted': sorted(set(self._files) - used)
+        }
+        body = json.dumps(payload, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        return body, hashlib.sha256(body).hexdigest()[:32], payload
+
+    def load(self):
+        """Rescan the directory and rebuild the manifest"""
+        with self._lock:
+            dir_mtime = self._dir_version()
+            assets_version = self.assets.version
+            self._files = self._scan()
+            self._payload = self._build()
+            self._dir_mtime = dir_mtime
+            self._assets_version = assets_version
+            self.scans += 1
+        return self._payload[2]
+
+    def _refresh(self):
+        if self._dir_version() != self._dir_mtime or self.assets.version != self._assets_version:
+            self.load()
+
+    def manifest(self):
+        """(body bytes, etag) of the JSON manifest, rescanning first if the directory or the asset build changed"""
+        self._refresh()
+        body, etag, _ = self._payload
+        return body, etag
+
+    def categories(self):
+        """[(key, label)] of the categories that have at least one image"""
+        self._refresh()
+        return [(c['key'], c['label']) for c in self._payload[2]['categories'] if c['items']]
+
+    def stats(self):
+        payload = self._payload[2]
+        return {
+            'directory': self.directory,
+            'available': payload['available'],
+            'missing': len(payload['missing']),
+            'unlisted': len(payload['unlisted']),
+            'scans': self.scans
+        }
@@ -0,0 +1,228 @@
+"""
+Pooled MySQL connections.
+
+Connections are opened lazily up to ``size`` and handed out from an idle
+queue, so a page view costs a queue pop instead of a full MySQL handshake.
+Each checkout health-checks idle connections and recycles old ones. When the
+pool is exhausted callers wait up to ``timeout`` seconds and then get None,
+the same "no database" result get_db_connection() always had.
+
+Statements run through ``PooledConnection.prepared(sql)`` are server-side
+prepared once per physical connection and reused on later checkouts.
+"""
+import logging
+import queue
+import threading
+import time
+
+import mysql.connector
+from mysql.connector import Error
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+CONNECT_SECONDS = metrics.histogram('db_connect_seconds', 'Time to open a new MySQL connection', ('outcome',))
+
+
+class PooledConnection:
+    """Checked-out connection; close() returns it to the pool"""
+
+    def __init__(self, pool, slot):
+        self._pool = pool
+        self._slot = slot
+        self._closed = False
+
+    def __getattr__(self, name):
+        # Proxy everything else (cursor, commit, rollback, is_connected, ...)
+        return getattr(self._slot.connection, name)
+
+    def prepared(self, sql, dictionary=False):
+        """Cursor for a server-side prepared statement, reused across checkouts"""
+        key = (sql, dictionary)
+        cursor = self._slot.statements.get(key)
+        if cursor is None:
+            cursor = self._slot.connection.cursor(prepared=True, dictionary=dictionary)
+            self._slot.statements[key] = cursor
+        return cursor
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._pool.release(self._slot)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class _Slot:
+    """A physical connection plus its bookkeeping"""
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+        self.statements = {}
+
+    def close(self):
+        for cursor in self.statements.values():
+            try:
+                cursor.close()
+            except Exception:
+                pass
+        self.statements.clear()
+        try:
+            self.connection.close()
+        except Exception:
+            pass
+
+
+class ConnectionPool:
+    """Bounded MySQL connection pool with health checks and wait-time metrics"""
+
+    def __init__(self, config, size=5, timeout=2.0, recycle=3600, ping_interval=30, retry_interval=5, connect=None):
+        self.config = dict(config)
+        # Connection factory called with the config (a stand-in can be passed for benchmarks)
+        self.connect = connect or mysql.connector.connect
+        self.size = size
+        self.timeout = timeout
+        self.recycle = recycle
+        self.ping_interval = ping_interval
+        self.retry_interval = retry_interval
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._open = 0
+        self._in_use = 0
+        self._down_until = 0.0
+        # Metrics
+        self.checkouts = 0
+        self.exhausted = 0
+        self.connects = 0
+        self.connect_errors = 0
+        self.recycled = 0
+        self.failed_pings = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def _connect(self):
+        started = time.perf_counter()
+        try:
+            connection = self.connect(**self.config)
+        except Error:
+            CONNECT_SECONDS.observe(time.perf_counter() - started, 'error')
+            raise
+        CONNECT_SECONDS.observe(time.perf_counter() - started, 'ok')
+        with self._lock:
+            self.connects += 1
+        return _Slot(connection)
+
+    def _discard(self, slot):
+        slot.close()
+        with self._lock:
+            self._open -= 1
+
+    def _healthy(self, slot):
+        """Recycle connections that are too old and ping ones that sat idle"""
+        now = time.monotonic()
+        if self.recycle and now - slot.created_at > self.recycle:
+            with self._lock:
+                self.recycled += 1
+            return False
+        if now - slot.last_used > self.ping_interval:
+            try:
+                slot.connection.ping(reconnect=False)
+            except Error:
+                with self._lock:
+                    self.failed_pings += 1
+                return False
+        return True
+
+    def _record_wait(self, started):
+        waited = time.monotonic() - started
+        with self._lock:
+            self.checkouts += 1
+            self._in_use += 1
+            self.wait_total += waited
+            self.wait_max = max(self.wait_max, waited)
+
+    def acquire(self):
+        """Check out a connection, or return None if the database is unavailable or the pool is exhausted"""
+        started = time.monotonic()
+        deadline = started + self.timeout
+        while True:
+            try:
+                slot = self._idle.get_nowait()
+            except queue.Empty:
+                slot = None
+
+            if slot is None:
+                with self._lock:
+                    can_open = self._open < self.size
+                    if can_open:
+                        if time.monotonic() < self._down_until:
+                            # Recent connect failure - degrade immediately instead of hammering MySQL
+                            return None
+                        self._open += 1
+                if can_open:
+                    try:
+                        slot = self._connect()
+                    except Error as e:
+                        logger.error("Error connecting to MySQL", extra={'error': str(e)})
+                        with self._lock:
+                            self._open -= 1
+                            self.connect_errors += 1
+                            self._down_until = time.monotonic() + self.retry_interval
+                        return None
+                else:
+                    remaining = deadline - time.monotonic()
+                    try:
+                        if remaining <= 0:
+                            raise queue.Empty
+                        slot = self._idle.get(timeout=remaining)
+                    except queue.Empty:
+                        with self._lock:
+                            self.exhausted += 1
+                        logger.warning("Database pool exhausted", extra={'pool_size': self.size})
+                        return None
+
+            if not self._healthy(slot):
+                self._discard(slot)
+                continue
+
+            self._record_wait(started)
+            return PooledConnection(self, slot)
+
+    def release(self, slot):
+        with self._lock:
+            self._in_use -= 1
+        try:
+            if not slot.connection.is_connected():
+                raise Error("connection lost")
+            if slot.connection.in_transaction:
+                slot.connection.rollback()
+        except Error:
+            self._discard(slot)
+            return
+        slot.last_used = time.monotonic()
+        self._idle.put(slot)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': self.size,
+                'open': self._open,
+                'in_use': self._in_use,
+                'idle': self._open - self._in_use,
+                'checkouts': self.checkouts,
+                'exhausted': self.exhausted,
+                'connects': self.connects,
+                'connect_errors': self.connect_errors,
+                'recycled': self.recycled,
+                'failed_pings': self.failed_pings,
+                'wait_avg_ms': round(self.wait_total / self.checkouts * 1000, 3) if self.checkouts else 0.0,
+                'wait_max_ms': round(self.wait_max * 1000, 3)
+            }
@@ -0,0 +1,80 @@
+"""
+Recent-generations gallery read model.
+
+Keeps the newest local images in memory so /home can render the gallery
+without a database round trip. A worker that writes new local rows
+invalidates its cache; the TTL bounds how stale a worker can get when other
+gunicorn workers insert.
+``version`` changes whenever the cached rows do, so output rendered from them
+can be cached under it.
+"""
+import threading
+import time
+
+GALLERY_SIZE = 12
+
+
+def is_local_image(image_url):
+    """Mirror of the generations.is_local column: non-empty and not an http(s) URL"""
+    return bool(image_url) and not image_url.startswith(('http://', 'https://'))
+
+
+class GalleryCache:
+    """Newest-first list of gallery rows with TTL"""
+
+    def __init__(self, size=GALLERY_SIZE, ttl=60):
+        self.size = size
+        self.ttl = ttl
+        self._rows = None
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()
+        self.version = 0
+        self.hits = 0
+        self.misses = 0
+
+    def _fresh(self):
+        return self._rows is not None and (not self.ttl or time.monotonic() - self._loaded_at < self.ttl)
+
+    def get(self, loader):
+        """
+        Return the cached rows, calling loader() on a miss.
+
+        loader returns a list of rows, or None if the database is unavailable
+        (in which case nothing is cached and an empty gallery is returned).
+        """
+        return self.snapshot(loader)[0]
+
+    def snapshot(self, loader):
+        """(rows, version) as of the same moment - see get()"""
+        with self._lock:
+            if self._fresh():
+                self.hits += 1
+                return list(self._rows), self.version
+            self.misses += 1
+        rows = loader()
+        if rows is None:
+            return [], None
+        with self._lock:
+            previous = self._rows
+            self._rows = list(rows[:self.size])
+            self._loaded_at = time.monotonic()
+            # A TTL reload that found the same rows keeps the version
+            if previous is None or [r['id'] for r in previous] != [r['id'] for r in self._rows]:
+                self.version += 1
+            return list(self._rows), self.version
+
+    def invalidate(self):
+        with self._lock:
+            self._rows = None
+            self.version += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'name': 'gallery',
+                'size': len(self._rows) if self._rows is not None else 0,
+                'max_size': self.size,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses
+            }
@@ -0,0 +1,116 @@
+"""
+Gregorian <-> Hijri conversion and Ramadan windows.
+
+Month starts come from the Umm al-Qura dates known to the app
+(``UMM_AL_QURA_RAMADAN``) and otherwise from the tabular Islamic calendar
+(30-year cycle, civil epoch), which stays within a day or two of Umm al-Qura.
+
+Request handlers want ``current_ramadan(today)``: the Ramadan in progress,
+or the next one. ``ramadan_window(year)`` is the first Ramadan that starts in
+a Gregorian year (for per-year artifacts). Both are memoized, so they can be
+called freely. Tests: tests/test_hijri.py.
+"""
+import math
+from datetime import date, timedelta
+from functools import lru_cache
+
+RAMADAN = 9
+
+# Gregorian years the app serves Ramadan windows and timetables for
+MIN_YEAR = 1900
+MAX_YEAR = 2100
+
+# 1 Muharram 1 AH (16 July 622 Julian) as a proleptic Gregorian ordinal
+EPOCH = date(622, 7, 19).toordinal()
+
+# Official Umm al-Qura Ramadan windows: Hijri year -> (first day, last day)
+UMM_AL_QURA_RAMADAN = {
+    1445: (date(2024, 3, 11), date(2024, 4, 9)),
+    1446: (date(2025, 3, 1), date(2025, 3, 29)),
+    1447: (date(2026, 2, 18), date(2026, 3, 19)),
+    1448: (date(2027, 2, 7), date(2027, 3, 8)),
+}
+
+
+def _tabular_ordinal(year, month, day):
+    """Ordinal of a Hijri date in the tabular calendar"""
+    return (day + math.ceil(29.5 * (month - 1)) + (year - 1) * 354
+            + (3 + 11 * year) // 30 + EPOCH - 1)
+
+
+def _tabular_from_ordinal(ordinal):
+    year = (30 * (ordinal - EPOCH) + 10646) // 10631
+    month = min(12, math.ceil((ordinal - (29 + _tabular_ordinal(year, 1, 1))) / 29.5) + 1)
+    day = ordinal - _tabular_ordinal(year, month, 1) + 1
+    return year, month, day
+
+
+def _shift_month(year, month, delta):
+    index = year * 12 + (month - 1) + delta
+    return index // 12, index % 12 + 1
+
+
+def month_start(year, month):
+    """Gregorian date of the first day of a Hijri month"""
+    tabular = date.fromordinal(_tabular_ordinal(year, month, 1))
+    known = UMM_AL_QURA_RAMADAN.get(year)
+    if known is None or month not in (RAMADAN - 1, RAMADAN, RAMADAN + 1):
+        return tabular
+    if month == RAMADAN:
+        return known[0]
+    if month == RAMADAN + 1:
+        return known[1] + timedelta(days=1)
+    # Sha'ban moves with Ramadan so neither month falls outside 29-30 days
+    return tabular + (known[0] - date.fromordinal(_tabular_ordinal(year, RAMADAN, 1)))
+
+
+def to_hijri(day):
+    """Convert a datetime.date to a (year, month, day) Hijri tuple"""
+    year, month, _ = _tabular_from_ordinal(day.toordinal())
+    # A known month start may move the boundary by a day or two either way
+    for delta in (1, 0, -1):
+        y, m = _shift_month(year, month, delta)
+        start = month_start(y, m)
+        if start <= day:
+            return y, m, (day - start).days + 1
+    y, m = _shift_month(year, month, -2)
+    return y, m, (day - month_start(y, m)).days + 1
+
+
+def to_gregorian(year, month, day):
+    """Convert a Hijri date to a datetime.date"""
+    return month_start(year, month) + timedelta(days=day - 1)
+
+
+@lru_cache(maxsize=None)
+def ramadan_of(hijri_year):
+    """(first day, last day) of Ramadan in a Hijri year"""
+    if hijri_year in UMM_AL_QURA_RAMADAN:
+        return UMM_AL_QURA_RAMADAN[hijri_year]
+    start = month_start(hijri_year, RAMADAN)
+    # Ramadan always has 30 days in the tabular calendar
+    return start, start + timedelta(days=29)
+
+
+@lru_cache(maxsize=64)
+def current_ramadan(today):
+    """(first day, last day) of the Ramadan that contains ``today``, or else the next one"""
+    year, month, _ = to_hijri(today)
+    return ramadan_of(year if month <= RAMADAN else year + 1)
+
+
+@lru_cache(maxsize=None)
+def ramadan_window(year):
+    """
+    (first day, last day) of the Ramadan that starts in a Gregorian year.
+
+    In the rare years where two Ramadans start (e.g. 2030), the first is used;
+    use current_ramadan() to find the one that applies to a given day.
+    """
+    hijri_year = to_hijri(date(year, 1, 1))[0]
+    for candidate in (hijri_year, hijri_year + 1):
+        start, end = ramadan_of(candidate)
+        if start.year == year:
+            return start, end
+    raise ValueError(f"No Ramadan starts in {year}")
+
@@ -0,0 +1,225 @@
+"""
+Responsive image derivatives.
+
+Images under static/images/ (or, through ``locate``, generated images in the
+image store) are resized to a fixed set of widths and encoded as AVIF, WebP
+and JPEG on first request (or ahead of time with
+``flask --app app build-images``). Results are cached on disk by source
+content hash, so a changed source gets new derivatives and identical
+sources share them. Each image also gets a tiny blurred placeholder that
+is inlined as a data URI while the real image loads.
+
+Pillow is optional; without it ``available`` is False and callers serve the
+original files.
+"""
+import base64
+import io
+import os
+import threading
+
+try:
+    from PIL import Image, ImageFilter, ImageOps
+except ImportError:
+    # Responsive images disabled - originals are served as before
+    Image = None
+
+from assets import file_hash
+
+WIDTHS = (160, 320, 480, 640, 960)
+IMAGE_SUFFIXES = ('.jpg', '.jpeg', '.png', '.webp')
+PLACEHOLDER_WIDTH = 16
+
+# Output format -> (Pillow format name, MIME type, save options), best first
+FORMATS = {
+    'avif': ('AVIF', 'image/avif', {'quality': 50, 'speed': 6}),
+    'webp': ('WEBP', 'image/webp', {'quality': 75, 'method': 4}),
+    'jpeg': ('JPEG', 'image/jpeg', {'quality': 78, 'optimize': True, 'progressive': True}),
+}
+
+
+def _supported_formats():
+    if Image is None:
+        return ()
+    extensions = Image.registered_extensions()
+    return tuple(fmt for fmt, (pil_name, _, _) in FORMATS.items() if pil_name in extensions.values())
+
+
+class ImagePipeline:
+    """Disk-cached resizer/encoder for images under a static directory"""
+
+    def __init__(self, static_dir, cache_dir, widths=WIDTHS, root='images', max_concurrent=2, locate=None):
+        self.static_dir = static_dir
+        self.cache_dir = cache_dir
+        self.widths = tuple(sorted(widths))
+        self.root = root
+        # name -> source path, instead of names under static_dir/root (e.g. image store keys)
+        self.locate = locate
+        self.formats = _supported_formats()
+        self._versions = {}
+        self._dimensions = {}
+        self._placeholders = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+        # Encoding is CPU heavy - bound how many requests do it at once
+        self._encode_slots = threading.Semaphore(max_concurrent)
+        self.generated = 0
+        self.cache_hits = 0
+
+    @property
+    def available(self):
+        return bool(self.formats)
+
+    def source_path(self, name):
+        """Absolute path of an image under the root (or found by ``locate``), or None if not servable"""
+        if not name.lower().endswith(IMAGE_SUFFIXES):
+            return None
+        if self.locate is not None:
+            path = self.locate(name)
+        else:
+            parts = name.split('/')
+            if not name.startswith(self.root + '/') or any(part in ('', '.', '..') for part in parts):
+                return None
+            path = os.path.join(self.static_dir, *parts)
+        return path if path and os.path.isfile(path) else None
+
+    def version(self, name):
+        """Content hash of the source (memoized until the file changes), or None"""
+        path = self.source_path(name)
+        if path is None:
+            return None
+        stat = os.stat(path)
+        key = (stat.st_mtime_ns, stat.st_size)
+        cached = self._versions.get(name)
+        if cached is None or cached[0] != key:
+            cached = (key, file_hash(path))
+            self._versions[name] = cached
+        return cached[1]
+
+    def _key_lock(self, key):
+        with self._lock:
+            lock = self._locks.get(key)
+            if lock is None:
+                lock = self._locks[key] = threading.Lock()
+            return lock
+
+    def _encode(self, source, width, fmt, blur=False):
+        pil_name, _, options = FORMATS[fmt]
+        with Image.open(source) as image:
+            if image.format == 'JPEG':
+                # Let the JPEG decoder downscale - far cheaper than decoding full size
+                image.draft('RGB', (width, max(1, image.height * width // image.width)))
+            image = ImageOps.exif_transpose(image)
+            if image.width > width:
+                height = max(1, round(image.height * width / image.width))
+                image = image.resize((width, height), Image.LANCZOS)
+            if blur:
+                image = image.filter(ImageFilter.GaussianBlur(1))
+            if fmt == 'jpeg' and image.mode != 'RGB':
+                image = image.convert('RGB')
+            elif image.mode not in ('RGB', 'RGBA'):
+                image = image.convert('RGBA' if 'A' in image.getbands() else 'RGB')
+            buffer = io.BytesIO()
+            image.save(buffer, pil_name, **options)
+            return buffer.getvalue()
+
+    @staticmethod
+    def _write(path, data):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def derivative(self, name, width, fmt):
+        """Path of the cached derivative, generating it on first use; None if unavailable"""
+        if fmt not in self.formats or width not in self.widths:
+            return None
+        version = self.version(name)
+        if version is None:
+            return None
+        path = os.path.join(self.cache_dir, version[:2], version, f"{width}.{fmt}")
+        if os.path.exists(path):
+            self.cache_hits += 1
+            return path
+        with self._key_lock(path):
+            if os.path.exists(path):
+                self.cache_hits += 1
+                return path
+            with self._encode_slots:
+                data = self._encode(self.source_path(name), width, fmt)
+            self._write(path, data)
+            self.generated += 1
+        with self._lock:
+            self._locks.pop(path, None)
+        return path
+
+    def placeholder(self, name):
+        """Tiny blurred JPEG as a data URI, or None"""
+        if not self.available:
+            return None
+        version = self.version(name)
+        if version is None:
+            return None
+        cached = self._placeholders.get(version)
+        if cached is None:
+            path = os.path.join(self.cache_dir, version[:2], version, 'placeholder.jpeg')
+            if not os.path.exists(path):
+                with self._encode_slots:
+                    data = self._encode(self.source_path(name), PLACEHOLDER_WIDTH, 'jpeg', blur=True)
+                self._write(path, data)
+            with open(path, 'rb') as f:
+                cached = 'data:image/jpeg;base64,' + base64.b64encode(f.read()).decode('ascii')
+            self._placeholders[version] = cached
+        return cached
+
+    def dimensions(self, name):
+        """(width, height) of the source as displayed, or None"""
+        version = self.version(name) if Image is not None else None
+        if version is None:
+            return None
+        size = self._dimensions.get(version)
+        if size is None:
+            with Image.open(self.source_path(name)) as image:
+                size = image.size
+                # EXIF orientations 5-8 are rotated by 90 degrees
+                if image.getexif().get(0x0112) in (5, 6, 7, 8):
+                    size = size[::-1]
+            self._dimensions[version] = size
+        return size
+
+    def widths_for(self, name):
+        """Widths worth offering - never upscale past the source"""
+        size = self.dimensions(name)
+        if size is None:
+            return ()
+        widths = [w for w in self.widths if w < size[0]]
+        # The largest width covers the full source resolution
+        return tuple(widths + [w for w in self.widths if w >= size[0]][:1])
+
+    def names(self):
+        """Every servable image under the root"""
+        base = os.path.join(self.static_dir, self.root)
+        for directory, _, files in os.walk(base):
+            for filename in sorted(files):
+                name = os.path.relpath(os.path.join(directory, filename), self.static_dir).replace(os.sep, '/')
+                if self.source_path(name):
+                    yield name
+
+    def build_all(self):
+        """Generate every derivative and placeholder ahead of time; returns the number of files written"""
+        before = self.generated
+        for name in self.names():
+            for width in self.widths_for(name):
+                for fmt in self.formats:
+                    self.derivative(name, width, fmt)
+            self.placeholder(name)
+        return self.generated - before
+
+    def stats(self):
+        return {
+            'available': self.available,
+            'formats': list(self.formats),
+            'widths': list(self.widths),
+            'generated': self.generated,
+            'cache_hits': self.cache_hits
+        }
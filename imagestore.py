@@ -0,0 +1,265 @@
+"""
+Content-addressed store for generated images.
+
+Images are written once under the SHA-256 of their bytes, sharded two levels
+deep so no directory grows too large:
+
+    <root>/3f/2a/3f2a1b...c9.png   (key "3f2a1b...c9.png", URL /media/<key>)
+
+``put(chunks)`` streams bytes to a temporary file while hashing them, checks
+the magic bytes, and moves the file into place. Identical outputs therefore
+share one file. Since a key never changes content, it can be served as
+immutable.
+
+``collect(referenced)`` is the garbage collector. It deletes files that no
+row references once they are older than the grace period (which covers rows
+still waiting in the write-behind buffer). If the store is still over
+``max_bytes`` it then evicts the least recently stored files. Only one
+process collects at a time.
+
+``put`` of bytes that are already stored reuses the file and refreshes its
+mtime. That happens under a shared lock on ``store.lock``; the collector
+deletes under the exclusive lock and re-checks each file's mtime first, so
+a file reused after the scan is kept.
+"""
+import hashlib
+import logging
+import os
+import re
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: no cross-process locks around collection
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Extension -> MIME type of the formats accepted into the store
+FORMATS = {
+    'jpg': 'image/jpeg',
+    'png': 'image/png',
+    'gif': 'image/gif',
+    'webp': 'image/webp',
+    'avif': 'image/avif',
+}
+
+KEY_RE = re.compile(r'^([0-9a-f]{64})\.(' + '|'.join(FORMATS) + r')$')
+SNIFF_BYTES = 32
+
+
+def sniff(head):
+    """Extension for the image format in the first bytes of a file, or None"""
+    if head.startswith(b'\xff\xd8\xff'):
+        return 'jpg'
+    if head.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'png'
+    if head.startswith((b'GIF87a', b'GIF89a')):
+        return 'gif'
+    if head.startswith(b'RIFF') and head[8:12] == b'WEBP':
+        return 'webp'
+    if head[4:8] == b'ftyp' and head[8:12] in (b'avif', b'avis'):
+        return 'avif'
+    return None
+
+
+class ImageStore:
+    """Sharded, deduplicating image files keyed by content hash"""
+
+    def __init__(self, root, max_bytes=2 << 30, max_file_bytes=20 << 20, collect_interval=3600):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.max_file_bytes = max_file_bytes
+        self.collect_interval = collect_interval
+        self._next_collect = time.monotonic() + collect_interval
+        self.tmp_dir = os.path.join(root, 'tmp')
+        self._lock = threading.Lock()
+        self.stored = 0
+        self.deduplicated = 0
+        self.rejected = 0
+        self.last_collect = None
+
+    @staticmethod
+    def valid_key(key):
+        return bool(KEY_RE.match(key or ''))
+
+    def path(self, key):
+        """Absolute path for a key (which is not checked for existence), or None if the key is malformed"""
+        if not self.valid_key(key):
+            return None
+        return os.path.join(self.root, key[:2], key[2:4], key)
+
+    @staticmethod
+    def mimetype(key):
+        return FORMATS[key.rsplit('.', 1)[1]]
+
+    @contextmanager
+    def _store_lock(self, exclusive):
+        """Shared by put() while it reuses or adds a file, exclusive while collect() deletes"""
+        os.makedirs(self.root, exist_ok=True)
+        fd = os.open(os.path.join(self.root, 'store.lock'), os.O_WRONLY | os.O_CREAT, 0o644)
+        try:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            yield
+        finally:
+            os.close(fd)
+
+    def put(self, chunks):
+        """Store an image from an iterable of byte chunks; returns its key"""
+        os.makedirs(self.tmp_dir, exist_ok=True)
+        tmp_path = os.path.join(self.tmp_dir, f"{uuid.uuid4().hex}.part")
+        digest = hashlib.sha256()
+        head = b''
+        size = 0
+        try:
+            with open(tmp_path, 'wb') as f:
+                for chunk in chunks:
+                    size += len(chunk)
+                    if size > self.max_file_bytes:
+                        raise ValueError(f"image larger than {self.max_file_bytes} bytes")
+                    if len(head) < SNIFF_BYTES:
+                        head += chunk[:SNIFF_BYTES - len(head)]
+                    digest.update(chunk)
+                    f.write(chunk)
+            ext = sniff(head)
+            if ext is None:
+                raise ValueError("not a supported image format")
+            key = f"{digest.hexdigest()}.{ext}"
+            path = self.path(key)
+            with self._store_lock(exclusive=False):
+                if os.path.exists(path):
+                    # Same bytes already stored - refresh its age for eviction
+                    os.utime(path)
+                    with self._lock:
+                        self.deduplicated += 1
+                    return key
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.replace(tmp_path, path)
+            with self._lock:
+                self.stored += 1
+            return key
+        except ValueError:
+            with self._lock:
+                self.rejected += 1
+            raise
+        finally:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+
+    def put_bytes(self, data):
+        return self.put([bytes(data)])
+
+    def entries(self):
+        """(key, size, mtime) of every stored image"""
+        try:
+            shards = os.scandir(self.root)
+        except FileNotFoundError:
+            return
+        with shards:
+            for shard in shards:
+                if not shard.is_dir() or len(shard.name) != 2:
+                    continue
+                for sub in os.scandir(shard.path):
+                    if not sub.is_dir():
+                        continue
+                    for entry in os.scandir(sub.path):
+                        if self.valid_key(entry.name):
+                            stat = entry.stat()
+                            yield entry.name, stat.st_size, stat.st_mtime
+
+    def _remove(self, key, mtime):
+        """Delete an image unless put() reused it after it was scanned; caller holds the store lock"""
+        path = self.path(key)
+        try:
+            if os.stat(path).st_mtime != mtime:
+                return False
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+        return True
+
+    def _sweep_tmp(self, before):
+        """Remove partial uploads left by crashed processes"""
+        try:
+            entries = list(os.scandir(self.tmp_dir))
+        except FileNotFoundError:
+            return
+        for entry in entries:
+            if entry.name.endswith('.part') and entry.stat().st_mtime < before:
+                os.unlink(entry.path)
+
+    def collect_due(self):
+        """True at most once per ``collect_interval`` in this process (0 = never)"""
+        if not self.collect_interval:
+            return False
+        with self._lock:
+            now = time.monotonic()
+            if now < self._next_collect:
+                return False
+            self._next_collect = now + self.collect_interval
+            return True
+
+    def collect(self, referenced, grace=3600, now=None):
+        """
+        Delete unreferenced images older than ``grace`` seconds, then evict the
+        oldest images until the store fits in ``max_bytes``.
+
+        Returns a summary with the evicted keys (those were still referenced),
+        or None if another process is collecting.
+        """
+        now = now if now is not None else time.time()
+        os.makedirs(self.root, exist_ok=True)
+        lock_fd = os.open(os.path.join(self.root, 'gc.lock'), os.O_WRONLY | os.O_CREAT, 0o644)
+        try:
+            if fcntl is not None:
+                try:
+                    fcntl.flock(lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    return None
+            self._sweep_tmp(now - grace)
+            entries = list(self.entries())
+            kept = []
+            orphans = 0
+            freed = 0
+            evicted = []
+            with self._store_lock(exclusive=True):
+                for key, size, mtime in entries:
+                    if key not in referenced and mtime < now - grace and self._remove(key, mtime):
+                        orphans += 1
+                        freed += size
+                    else:
+                        kept.append((mtime, key, size))
+                total = sum(size for _, _, size in kept)
+                for mtime, key, size in sorted(kept):
+                    if total <= self.max_bytes:
+                        break
+                    if not self._remove(key, mtime):
+                        continue
+                    total -= size
+                    freed += size
+                    evicted.append(key)
+            if evicted:
+                logger.warning("Image store over budget", extra={'evicted': len(evicted), 'max_bytes': self.max_bytes})
+            summary = {'files': len(kept) - len(evicted), 'bytes': total, 'orphans': orphans,
+                       'evicted': evicted, 'freed': freed}
+            self.last_collect = {**summary, 'evicted': len(evicted), 'at': now}
+            return summary
+        finally:
+            os.close(lock_fd)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'root': self.root,
+                'max_bytes': self.max_bytes,
+                'stored': self.stored,
+                'deduplicated': self.deduplicated,
+                'rejected': self.rejected,
+                'last_collect': self.last_collect
+            }
+
@@ -0,0 +1,518 @@
+"""
+Background job queue for image generation.
+
+/generate enqueues a job and returns immediately; a bounded pool of worker
+threads runs the generator. Jobs have priorities (higher runs first),
+cancellation and a per-job timeout, and are persisted through a pluggable
+store so their status can be read from any gunicorn worker:
+
+    MemoryJobStore   in-process only (tests, single-process servers)
+    SQLiteJobStore   local file shared by the workers on one host
+    MySQLJobStore    generation_jobs table next to generations
+
+The runner executes on the worker thread, so ``workers`` bounds how many
+generations run at once. Python threads can't be killed, so timeouts and
+cancellation are cooperative: a watchdog marks a job timed_out when its
+deadline passes and sets its cancel event, and the runner is expected to
+call ``job.check()`` between steps and to pass ``job.remaining()`` as the
+timeout of blocking calls. A result that arrives after that is discarded.
+"""
+import abc
+import heapq
+import itertools
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+QUEUED = 'queued'
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+TIMED_OUT = 'timed_out'
+TERMINAL_STATUSES = (SUCCEEDED, FAILED, CANCELLED, TIMED_OUT)
+
+
+class QueueFullError(Exception):
+    """Raised when the queue already holds max_queued jobs"""
+
+
+class JobError(Exception):
+    """Raised by a runner to fail a job with a specific error type"""
+
+    def __init__(self, message, error_type='api_error'):
+        super().__init__(message)
+        self.error_type = error_type
+
+
+class JobAborted(JobError):
+    """Raised by Job.check() once the job is cancelled or past its deadline"""
+
+
+class Job:
+    """A single generation request and its lifecycle"""
+
+    FIELDS = ('id', 'prompt', 'priority', 'status', 'result', 'error', 'error_type',
+              'timeout', 'created_at', 'started_at', 'finished_at', 'version')
+
+    def __init__(self, prompt, priority=5, timeout=120, id=None, status=QUEUED, result=None,
+                 error=None, error_type=None, created_at=None, started_at=None,
+                 finished_at=None, version=0):
+        self.id = id or uuid.uuid4().hex
+        self.prompt = prompt
+        self.priority = priority
+        self.status = status
+        self.result = result
+        self.error = error
+        self.error_type = error_type
+        self.timeout = timeout
+        self.created_at = created_at or time.time()
+        self.started_at = started_at
+        self.finished_at = finished_at
+        self.version = version
+        self.cancel_event = threading.Event()
+        self.deadline = None  # time.monotonic() by which the runner must finish
+
+    @property
+    def done(self):
+        return self.status in TERMINAL_STATUSES
+
+    def remaining(self):
+        """Seconds left before the deadline (None without one)"""
+        if self.deadline is None:
+            return None
+        return max(0.0, self.deadline - time.monotonic())
+
+    def check(self):
+        """Raise JobAborted if the job was cancelled or its time is up"""
+        if self.cancel_event.is_set():
+            raise JobAborted("job cancelled", error_type='cancelled')
+        if self.deadline is not None and time.monotonic() >= self.deadline:
+            raise JobAborted("job timed out", error_type='timeout')
+
+    def to_dict(self):
+        return {
+            'job_id': self.id,
+            'status': self.status,
+            'priority': self.priority,
+            'prompt': self.prompt,
+            'result': self.result,
+            'error': self.error,
+            'error_type': self.error_type,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at
+        }
+
+    def to_row(self):
+        return {
+            **{field: getattr(self, field) for field in self.FIELDS},
+            'result': json.dumps(self.result, ensure_ascii=False) if self.result is not None else None
+        }
+
+    @classmethod
+    def from_row(cls, row):
+        data = dict(row)
+        if data.get('result') is not None:
+            data['result'] = json.loads(data['result'])
+        return cls(**{field: data.get(field) for field in cls.FIELDS})
+
+
+class MemoryJobStore:
+    """Jobs kept in a dict - visible to this process only"""
+
+    def __init__(self, max_finished=1000):
+        self.max_finished = max_finished
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def insert(self, job):
+        with self._lock:
+            self._jobs[job.id] = job.to_row()
+            self._trim()
+
+    def update(self, job, expected_status=None):
+        """Write job state; with expected_status, only if the stored status still matches"""
+        with self._lock:
+            row = self._jobs.get(job.id)
+            if row is None or (expected_status and row['status'] != expected_status):
+                return False
+            self._jobs[job.id] = job.to_row()
+            return True
+
+    def get(self, job_id):
+        with self._lock:
+            row = self._jobs.get(job_id)
+        return Job.from_row(row) if row else None
+
+    def pending(self):
+        with self._lock:
+            return [Job.from_row(r) for r in self._jobs.values() if r['status'] in (QUEUED, RUNNING)]
+
+    def _trim(self):
+        finished = [r for r in self._jobs.values() if r['status'] in TERMINAL_STATUSES]
+        if len(finished) > self.max_finished:
+            finished.sort(key=lambda r: r['finished_at'] or 0)
+            for row in finished[:len(finished) - self.max_finished]:
+                del self._jobs[row['id']]
+
+
+class _SQLJobStore(abc.ABC):
+    """
+    Shared SQL for the SQLite and MySQL stores.
+
+    Like MemoryJobStore, only the newest ``max_finished`` finished jobs are
+    kept; the older ones are deleted every ``TRIM_EVERY`` finishes.
+    """
+
+    placeholder = '?'
+    TRIM_EVERY = 100
+
+    def __init__(self, max_finished=1000):
+        self.max_finished = max_finished
+        self._finishes = itertools.count(1)
+
+    @abc.abstractmethod
+    def _execute(self, sql, params=(), fetch=None):
+        """Run one statement; fetch is 'one', 'all' or None (commit and return the rowcount)"""
+
+    def _sql(self, sql):
+        return sql.replace('?', self.placeholder)
+
+    def insert(self, job):
+        row = job.to_row()
+        columns = ', '.join(Job.FIELDS)
+        values = ', '.join('?' for _ in Job.FIELDS)
+        self._execute(self._sql(f"INSERT INTO generation_jobs ({columns}) VALUES ({values})"),
+                      tuple(row[f] for f in Job.FIELDS))
+
+    def update(self, job, expected_status=None):
+        row = job.to_row()
+        fields = [f for f in Job.FIELDS if f != 'id']
+        assignments = ', '.join(f"{f} = ?" for f in fields)
+        sql = f"UPDATE generation_jobs SET {assignments} WHERE id = ?"
+        params = [row[f] for f in fields] + [job.id]
+        if expected_status:
+            sql += " AND status = ?"
+            params.append(expected_status)
+        updated = self._execute(self._sql(sql), tuple(params), fetch='rowcount') > 0
+        if updated and job.status in TERMINAL_STATUSES and next(self._finishes) % self.TRIM_EVERY == 0:
+            self.trim()
+        return updated
+
+    def trim(self):
+        """Delete finished jobs older than the newest ``max_finished``; returns how many"""
+        marks = ', '.join('?' for _ in TERMINAL_STATUSES)
+        row = self._execute(self._sql(
+            f"SELECT finished_at FROM generation_jobs WHERE status IN ({marks}) "
+            f"ORDER BY finished_at DESC LIMIT 1 OFFSET ?"
+        ), TERMINAL_STATUSES + (self.max_finished,), fetch='one')
+        if row is None:
+            return 0
+        return self._execute(self._sql(
+            f"DELETE FROM generation_jobs WHERE status IN ({marks}) AND finished_at <= ?"
+        ), TERMINAL_STATUSES + (row[0],))
+
+    def get(self, job_id):
+        columns = ', '.join(Job.FIELDS)
+        row = self._execute(self._sql(f"SELECT {columns} FROM generation_jobs WHERE id = ?"),
+                            (job_id,), fetch='one')
+        return Job.from_row(dict(zip(Job.FIELDS, row))) if row else None
+
+    def pending(self):
+        columns = ', '.join(Job.FIELDS)
+        rows = self._execute(self._sql(
+            f"SELECT {columns} FROM generation_jobs WHERE status IN (?, ?) ORDER BY created_at"
+        ), (QUEUED, RUNNING), fetch='all')
+        return [Job.from_row(dict(zip(Job.FIELDS, r))) for r in rows]
+
+
+class SQLiteJobStore(_SQLJobStore):
+    """Job table in a local SQLite file (offline stand-in for the MySQL table)"""
+
+    def __init__(self, path, max_finished=1000):
+        super().__init__(max_finished)
+        self.path = path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._execute("""
+            CREATE TABLE IF NOT EXISTS generation_jobs (
+                id TEXT PRIMARY KEY,
+                prompt TEXT NOT NULL,
+                priority INTEGER NOT NULL,
+                status TEXT NOT NULL,
+                result TEXT,
+                error TEXT,
+                error_type TEXT,
+                timeout REAL,
+                created_at REAL NOT NULL,
+                started_at REAL,
+                finished_at REAL,
+                version INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+        self._execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON generation_jobs (status, created_at)")
+        self._execute("CREATE INDEX IF NOT EXISTS idx_jobs_finished ON generation_jobs (status, finished_at)")
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def _execute(self, sql, params=(), fetch=None):
+        conn = self._connection()
+        cursor = conn.execute(sql, params)
+        if fetch == 'one':
+            return cursor.fetchone()
+        if fetch == 'all':
+            return cursor.fetchall()
+        conn.commit()
+        return cursor.rowcount
+
+
+class MySQLJobStore(_SQLJobStore):
+    """generation_jobs table in the application database (see schema.sql)"""
+
+    placeholder = '%s'
+
+    def __init__(self, get_connection, max_finished=1000):
+        super().__init__(max_finished)
+        self.get_connection = get_connection
+
+    def _execute(self, sql, params=(), fetch=None):
+        connection = self.get_connection()
+        if not connection:
+            raise RuntimeError("database unavailable")
+        try:
+            cursor = connection.prepared(sql)
+            cursor.execute(sql, params)
+            if fetch == 'one':
+                return cursor.fetchone()
+            if fetch == 'all':
+                return cursor.fetchall()
+            connection.commit()
+            return cursor.rowcount
+        finally:
+            connection.close()
+
+
+class JobQueue:
+    """Priority queue of jobs executed by a bounded pool of worker threads"""
+
+    def __init__(self, runner, store=None, workers=2, max_queued=100, default_timeout=120):
+        self.runner = runner
+        self.store = store or MemoryJobStore()
+        self.workers = workers
+        self.max_queued = max_queued
+        self.default_timeout = default_timeout
+        self._heap = []
+        self._seq = itertools.count()
+        self._jobs = {}
+        self._cond = threading.Condition()
+        self._threads = []
+        self._running = {}
+        self._started = False
+        self.counters = {'submitted': 0, SUCCEEDED: 0, FAILED: 0, CANCELLED: 0, TIMED_OUT: 0}
+
+    def start(self):
+        """Start the workers and re-enqueue jobs left pending by a previous process"""
+        with self._cond:
+            if self._started:
+                return
+            self._started = True
+        try:
+            now = time.time()
+            for job in self.store.pending():
+                if job.status == RUNNING:
+                    # Only take over jobs whose worker is gone (past their timeout)
+                    if now - (job.started_at or 0) < (job.timeout or self.default_timeout):
+                        continue
+                    job.status = QUEUED
+                    if not self.store.update(job, expected_status=RUNNING):
+                        continue
+                self._push(job)
+        except Exception as e:
+            logger.error("Could not restore pending jobs", extra={'error': str(e)})
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f"job-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        threading.Thread(target=self._watchdog, name='job-watchdog', daemon=True).start()
+
+    def _push(self, job):
+        with self._cond:
+            self._jobs[job.id] = job
+            heapq.heappush(self._heap, (-job.priority, next(self._seq), job.id))
+            self._cond.notify_all()
+
+    def submit(self, prompt, priority=5, timeout=None):
+        """Queue a job and return it; raises QueueFullError when the queue is full"""
+        with self._cond:
+            queued = sum(1 for j in self._jobs.values() if j.status == QUEUED)
+            if queued >= self.max_queued:
+                raise QueueFullError("job queue is full")
+            self.counters['submitted'] += 1
+        job = Job(prompt, priority=priority, timeout=timeout or self.default_timeout)
+        self.store.insert(job)
+        self._push(job)
+        self.start()
+        return job
+
+    def get(self, job_id):
+        """Current job state from this process, or from the store for other workers' jobs"""
+        self.start()
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if job is not None and (job.done or job_id in self._running):
+                return job
+        # Another worker process may have claimed or finished a job queued here
+        stored = self.store.get(job_id)
+        if stored is None or (job is not None and stored.status == QUEUED):
+            return job
+        return stored
+
+    def wait(self, timeout):
+        """Block until any job changes state (or the timeout passes)"""
+        with self._cond:
+            self._cond.wait(timeout)
+
+    def cancel(self, job_id):
+        """Cancel a queued or running job; returns the job, or None if unknown"""
+        job = self.get(job_id)
+        if job is None or job.done:
+            return job
+        previous = job.status
+        job.cancel_event.set()
+        self._finish(job, CANCELLED, expected_status=previous)
+        return self.get(job_id)
+
+    def _finish(self, job, status, result=None, error=None, error_type=None, expected_status=RUNNING):
+        with self._cond:
+            if job.done:
+                return False
+            job.status = status
+            job.result = result
+            job.error = error
+            job.error_type = error_type
+            job.finished_at = time.time()
+            job.version += 1
+            self.counters[status] += 1
+            self._cond.notify_all()
+        try:
+            # Conditional write: a cancel from another worker wins over a late result
+            if not self.store.update(job, expected_status=expected_status):
+                stored = self.store.get(job.id)
+                if stored is not None:
+                    with self._cond:
+                        job.status = stored.status
+                        job.result = stored.result
+        except Exception as e:
+            logger.error("Could not persist job", extra={'job_id': job.id, 'error': str(e)})
+        return True
+
+    def _next(self):
+        with self._cond:
+            while True:
+                while not self._heap:
+                    self._cond.wait()
+                _, _, job_id = heapq.heappop(self._heap)
+                job = self._jobs.get(job_id)
+                if job is not None and job.status == QUEUED:
+                    return job
+
+    def _work(self):
+        while True:
+            job = self._next()
+
+            with self._cond:
+                job.status = RUNNING
+                job.started_at = time.time()
+                job.deadline = time.monotonic() + job.timeout if job.timeout else None
+                job.version += 1
+            try:
+                # Claim the job; fails if it was cancelled or claimed through another worker process
+                claimed = self.store.update(job, expected_status=QUEUED)
+            except Exception as e:
+                logger.error("Could not persist job", extra={'job_id': job.id, 'error': str(e)})
+                claimed = True
+            if not claimed:
+                stored = self.store.get(job.id)
+                with self._cond:
+                    job.status = stored.status if stored is not None else CANCELLED
+                    self._cond.notify_all()
+                continue
+            with self._cond:
+                self._cond.notify_all()
+
+            self._run(job)
+            self._forget_finished()
+
+    def _run(self, job):
+        with self._cond:
+            self._running[job.id] = job
+            self._cond.notify_all()  # the watchdog waits for the new deadline
+        try:
+            result = self.runner(job)
+        except Exception as e:
+            if job.deadline is not None and time.monotonic() >= job.deadline:
+                self._time_out(job)
+            else:
+                # Already final if it was cancelled or timed out - then this does nothing
+                self._finish(job, FAILED, error=str(e), error_type=getattr(e, 'error_type', 'api_error'))
+        else:
+            if job.deadline is not None and time.monotonic() >= job.deadline:
+                self._time_out(job)
+            else:
+                self._finish(job, SUCCEEDED, result=result)
+        finally:
+            with self._cond:
+                self._running.pop(job.id, None)
+
+    def _time_out(self, job):
+        job.cancel_event.set()
+        self._finish(job, TIMED_OUT, error='انتهت مهلة توليد الصورة', error_type='timeout')
+
+    def _watchdog(self):
+        """Mark running jobs timed_out as soon as their deadline passes"""
+        while True:
+            with self._cond:
+                now = time.monotonic()
+                deadlines = [j.deadline for j in self._running.values() if j.deadline is not None and not j.done]
+                overdue = [j for j in self._running.values()
+                           if j.deadline is not None and j.deadline <= now and not j.done]
+                if not overdue:
+                    self._cond.wait(min(deadlines) - now if deadlines else None)
+                    continue
+            for job in overdue:
+                # The worker stays busy until the runner returns; the late result is discarded
+                self._time_out(job)
+
+    def _forget_finished(self, keep=1000):
+        with self._cond:
+            finished = [j for j in self._jobs.values() if j.done]
+            if len(finished) > keep:
+                finished.sort(key=lambda j: j.finished_at or 0)
+                for job in finished[:len(finished) - keep]:
+                    del self._jobs[job.id]
+
+    def stats(self):
+        with self._cond:
+            statuses = {}
+            for job in self._jobs.values():
+                statuses[job.status] = statuses.get(job.status, 0) + 1
+            return {
+                'workers': self.workers,
+                'max_queued': self.max_queued,
+                'queued': statuses.get(QUEUED, 0),
+                'running': statuses.get(RUNNING, 0),
+                **self.counters
+            }
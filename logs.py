@@ -0,0 +1,74 @@
+"""
+Structured logging.
+
+Modules log through the standard library (``logger = logging.getLogger(__name__)``)
+and pass their fields with ``extra``::
+
+    logger.info("Iftar times collected", extra={'total_times': 930, 'countries': 22})
+
+``configure()`` installs one handler on the root logger that writes either
+one JSON object per line (LOG_FORMAT=json, for log shippers) or logfmt-style
+``key=value`` lines (LOG_FORMAT=text, the default).
+"""
+import json
+import logging
+import sys
+from datetime import datetime, timezone
+
+# Attributes every LogRecord has - anything else came from extra=
+_RECORD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime', 'taskName'}
+
+
+def _fields(record):
+    return {key: value for key, value in vars(record).items() if key not in _RECORD_ATTRS}
+
+
+def _timestamp(record):
+    return datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds')
+
+
+class JSONFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'ts': _timestamp(record),
+            'level': record.levelname.lower(),
+            'logger': record.name,
+            'msg': record.getMessage(),
+            **_fields(record)
+        }
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class KeyValueFormatter(logging.Formatter):
+    @staticmethod
+    def _quote(value):
+        text = str(value)
+        if not text or any(c in text for c in ' ="'):
+            return json.dumps(text, ensure_ascii=False)
+        return text
+
+    def format(self, record):
+        parts = [
+            f"ts={_timestamp(record)}",
+            f"level={record.levelname.lower()}",
+            f"logger={record.name}",
+            f"msg={self._quote(record.getMessage())}"
+        ]
+        parts.extend(f"{key}={self._quote(value)}" for key, value in _fields(record).items())
+        line = ' '.join(parts)
+        if record.exc_info:
+            line += '\n' + self.formatException(record.exc_info)
+        return line
+
+
+def configure(fmt='text', level='INFO'):
+    """Send all logging to stderr in the chosen format (replaces earlier handlers)"""
+    handler = logging.StreamHandler(sys.stderr)
+    handler.setFormatter(JSONFormatter() if fmt == 'json' else KeyValueFormatter())
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(level.upper() if isinstance(level, str) else level)
@@ -0,0 +1,420 @@
+"""
+In-process metrics exposed in the Prometheus text format.
+
+Counters and histograms are updated on the request path, so every thread
+writes to a shard of its own - no lock is taken per observation. The shards
+are summed when /metrics is scraped; shards of finished threads are folded
+into a running total so short-lived threads do not pile up.
+
+Gauges read a callback at scrape time (pool sizes, queue depths, ...).
+
+Each gunicorn worker keeps its own numbers. With ``REGISTRY.share(SQLiteShare(path))``
+every worker publishes a snapshot of them to a SQLite file shared by the
+workers on the host (every few seconds, and by the scraped worker just before
+it answers), so whichever worker answers /metrics reports the counters and
+histograms summed over all workers. Snapshots of workers that exited are
+folded into a running total, so the sums do not drop when gunicorn replaces
+a worker. Gauges stay per worker, with a ``worker`` label.
+
+Without a shared file each worker reports only its own numbers, every sample
+labelled with ``worker``.
+
+    REQUEST_SECONDS = metrics.histogram('http_request_duration_seconds', 'Request latency',
+                                        ('endpoint', 'method', 'status'))
+    REQUEST_SECONDS.observe(0.012, 'home', 'GET', '200')
+    with REQUEST_SECONDS.time('home', 'GET', '200'):
+        ...
+"""
+import abc
+import atexit
+import bisect
+import json
+import logging
+import math
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+class _ShardedMetric(abc.ABC):
+    """Per-thread shards of {label values: [numbers]}, merged on collect"""
+
+    kind = None
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.reset()
+
+    def reset(self):
+        """Drop every number (a forked worker starts from zero)"""
+        self._local = threading.local()
+        self._shards = {}  # thread -> shard
+        self._retired = {}
+        self._lock = threading.Lock()
+
+    @abc.abstractmethod
+    def _new_values(self):
+        """Zeroed numbers for a new label set"""
+
+    def _shard(self):
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = self._local.shard = {}
+            with self._lock:
+                self._retire_finished()
+                self._shards[threading.current_thread()] = shard
+        return shard
+
+    def _values(self, labels):
+        shard = self._shard()
+        values = shard.get(labels)
+        if values is None:
+            if len(labels) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}, got {labels}")
+            values = shard[labels] = self._new_values()
+        return values
+
+    @staticmethod
+    def _merge(target, shard):
+        for labels, values in shard.items():
+            total = target.get(labels)
+            if total is None:
+                target[labels] = list(values)
+            else:
+                for i, value in enumerate(values):
+                    total[i] += value
+
+    def _retire_finished(self):
+        # Caller holds the lock; a finished thread never writes to its shard again
+        for thread in [t for t in self._shards if not t.is_alive()]:
+            self._merge(self._retired, self._shards.pop(thread))
+
+    def collect(self):
+        """{label values: merged numbers} across all threads"""
+        with self._lock:
+            self._retire_finished()
+            merged = {labels: list(values) for labels, values in self._retired.items()}
+            shards = list(self._shards.values())
+        for shard in shards:
+            # Another thread may add a label set while we copy
+            self._merge(merged, dict(shard))
+        return merged
+
+
+class Counter(_ShardedMetric):
+    kind = 'counter'
+
+    def _new_values(self):
+        return [0.0]
+
+    def inc(self, *labels, amount=1):
+        self._values(labels)[0] += amount
+
+    def render(self, samples, extra):
+        for labels, (value,) in sorted(samples.items()):
+            yield f"{self.name}_total{_labels(self.labelnames, labels, extra)} {_format_value(value)}"
+
+
+class Histogram(_ShardedMetric):
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_values(self):
+        # One count per bucket, one for +Inf, then the sum
+        return [0] * (len(self.buckets) + 1) + [0.0]
+
+    def observe(self, value, *labels):
+        values = self._values(labels)
+        values[bisect.bisect_left(self.buckets, value)] += 1
+        values[-1] += value
+
+    @contextmanager
+    def time(self, *labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *labels)
+
+    def render(self, samples, extra):
+        for labels, values in sorted(samples.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), values):
+                cumulative += count
+                le = (('le', _format_value(float(bound))),)
+                yield f"{self.name}_bucket{_labels(self.labelnames, labels, tuple(extra) + le)} {cumulative}"
+            yield f"{self.name}_sum{_labels(self.labelnames, labels, extra)} {_format_value(values[-1])}"
+            yield f"{self.name}_count{_labels(self.labelnames, labels, extra)} {cumulative}"
+
+
+class Gauge:
+    """Value(s) read from a callback at scrape time: a number or {label values: number}"""
+
+    kind = 'gauge'
+
+    def __init__(self, name, help_text, callback, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.callback = callback
+        self.labelnames = tuple(labelnames)
+
+    def collect(self):
+        """{label values: [number]} read from the callback"""
+        value = self.callback()
+        samples = value.items() if isinstance(value, dict) else [((), value)]
+        return {tuple(labels): [number] for labels, number in samples if number is not None}
+
+    def render(self, samples, extra):
+        for labels, (number,) in sorted(samples.items()):
+            yield f"{self.name}{_labels(self.labelnames, labels, extra)} {_format_value(number)}"
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class SQLiteShare:
+    """Per-worker metric snapshots in a SQLite file shared by every process on the host"""
+
+    # Dead workers' counters and histograms are summed into this pid
+    RETIRED = 0
+
+    def __init__(self, path, interval=10, alive=_alive):
+        self.path = path
+        self.interval = interval
+        self.alive = alive  # pid -> whether the worker is still running
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._connection().execute(
+            "CREATE TABLE IF NOT EXISTS metric_samples ("
+            "pid INTEGER NOT NULL, kind TEXT NOT NULL, name TEXT NOT NULL, labels TEXT NOT NULL, "
+            "vals TEXT NOT NULL, PRIMARY KEY (pid, name, labels)) WITHOUT ROWID"
+        )
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        # A connection must not cross a fork (gunicorn --preload)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def publish(self, pid, samples):
+        """Replace the snapshot of one worker; samples are (kind, name, label values, numbers)"""
+        rows = [(pid, kind, name, json.dumps(list(labels)), json.dumps(values))
+                for kind, name, labels, values in samples]
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM metric_samples WHERE pid = ?", (pid,))
+            conn.executemany("INSERT INTO metric_samples VALUES (?, ?, ?, ?, ?)", rows)
+
+    def retire(self):
+        """Fold the counters and histograms of workers that exited into the running total; drop their gauges"""
+        with self._transaction() as conn:
+            pids = [row[0] for row in conn.execute(
+                "SELECT DISTINCT pid FROM metric_samples WHERE pid != ?", (self.RETIRED,))]
+            dead = [pid for pid in pids if not self.alive(pid)]
+            for pid in dead:
+                rows = conn.execute(
+                    "SELECT kind, name, labels, vals FROM metric_samples WHERE pid = ? AND kind != 'gauge'", (pid,)
+                ).fetchall()
+                for kind, name, labels, vals in rows:
+                    total = conn.execute(
+                        "SELECT vals FROM metric_samples WHERE pid = ? AND name = ? AND labels = ?",
+                        (self.RETIRED, name, labels)
+                    ).fetchone()
+                    values = json.loads(vals)
+                    if total is not None:
+                        values = [a + b for a, b in zip(json.loads(total[0]), values)]
+                    conn.execute("INSERT OR REPLACE INTO metric_samples VALUES (?, ?, ?, ?, ?)",
+                                 (self.RETIRED, kind, name, labels, json.dumps(values)))
+                conn.execute("DELETE FROM metric_samples WHERE pid = ?", (pid,))
+        return dead
+
+    def read(self):
+        """[(pid, name, label values, numbers)] of every worker"""
+        return [(pid, name, tuple(json.loads(labels)), json.loads(vals)) for pid, name, labels, vals in
+                self._connection().execute("SELECT pid, name, labels, vals FROM metric_samples")]
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+        self.store = None  # SQLiteShare
+        self._stop = threading.Event()
+        self._thread = None
+
+    def register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric {metric.name} already registered")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def _collect(self):
+        """[(metric, samples or the exception raised while collecting)] of this process"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        collected = []
+        for metric in metrics:
+            try:
+                collected.append((metric, metric.collect()))
+            except Exception as e:
+                collected.append((metric, e))
+        return collected
+
+    def publish(self):
+        """Write this worker's snapshot to the shared store"""
+        samples = [(metric.kind, metric.name, labels, values)
+                   for metric, collected in self._collect() if not isinstance(collected, Exception)
+                   for labels, values in collected.items()]
+        self.store.publish(os.getpid(), samples)
+
+    def share(self, store):
+        """Publish to ``store`` (SQLiteShare) in the background, and render every worker's numbers"""
+        self.store = store
+        self._start()
+        os.register_at_fork(after_in_child=self._after_fork)
+        atexit.register(self._stop_publishing)
+
+    def _after_fork(self):
+        # The parent publishes its own numbers - a forked worker (gunicorn --preload) starts from zero,
+        # and threads do not survive the fork
+        with self._lock:
+            metrics = list(self._metrics.values())
+        for metric in metrics:
+            if isinstance(metric, _ShardedMetric):
+                metric.reset()
+        self._start()
+
+    def _start(self):
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._publish_loop, args=(self._stop,), name='metrics-publish',
+                                        daemon=True)
+        self._thread.start()
+
+    def _publish_loop(self, stop):
+        while not stop.wait(self.store.interval):
+            try:
+                self.publish()
+            except Exception as e:
+                logger.warning("Metrics publish failed", extra={'path': self.store.path, 'error': str(e)})
+
+    def _stop_publishing(self):
+        self._stop.set()
+        try:
+            # Last snapshot, folded into the total once this process is gone
+            self.publish()
+        except Exception:
+            pass
+
+    def _shared(self):
+        """{metric name: [(extra labels, samples)]} summed over the workers sharing the store"""
+        self.publish()
+        self.store.retire()
+        totals = {}
+        gauges = {}
+        for pid, name, labels, values in self.store.read():
+            metric = self._metrics.get(name)
+            if metric is None:
+                continue
+            if metric.kind == 'gauge':
+                gauges.setdefault(name, {}).setdefault(pid, {})[labels] = values
+            else:
+                _ShardedMetric._merge(totals.setdefault(name, {}), {labels: values})
+        shared = {name: [((), samples)] for name, samples in totals.items()}
+        for name, by_pid in gauges.items():
+            shared[name] = [((('worker', pid),), samples) for pid, samples in sorted(by_pid.items())]
+        return shared
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format"""
+        collected = self._collect()
+        shared = None
+        if self.store is not None:
+            try:
+                shared = self._shared()
+            except Exception as e:
+                logger.warning("Metrics store unavailable", extra={'path': self.store.path, 'error': str(e)})
+        lines = []
+        for metric, samples in collected:
+            name = f"{metric.name}_total" if metric.kind == 'counter' else metric.name
+            lines.append(f"# HELP {name} {metric.help}")
+            lines.append(f"# TYPE {name} {metric.kind}")
+            if isinstance(samples, Exception):
+                lines.append(f"# {metric.name} unavailable: {_escape(samples)}")
+                continue
+            if shared is not None:
+                parts = shared.get(metric.name, [])
+            else:
+                # Only this worker's numbers
+                parts = [((('worker', os.getpid()),), samples)]
+            for extra, part in parts:
+                lines.extend(metric.render(part, extra))
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+
+def counter(name, help_text, labelnames=()):
+    return REGISTRY.register(Counter(name, help_text, labelnames))
+
+
+def histogram(name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+    return REGISTRY.register(Histogram(name, help_text, labelnames, buckets))
+
+
+def gauge(name, help_text, callback, labelnames=()):
+    return REGISTRY.register(Gauge(name, help_text, callback, labelnames))
@@ -0,0 +1,6 @@
+-- Gallery read model for databases created before is_local existed.
+-- mysql -u root -p ramadan_app < migrations/001_gallery_read_model.sql
+
+ALTER TABLE generations
+    ADD COLUMN is_local TINYINT(1) AS (image_url != '' AND image_url NOT LIKE 'http://%' AND image_url NOT LIKE 'https://%') STORED,
+    ADD INDEX idx_gallery (is_local, id);
@@ -0,0 +1,6 @@
+-- Prompt-result dedup for databases created before prompt_hash existed.
+-- mysql -u root -p ramadan_app < migrations/002_prompt_hash.sql
+
+ALTER TABLE generations
+    ADD COLUMN prompt_hash CHAR(64) NULL,
+    ADD INDEX idx_prompt_hash (prompt_hash);
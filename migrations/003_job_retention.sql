@@ -0,0 +1,5 @@
+-- Index for deleting old finished jobs, for databases created before it existed.
+-- mysql -u root -p ramadan_app < migrations/003_job_retention.sql
+
+ALTER TABLE generation_jobs
+    ADD INDEX idx_jobs_finished (status, finished_at);
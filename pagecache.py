@@ -0,0 +1,139 @@
+"""
+Rendered-page cache.
+
+Template output that only changes when its inputs change (the loading page,
+the /home shell, the gallery fragment) is rendered once per key and kept as
+bytes with a strong ETag. Full pages are compressed at most once per
+encoding and entry, on the first request that accepts that encoding, instead
+of on every response.
+
+Keys carry the version of everything the output depends on, e.g.
+``('gallery', gallery_cache.version)``, so a change simply misses and the
+old entry ages out of the LRU. ``ttl`` bounds how long inputs that are not in
+the key (files on disk, settings) can go stale.
+"""
+import gzip
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+try:
+    import brotli
+except ImportError:
+    # gzip only
+    brotli = None
+
+from assets import ENCODINGS, MIN_COMPRESS_SIZE
+
+# Lower levels than the asset build: pages are compressed while a request waits
+COMPRESSORS = {'gzip': lambda data: gzip.compress(data, compresslevel=6, mtime=0)}
+if brotli is not None:
+    COMPRESSORS['br'] = lambda data: brotli.compress(data, quality=5, mode=brotli.MODE_TEXT)
+
+
+class CachedPage:
+    """Rendered body plus its lazily built compressed variants"""
+
+    __slots__ = ('body', 'etag', 'created', '_variants', '_lock')
+
+    def __init__(self, body):
+        self.body = body
+        self.etag = hashlib.sha256(body).hexdigest()[:32]
+        self.created = time.monotonic()
+        self._variants = {}
+        self._lock = threading.Lock()
+
+    def variant(self, accepts):
+        """(body, encoding or None) for a client; ``accepts(encoding)`` tells what it takes"""
+        if len(self.body) < MIN_COMPRESS_SIZE:
+            return self.body, None
+        for encoding, _ in ENCODINGS:
+            if encoding not in COMPRESSORS or not accepts(encoding):
+                continue
+            data = self._variants.get(encoding)
+            if data is None:
+                with self._lock:
+                    data = self._variants.get(encoding)
+                    if data is None:
+                        data = self._variants[encoding] = COMPRESSORS[encoding](self.body)
+            return data, encoding
+        return self.body, None
+
+
+class PageCache:
+    """LRU of CachedPage by tuple key; each key is rendered by one thread at a time"""
+
+    def __init__(self, name='pages', max_size=32, ttl=300):
+        self.name = name
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._rendering = {}  # key -> lock held while that key renders
+        self.hits = 0
+        self.misses = 0
+
+    def _lookup(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if self.ttl and time.monotonic() - entry.created >= self.ttl:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def get(self, key, render):
+        """CachedPage for key, calling render() -> bytes on a miss"""
+        entry = self._lookup(key)
+        if entry is not None:
+            with self._lock:
+                self.hits += 1
+            return entry
+        with self._lock:
+            render_lock = self._rendering.setdefault(key, threading.Lock())
+        try:
+            with render_lock:
+                # Another thread may have rendered it while we waited
+                entry = self._lookup(key)
+                if entry is None:
+                    entry = CachedPage(render())
+                    with self._lock:
+                        self.misses += 1
+                        if self.max_size:
+                            self._entries[key] = entry
+                            while len(self._entries) > self.max_size:
+                                self._entries.popitem(last=False)
+                else:
+                    with self._lock:
+                        self.hits += 1
+        finally:
+            with self._lock:
+                if self._rendering.get(key) is render_lock and not render_lock.locked():
+                    del self._rendering[key]
+        return entry
+
+    def invalidate(self, prefix=None):
+        """Drop every entry, or those whose key starts with ``prefix``"""
+        with self._lock:
+            if prefix is None:
+                self._entries.clear()
+                return
+            for key in [k for k in self._entries if k[0] == prefix]:
+                del self._entries[key]
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'name': self.name,
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / total, 3) if total else 0.0
+            }
+
@@ -0,0 +1,183 @@
+"""
+Local prayer-time engine (Maghrib / Iftar).
+
+Implements the same solar-position algorithm used by PrayTimes / api.aladhan.com
+so that Maghrib can be computed in-process instead of calling the remote API.
+Settings match what we send upstream: method 4 (Umm al-Qura, Makkah) and
+school 0 (Shafi). Maghrib under Umm al-Qura is plain sunset with no offset,
+so the juristic school does not affect it.
+"""
+import math
+from datetime import date, datetime, timedelta
+from functools import lru_cache
+from zoneinfo import ZoneInfo
+
+# Umm al-Qura, Makkah (aladhan method 4)
+METHOD = 4
+SCHOOL = 0
+
+# Sun altitude at sunset: refraction + semi-diameter (no elevation correction)
+RISE_SET_ANGLE = 0.833
+
+# Minutes added to sunset to get Maghrib for method 4
+MAGHRIB_OFFSET_MINUTES = 0
+
+_DEG = math.pi / 180.0
+
+
+def _fix(value, mod):
+    value = value - mod * math.floor(value / mod)
+    return value + mod if value < 0 else value
+
+
+@lru_cache(maxsize=4096)
+def julian_day(year, month, day):
+    """Julian day number at 0h UT for a Gregorian date"""
+    if month <= 2:
+        year -= 1
+        month += 12
+    a = year // 100
+    b = 2 - a + a // 4
+    return math.floor(365.25 * (year + 4716)) + math.floor(30.6001 * (month + 1)) + day + b - 1524.5
+
+
+def sun_position(jd):
+    """Return (declination in degrees, equation of time in hours) for a Julian day"""
+    d = jd - 2451545.0
+    g = _fix(357.529 + 0.98560028 * d, 360.0) * _DEG
+    q = _fix(280.459 + 0.98564736 * d, 360.0)
+    l = _fix(q + 1.915 * math.sin(g) + 0.020 * math.sin(2 * g), 360.0) * _DEG
+    e = (23.439 - 0.00000036 * d) * _DEG
+
+    ra = math.atan2(math.cos(e) * math.sin(l), math.cos(l)) / _DEG / 15.0
+    eqt = q / 15.0 - _fix(ra, 24.0)
+    decl = math.asin(math.sin(e) * math.sin(l)) / _DEG
+    return decl, eqt
+
+
+@lru_cache(maxsize=8192)
+def utc_offset_hours(tz_name, year, month, day):
+    """UTC offset (hours) of a timezone at local noon of the given date"""
+    tz = ZoneInfo(tz_name)
+    offset = datetime(year, month, day, 12, tzinfo=tz).utcoffset()
+    return offset.total_seconds() / 3600.0
+
+
+def sunset_hours(lat, lng, jd):
+    """
+    Sunset in UT hours (may be outside 0..24) for a location and Julian day.
+
+    Returns None when the sun does not set (polar day / night).
+    """
+    # Same single refinement PrayTimes does: start from an 18:00 local guess
+    jdate = jd - lng / (15.0 * 24.0)
+    t = 18.0 / 24.0
+    decl, eqt = sun_position(jdate + t)
+    noon = _fix(12.0 - eqt, 24.0)
+
+    lat_r = lat * _DEG
+    decl_r = decl * _DEG
+    cos_h = (-math.sin(RISE_SET_ANGLE * _DEG) - math.sin(decl_r) * math.sin(lat_r)) / (
+        math.cos(decl_r) * math.cos(lat_r))
+    if cos_h < -1.0 or cos_h > 1.0:
+        return None
+    hour_angle = math.acos(cos_h) / _DEG / 15.0
+    return noon + hour_angle - lng / 15.0
+
+
+def _local_minutes(sunset, offset):
+    """Convert a UT sunset (hours, or None) to local Maghrib minutes since midnight"""
+    if sunset is None:
+        return None
+    local = sunset + offset + MAGHRIB_OFFSET_MINUTES / 60.0
+    # aladhan adds half a minute then truncates
+    local = _fix(local + 0.5 / 60.0, 24.0)
+    return int(math.floor(local * 60.0)) % 1440
+
+
+def maghrib_minutes(lat, lng, day, tz_name):
+    """Maghrib as local minutes since midnight (rounded like aladhan), or None"""
+    sunset = sunset_hours(lat, lng, julian_day(day.year, day.month, day.day))
+    return _local_minutes(sunset, utc_offset_hours(tz_name, day.year, day.month, day.day))
+
+
+def format_minutes(minutes):
+    """Format minutes since midnight as 24-hour HH:MM"""
+    if minutes is None:
+        return '--:--'
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
+
+
+def parse_minutes(value):
+    """Parse 24-hour 'HH:MM' into minutes since midnight (None for missing/invalid)"""
+    try:
+        hours, minutes = (int(x) for x in value.split(':')[:2])
+    except (AttributeError, ValueError):
+        return None
+    return hours * 60 + minutes
+
+
+def get_maghrib(lat, lng, day, tz_name):
+    """Maghrib time for one location/date as a 24-hour 'HH:MM' string"""
+    if isinstance(day, str):
+        day = date.fromisoformat(day)
+    return format_minutes(maghrib_minutes(lat, lng, day, tz_name))
+
+
+def maghrib_matrix(locations, dates):
+    """
+    Batch Maghrib computation.
+
+    Args:
+        locations (list): (lat, lng, tz_name) tuples
+        dates (list): datetime.date objects
+
+    Returns:
+        list: one row per location, each a list of minutes-since-midnight
+              (or None) aligned with ``dates``
+    """
+    # Julian days are shared by all locations, timezone offsets by all
+    # locations in the same zone
+    jds = [julian_day(d.year, d.month, d.day) for d in dates]
+    offsets = {}
+    rows = []
+    for lat, lng, tz_name in locations:
+        if tz_name not in offsets:
+            offsets[tz_name] = [utc_offset_hours(tz_name, d.year, d.month, d.day) for d in dates]
+        rows.append([
+            _local_minutes(sunset_hours(lat, lng, jd), offset)
+            for jd, offset in zip(jds, offsets[tz_name])
+        ])
+    return rows
+
+
+def maghrib_table(countries, dates):
+    """
+    Compute Maghrib for every country and date in a single batch call.
+
+    Args:
+        countries (dict): name -> {'lat', 'lng', 'tz', ...}
+        dates (list): 'YYYY-MM-DD' strings or datetime.date objects
+
+    Returns:
+        dict: name -> {'YYYY-MM-DD': 'HH:MM'}
+    """
+    days = [date.fromisoformat(d) if isinstance(d, str) else d for d in dates]
+    keys = [d.isoformat() for d in days]
+    names = list(countries.keys())
+    locations = [(countries[n]['lat'], countries[n]['lng'], countries[n]['tz']) for n in names]
+    rows = maghrib_matrix(locations, days)
+    return {
+        name: {key: format_minutes(m) for key, m in zip(keys, row)}
+        for name, row in zip(names, rows)
+    }
+
+
+def date_range(start, end):
+    """Inclusive list of dates between two datetime.date objects"""
+    days = []
+    current = start
+    while current <= end:
+        days.append(current)
+        current += timedelta(days=1)
+    return days
@@ -0,0 +1,286 @@
+"""
+Background prefetch of prayer times ahead of the pre-iftar peak.
+
+Traffic to /api/iftar-times peaks in the hour before Maghrib. The scheduler
+refreshes every country's upcoming days into the shared prayer cache
+``lead_minutes`` before its local Maghrib, so requests during the peak are
+served from the cache instead of waiting on the upstream API.
+
+Only one process runs the refreshes: every gunicorn worker starts a
+scheduler, but each round first takes (or renews) a lease row in a SQLite
+file shared by the workers, and only the lease holder refreshes.
+
+While a round of refreshes runs, a background thread renews the lease every
+third of its TTL, so a refresh that takes longer than the TTL (a slow
+upstream) does not let a second worker become leader and run the same
+fan-out. If a renewal fails, the round stops after the current refresh.
+
+The clock is injectable. With ``FakeClock`` the schedule can be driven
+offline by calling ``run_pending()`` after ``clock.advance()`` (see
+tests/test_prefetch.py).
+"""
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+
+import prayer_times
+
+logger = logging.getLogger(__name__)
+
+
+class SystemClock:
+    """Wall clock (epoch seconds)"""
+
+    def now(self):
+        return time.time()
+
+
+class FakeClock:
+    """Manually advanced clock for driving the scheduler offline"""
+
+    def __init__(self, start=0.0):
+        self._now = float(start)
+
+    def now(self):
+        return self._now
+
+    def advance(self, seconds):
+        self._now += seconds
+        return self._now
+
+
+class SQLiteLease:
+    """Time-limited named lease shared by processes through a SQLite file"""
+
+    def __init__(self, path, name='prefetch', ttl=60):
+        self.path = path
+        self.name = name
+        self.ttl = ttl
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        conn = self._connection()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS leases ("
+            "name TEXT PRIMARY KEY, holder TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+        conn.commit()
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def acquire(self, holder, now):
+        """Take the lease if it is free or expired, or renew it if held; returns True if held"""
+        conn = self._connection()
+        conn.execute(
+            "INSERT INTO leases (name, holder, expires_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(name) DO UPDATE SET holder = excluded.holder, expires_at = excluded.expires_at "
+            "WHERE leases.holder = excluded.holder OR leases.expires_at <= ?",
+            (self.name, holder, now + self.ttl, now)
+        )
+        conn.commit()
+        row = conn.execute("SELECT holder FROM leases WHERE name = ?", (self.name,)).fetchone()
+        return row is not None and row[0] == holder
+
+    def release(self, holder):
+        conn = self._connection()
+        conn.execute("DELETE FROM leases WHERE name = ? AND holder = ?", (self.name, holder))
+        conn.commit()
+
+    def holder(self, now):
+        row = self._connection().execute(
+            "SELECT holder, expires_at FROM leases WHERE name = ?", (self.name,)
+        ).fetchone()
+        if row is None or row[1] <= now:
+            return None
+        return row[0]
+
+
+class _LeaseKeeper:
+    """Renews a lease every ``interval`` seconds until stopped; ``lost`` is set if a renewal fails"""
+
+    def __init__(self, renew, interval):
+        self.renew = renew
+        self.interval = interval
+        self.lost = threading.Event()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._loop, name='prefetch-lease', daemon=True)
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            if not self.renew():
+                self.lost.set()
+                return
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+class PrefetchScheduler:
+    """
+    Refresh each location ``lead_minutes`` before its local Maghrib, once a day.
+
+    ``refresh(name, location)`` does the work and returns True when every
+    value was stored; on False or an exception it is retried after
+    ``retry_interval`` seconds. Each location is also refreshed as soon as
+    a process becomes leader.
+    """
+
+    def __init__(self, refresh, locations, lease, clock=None, lead_minutes=90, retry_interval=300):
+        self.refresh = refresh
+        self.locations = locations  # {name: {'lat', 'lng', 'tz', ...}}
+        self.lease = lease
+        self.clock = clock or SystemClock()
+        self.lead_minutes = lead_minutes
+        self.retry_interval = retry_interval
+        self._token = uuid.uuid4().hex[:8]
+        self.is_leader = False
+        self._due = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.refreshes = 0
+        self.failures = 0
+        self.last_run = None
+
+    @property
+    def holder(self):
+        # Includes the current pid so workers forked from a preloaded app get distinct ids
+        return f"{socket.gethostname()}:{os.getpid()}:{self._token}"
+
+    def _renew(self, now):
+        try:
+            return self.lease.acquire(self.holder, now)
+        except sqlite3.Error as e:
+            logger.warning("Prefetch lease error", extra={'error': str(e)})
+            return False
+
+    def next_peak(self, location, after):
+        """Epoch time at which the location's next pre-iftar refresh should run"""
+        tz = ZoneInfo(location['tz'])
+        local_day = datetime.fromtimestamp(after, tz).date()
+        for offset in range(3):
+            day = local_day + timedelta(days=offset)
+            minutes = prayer_times.maghrib_minutes(location['lat'], location['lng'], day, location['tz'])
+            if minutes is None:
+                # No sunset (polar) - fall back to local noon
+                minutes = 12 * 60 + self.lead_minutes
+            midnight = datetime(day.year, day.month, day.day, tzinfo=tz)
+            peak = (midnight + timedelta(minutes=minutes - self.lead_minutes)).timestamp()
+            if peak > after:
+                return peak
+        return after + 24 * 3600
+
+    def run_pending(self):
+        """Run every refresh that is due; returns the names refreshed in this call"""
+        now = self.clock.now()
+        leader = self._renew(now)
+        with self._lock:
+            if leader and not self.is_leader:
+                # New leader: warm everything now, then follow the daily schedule
+                self._due = {name: now for name in self.locations}
+            self.is_leader = leader
+            if not leader:
+                return []
+            due = [name for name, at in self._due.items() if at <= now]
+
+        refreshed = []
+        if not due:
+            self.last_run = now
+            return refreshed
+        # Keep the lease while refreshes run, however long a single one takes
+        with _LeaseKeeper(lambda: self._renew(self.clock.now()), self.lease.ttl / 3) as keeper:
+            for i, name in enumerate(due):
+                # Also renew between refreshes, so a lost lease stops the round early
+                if keeper.lost.is_set() or (i and not self._renew(self.clock.now())):
+                    with self._lock:
+                        self.is_leader = False
+                    break
+                location = self.locations[name]
+                try:
+                    complete = self.refresh(name, location)
+                except Exception as e:
+                    logger.warning("Prefetch failed", extra={'location': name, 'error': str(e)})
+                    complete = False
+                now = self.clock.now()
+                with self._lock:
+                    if complete:
+                        self.refreshes += 1
+                        self._due[name] = self.next_peak(location, now)
+                        refreshed.append(name)
+                    else:
+                        self.failures += 1
+                        self._due[name] = now + self.retry_interval
+            if keeper.lost.is_set():
+                logger.warning("Prefetch lease lost during a refresh round")
+                with self._lock:
+                    self.is_leader = False
+        self.last_run = now
+        return refreshed
+
+    def seconds_until_next(self):
+        """Time until the next refresh is due or the lease needs renewing"""
+        renew = self.lease.ttl / 2
+        with self._lock:
+            if not self.is_leader or not self._due:
+                return renew
+            wait = min(self._due.values()) - self.clock.now()
+        return max(1.0, min(wait, renew))
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                self.run_pending()
+            except Exception:
+                logger.exception("Prefetch scheduler error")
+            self._stop.wait(self.seconds_until_next())
+
+    def start(self):
+        """Start the background thread (idempotent)"""
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._loop, name='prefetch', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+        try:
+            self.lease.release(self.holder)
+        except sqlite3.Error:
+            pass
+
+    def stats(self):
+        with self._lock:
+            next_run = min(self._due.values()) if self.is_leader and self._due else None
+            return {
+                'running': self._thread is not None and not self._stop.is_set(),
+                'leader': self.is_leader,
+                'holder': self.holder,
+                'locations': len(self.locations),
+                'lead_minutes': self.lead_minutes,
+                'refreshes': self.refreshes,
+                'failures': self.failures,
+                'last_run': datetime.utcfromtimestamp(self.last_run).isoformat() + 'Z' if self.last_run else None,
+                'next_run': datetime.utcfromtimestamp(next_run).isoformat() + 'Z' if next_run else None
+            }
+
@@ -0,0 +1,29 @@
+"""
+Content-addressed keys for generated images.
+
+Two prompts that differ only in case, spacing, tatweel or Arabic diacritics
+produce the same image request, so they share one cache key (and one row in
+generations via the prompt_hash column).
+"""
+import hashlib
+import json
+import re
+import unicodedata
+
+_WHITESPACE = re.compile(r'\s+')
+# Arabic diacritics (tashkeel), superscript alef and tatweel
+_ARABIC_MARKS = re.compile(r'[\u064B-\u065F\u0670\u06D6-\u06ED\u0640]')
+
+
+def normalize_prompt(prompt):
+    """Canonical form of a sanitized prompt used for deduplication"""
+    text = unicodedata.normalize('NFKC', prompt or '')
+    text = _ARABIC_MARKS.sub('', text)
+    text = _WHITESPACE.sub(' ', text).strip()
+    return text.casefold()
+
+
+def prompt_key(prompt, settings):
+    """SHA-256 over the normalized prompt plus the generation settings"""
+    payload = json.dumps([normalize_prompt(prompt), settings], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
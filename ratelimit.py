@@ -0,0 +1,290 @@
+"""
+Rate limiting shared by every worker process.
+
+Limits such as ``"10 per minute"`` are enforced with GCRA (a token bucket
+kept as a single "theoretical arrival time" per key): a client may burst up
+to the full amount, after which requests are admitted at the steady rate
+``window / amount``. One float per key is all the state there is, so it is
+cheap to keep in a store shared between gunicorn workers:
+
+    memory://                   this process only (tests, single worker)
+    sqlite:///path/to/file.db   every process on the host (default)
+    redis://host:6379/0         every host (needs the redis package)
+
+``Limiter`` mirrors the Flask-Limiter API the app used (``default_limits``,
+``@limiter.limit(...)``, ``@limiter.exempt``). A route's own limits replace
+the defaults, counters are per route and client address, and static files
+are never limited. If the store fails, requests are let through.
+"""
+import logging
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+
+try:
+    import redis
+except ImportError:
+    # redis:// storage unavailable - sqlite:// covers one host
+    redis = None
+
+logger = logging.getLogger(__name__)
+
+_UNITS = {'second': 1, 'minute': 60, 'hour': 3600, 'day': 86400}
+_LIMIT_RE = re.compile(r'^\s*(\d+)\s*(?:per|/)\s*(\d+)?\s*(second|minute|hour|day)s?\s*$', re.IGNORECASE)
+
+RateLimit = namedtuple('RateLimit', 'amount window text')
+# retry_after: seconds until the next request would be admitted (0 when allowed)
+Decision = namedtuple('Decision', 'allowed remaining retry_after')
+
+
+def parse_limit(text):
+    """'10 per minute' / '200/day' / '5 per 10 seconds' -> RateLimit"""
+    match = _LIMIT_RE.match(text)
+    if not match:
+        raise ValueError(f"Invalid rate limit: {text!r}")
+    amount, multiple, unit = match.groups()
+    amount = int(amount)
+    if amount < 1:
+        raise ValueError(f"Invalid rate limit: {text!r}")
+    return RateLimit(amount, int(multiple or 1) * _UNITS[unit.lower()], text)
+
+
+def _decide(allowed, tat, now, limit):
+    """Decision for a key whose theoretical arrival time is now ``tat``"""
+    interval = limit.window / limit.amount
+    if not allowed:
+        return Decision(False, 0, max(0.0, tat + interval - limit.window - now))
+    return Decision(True, max(0, int((limit.window - (tat - now)) / interval + 1e-9)), 0.0)
+
+
+def gcra(tat, now, limit):
+    """One GCRA step: returns (allowed, new tat)"""
+    tat = max(tat if tat is not None else now, now)
+    new_tat = tat + limit.window / limit.amount
+    if new_tat - limit.window > now:
+        return False, tat
+    return True, new_tat
+
+
+class MemoryStore:
+    """Per-process counters"""
+
+    PRUNE_EVERY = 1000
+
+    def __init__(self):
+        self._tats = {}
+        self._lock = threading.Lock()
+        self._hits = 0
+
+    def hit(self, key, limit, now):
+        with self._lock:
+            allowed, tat = gcra(self._tats.get(key), now, limit)
+            self._tats[key] = tat
+            self._hits += 1
+            if self._hits % self.PRUNE_EVERY == 0:
+                # A tat in the past means a full bucket - same as no entry
+                self._tats = {k: v for k, v in self._tats.items() if v > now}
+        return _decide(allowed, tat, now, limit)
+
+    def clear(self):
+        with self._lock:
+            self._tats.clear()
+
+
+class SQLiteStore:
+    """Counters in a SQLite file shared by every process on the host"""
+
+    PRUNE_EVERY = 1000
+
+    # One atomic statement: the update only happens when the request is admitted
+    HIT_QUERY = (
+        "INSERT INTO rate_limits (key, tat) VALUES (:key, :now + :interval) "
+        "ON CONFLICT(key) DO UPDATE SET tat = max(tat, :now) + :interval "
+        "WHERE max(tat, :now) + :interval - :window <= :now "
+        "RETURNING tat"
+    )
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._hits = 0
+        self._connection().execute(
+            "CREATE TABLE IF NOT EXISTS rate_limits (key TEXT PRIMARY KEY, tat REAL NOT NULL) WITHOUT ROWID"
+        )
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        # A connection must not cross a fork (gunicorn --preload)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def hit(self, key, limit, now):
+        conn = self._connection()
+        row = conn.execute(self.HIT_QUERY, {
+            'key': key, 'now': now, 'interval': limit.window / limit.amount, 'window': limit.window
+        }).fetchone()
+        if row is not None:
+            decision = _decide(True, row[0], now, limit)
+        else:
+            tat = conn.execute("SELECT tat FROM rate_limits WHERE key = ?", (key,)).fetchone()[0]
+            decision = _decide(False, tat, now, limit)
+        self._hits += 1
+        if self._hits % self.PRUNE_EVERY == 0:
+            conn.execute("DELETE FROM rate_limits WHERE tat < ?", (now,))
+        return decision
+
+    def clear(self):
+        self._connection().execute("DELETE FROM rate_limits")
+
+
+class RedisStore:
+    """Counters in Redis, shared across hosts"""
+
+    # Same GCRA step as gcra(); numbers travel as strings to keep the fractions
+    SCRIPT = """
+        local now = tonumber(ARGV[1])
+        local interval = tonumber(ARGV[2])
+        local window = tonumber(ARGV[3])
+        local tat = tonumber(redis.call('GET', KEYS[1]) or ARGV[1])
+        if tat < now then tat = now end
+        local new_tat = tat + interval
+        if new_tat - window > now then
+            return {0, tostring(tat)}
+        end
+        redis.call('SET', KEYS[1], tostring(new_tat), 'PX', math.ceil((new_tat - now) * 1000))
+        return {1, tostring(new_tat)}
+    """
+
+    def __init__(self, url, prefix='ratelimit:'):
+        if redis is None:
+            raise RuntimeError("redis:// rate limit storage needs the redis package (pip install redis)")
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+        self._script = self.client.register_script(self.SCRIPT)
+
+    def hit(self, key, limit, now):
+        allowed, tat = self._script(
+            keys=[self.prefix + key], args=[repr(now), repr(limit.window / limit.amount), limit.window]
+        )
+        return _decide(bool(allowed), float(tat), now, limit)
+
+    def clear(self):
+        for key in self.client.scan_iter(self.prefix + '*'):
+            self.client.delete(key)
+
+
+def create_store(uri):
+    """Store for a storage URI (memory://, sqlite:///path, redis://...)"""
+    if uri == 'memory://':
+        return MemoryStore()
+    if uri.startswith('sqlite://'):
+        path = uri[len('sqlite://'):]
+        # sqlite:///abs/path -> /abs/path, sqlite://rel/path -> rel/path
+        return SQLiteStore(path)
+    if uri.startswith(('redis://', 'rediss://', 'unix://')):
+        return RedisStore(uri)
+    raise ValueError(f"Unsupported rate limit storage: {uri!r}")
+
+
+def remote_address():
+    from flask import request
+    return request.remote_addr or '127.0.0.1'
+
+
+class Limiter:
+    """Per-route, per-client rate limits checked before each request"""
+
+    def __init__(self, app=None, key_func=remote_address, default_limits=(), store=None, enabled=True,
+                 clock=time.time):
+        self.key_func = key_func
+        self.default_limits = [parse_limit(text) for text in default_limits]
+        self.store = store if store is not None else MemoryStore()
+        self.enabled = enabled
+        self.clock = clock
+        self._lock = threading.Lock()
+        self.checks = 0
+        self.rejected = 0
+        self.errors = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        app.before_request(self._check_request)
+
+    def limit(self, *limits):
+        """Decorator: these limits replace the defaults for the route"""
+        parsed = [parse_limit(text) for text in limits]
+
+        def decorator(f):
+            f._rate_limits = getattr(f, '_rate_limits', []) + parsed
+            return f
+        return decorator
+
+    def exempt(self, f):
+        """Decorator: never limit the route"""
+        f._rate_limit_exempt = True
+        return f
+
+    def limits_for(self, view):
+        if view is None or getattr(view, '_rate_limit_exempt', False):
+            return []
+        return getattr(view, '_rate_limits', None) or self.default_limits
+
+    def check(self, scope, client, limits):
+        """Count one request against each limit; returns the most restrictive Decision, or None"""
+        now = self.clock()
+        result = None
+        for limit in limits:
+            decision = self.store.hit(f"{scope}/{limit.amount}/{limit.window}/{client}", limit, now)
+            if result is None or not decision.allowed or (result.allowed and decision.remaining < result.remaining):
+                result = decision
+            if not decision.allowed:
+                break
+        return result
+
+    def _check_request(self):
+        from flask import request, jsonify
+        if not self.enabled or request.endpoint in (None, 'static'):
+            return None
+        limits = self.limits_for(self.app.view_functions.get(request.endpoint))
+        if not limits:
+            return None
+        try:
+            decision = self.check(request.endpoint, self.key_func(), limits)
+        except Exception as e:
+            # Fail open - a broken store must not take the site down
+            with self._lock:
+                self.errors += 1
+            logger.warning("Rate limit store error", extra={'error': str(e)})
+            return None
+        with self._lock:
+            self.checks += 1
+            if not decision.allowed:
+                self.rejected += 1
+        if decision.allowed:
+            return None
+        response = jsonify({'success': False, 'error': 'طلبات كثيرة جداً، يرجى المحاولة بعد قليل'})
+        response.status_code = 429
+        response.headers['Retry-After'] = str(max(1, math.ceil(decision.retry_after)))
+        return response
+
+    def stats(self):
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'store': type(self.store).__name__,
+                'checks': self.checks,
+                'rejected': self.rejected,
+                'errors': self.errors
+            }
@@ -10,5 +10,29 @@ CREATE TABLE IF NOT EXISTS generations (
     prompt TEXT NOT NULL,
     image_url VARCHAR(500) NOT NULL,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-    INDEX idx_created_at (created_at)
+    -- 1 when image_url is a local path (the only rows shown in the gallery)
+    is_local TINYINT(1) AS (image_url != '' AND image_url NOT LIKE 'http://%' AND image_url NOT LIKE 'https://%') STORED,
+    -- SHA-256 of the normalized prompt + generation settings (see prompt_cache.py)
+    prompt_hash CHAR(64) NULL,
+    INDEX idx_created_at (created_at),
+    INDEX idx_gallery (is_local, id),
+    INDEX idx_prompt_hash (prompt_hash)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+-- Image generation jobs queued by /generate (JOB_QUEUE_BACKEND=mysql)
+CREATE TABLE IF NOT EXISTS generation_jobs (
+    id CHAR(32) PRIMARY KEY,
+    prompt TEXT NOT NULL,
+    priority TINYINT NOT NULL DEFAULT 5,
+    status VARCHAR(16) NOT NULL,
+    result TEXT NULL,
+    error TEXT NULL,
+    error_type VARCHAR(32) NULL,
+    timeout DOUBLE NULL,
+    created_at DOUBLE NOT NULL,
+    started_at DOUBLE NULL,
+    finished_at DOUBLE NULL,
+    version INT NOT NULL DEFAULT 0,
+    INDEX idx_jobs_status (status, created_at),
+    INDEX idx_jobs_finished (status, finished_at)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
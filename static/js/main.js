@@ -242,78 +242,59 @@ document.addEventListener('DOMContentLoaded', function() {
             return; // توقف عن تنفيذ الكود لو العناصر مش موجودة
         }
 
-    // Static data for characters (يمكنك تغيير المسارات والأسماء براحتك)
-    const charactersData = {
-        // Category 1: Arab Characters (Nationalities)
-        arabCharacters: [
-            { id: 'egyptian',   name: 'Egyptian / مصري',                     imageUrl: '/static/images/generated/arab-egyptian.jpg' },
-            { id: 'saudi',      name: 'Saudi / سعودي',                       imageUrl: '/static/images/generated/arab-saudi.jpg' },
-            { id: 'moroccan',   name: 'Moroccan / مغربي',                    imageUrl: '/static/images/generated/arab-moroccan.jpg' },
-            { id: 'emirati',    name: 'Emirati / إماراتي',                   imageUrl: '/static/images/generated/arab-emirati.jpg' }
-        ],
+    // Character catalog from the server - only designs whose image exists are listed
+    // (the list itself lives in catalog.py)
+    const charactersData = {};
+    const catalogReady = fetch('/api/characters')
+        .then(response => response.ok ? response.json() : null)
+        .then(data => {
+            (data && data.categories ? data.categories : []).forEach(category => {
+                charactersData[category.key] = category.items;
+            });
+        })
+        .catch(error => console.warn('تعذر تحميل قائمة الشخصيات', error));
 
-        // Category 2: Foreign Characters (Nationalities)
-        foreignCharacters: [
-            { id: 'italian',    name: 'Italian / إيطالي',                    imageUrl: '/static/images/generated/foreign-italian.jpg' },
-            { id: 'american_cowboy', name: 'American (Cowboy) / أمريكي (راعي بقر)', imageUrl: '/static/images/generated/foreign-american-cowboy.jpg' },
-            { id: 'japanese',   name: 'Japanese / ياباني',                   imageUrl: '/static/images/generated/foreign-japanese.jpg' },
-            { id: 'mexican',    name: 'Mexican / مكسيكي',                    imageUrl: '/static/images/generated/foreign-mexican.jpg' },
-            { id: 'french',     name: 'French / فرنسي',                      imageUrl: '/static/images/generated/foreign-french.jpg' },
-            { id: 'indian',     name: 'Indian / هندي',                       imageUrl: '/static/images/generated/foreign-indian.jpg' },
-            { id: 'british',    name: 'British / بريطاني',                   imageUrl: '/static/images/generated/foreign-british.jpg' },
-            { id: 'spanish',    name: 'Spanish / إسباني',                    imageUrl: '/static/images/generated/foreign-spanish.jpg' },
-            { id: 'russian',    name: 'Russian / روسي',                      imageUrl: '/static/images/generated/foreign-russian.jpg' },
-            { id: 'brazilian',  name: 'Brazilian / برازيلي',                imageUrl: '/static/images/generated/foreign-brazilian.jpg' }
-        ],
-
-        // Category 3: Jobs & Professions
-        jobs: [
-            { id: 'doctor',         name: 'Doctor / طبيب',                   imageUrl: '/static/images/generated/job-doctor.jpg' },
-            { id: 'chef',           name: 'Chef / طباخ (شيف)',               imageUrl: '/static/images/generated/job-chef.jpg' },
-            { id: 'astronaut',      name: 'Astronaut / رائد فضاء',           imageUrl: '/static/images/generated/job-astronaut.jpg' },
-            { id: 'firefighter',    name: 'Firefighter / رجل إطفاء',         imageUrl: '/static/images/generated/job-firefighter.jpg' },
-            { id: 'construction_engineer', name: 'Construction Engineer / مهندس بناء', imageUrl: '/static/images/generated/job-construction-engineer.jpg' },
-            { id: 'pilot',          name: 'Pilot / طيار',                    imageUrl: '/static/images/generated/job-pilot.jpg' },
-            { id: 'farmer',         name: 'Farmer / فلاح (مزارع)',          imageUrl: '/static/images/generated/job-farmer.jpg' },
-            { id: 'judge',          name: 'Judge / قاضي',                    imageUrl: '/static/images/generated/job-judge.jpg' },
-            { id: 'delivery_rider', name: 'Delivery Rider / عامل توصيل (دليفري)', imageUrl: '/static/images/generated/job-delivery-rider.jpg' }
-        ],
-
-        // Category 4: Football Clubs
-        clubs: [
-            { id: 'alahly',        name: 'Al Ahly SC / النادي الأهلي المصري',        imageUrl: '/static/images/generated/club-alahly.jpg' },
-            { id: 'zamalek',       name: 'Zamalek SC / نادي الزمالك',               imageUrl: '/static/images/generated/club-zamalek.jpg' },
-            { id: 'alhilal',       name: 'Al Hilal SFC / نادي الهلال السعودي',      imageUrl: '/static/images/generated/club-alhilal.jpg' },
-            { id: 'real_madrid',   name: 'Real Madrid / ريال مدريد',                imageUrl: '/static/images/generated/club-real-madrid.jpg' },
-            { id: 'barcelona',     name: 'FC Barcelona / برشلونة',                  imageUrl: '/static/images/generated/club-barcelona.jpg' },
-            { id: 'man_utd',       name: 'Manchester United / مانشستر يونايتد',     imageUrl: '/static/images/generated/club-man-utd.jpg' },
-            { id: 'liverpool',     name: 'Liverpool FC / ليفربول',                  imageUrl: '/static/images/generated/club-liverpool.jpg' },
-            { id: 'bayern',        name: 'Bayern Munich / بايرن ميونخ',             imageUrl: '/static/images/generated/club-bayern.jpg' },
-            { id: 'juventus',      name: 'Juventus FC / يوفنتوس',                   imageUrl: '/static/images/generated/club-juventus.jpg' },
-            { id: 'psg',           name: 'Paris Saint-Germain (PSG) / باريس سان جيرمان', imageUrl: '/static/images/generated/club-psg.jpg' }
-        ]
-    };
+    // Resized AVIF/WebP/JPEG variants of a static image from the server, or null
+    async function fetchResponsiveImage(imageUrl) {
+        try {
+            const response = await fetch('/api/images/responsive?src=' + encodeURIComponent(imageUrl));
+            if (!response.ok) return null;
+            return await response.json();
+        } catch (error) {
+            return null;
+        }
+    }
 
-    // Function to check if image exists
-    async function checkImageExists(imageUrl) {
-        return new Promise((resolve) => {
-            const img = new Image();
-            img.onload = function() {
-                resolve(true);
-            };
-            img.onerror = function() {
-                resolve(false);
-            };
-            // Set timeout to avoid hanging
-            setTimeout(() => resolve(false), 3000);
+    // Point the <picture> at the variants (or at the original when there are none)
+    function applyResponsiveImage(img, imageUrl, info) {
+        const picture = img.parentElement;
+        if (picture && picture.tagName === 'PICTURE') {
+            picture.querySelectorAll('source').forEach(source => source.remove());
+            (info ? info.sources : []).forEach(source => {
+                const element = document.createElement('source');
+                element.type = source.type;
+                element.srcset = source.srcset;
+                element.sizes = img.sizes;
+                picture.insertBefore(element, img);
+            });
+        }
+        img.dataset.original = imageUrl;
+        if (info) {
+            img.srcset = info.srcset;
+            img.style.background = `url('${info.placeholder}') center / cover no-repeat`;
+            img.src = info.src;
+        } else {
+            img.removeAttribute('srcset');
+            img.style.background = '';
             img.src = imageUrl;
-        });
+        }
     }
 
     function clearResult() {
         if (generatedImage) {
             generatedImage.style.display = 'none';
-            generatedImage.src = '';
+            applyResponsiveImage(generatedImage, '', null);
+            generatedImage.removeAttribute('src');
         }
         if (resultPlaceholder) {
             resultPlaceholder.style.display = 'flex';
@@ -351,7 +332,8 @@ document.addEventListener('DOMContentLoaded', function() {
     }
 
     // نجعل الدالة متاحة عالميًا عشان نقدر نستدعيها من الـ HTML مباشرة
-    window.handleCategoryChange = function (categoryKey) {
+    window.handleCategoryChange = async function (categoryKey) {
+        await catalogReady;
         populateItems(categoryKey);
     };
 
@@ -386,18 +368,8 @@ document.addEventListener('DOMContentLoaded', function() {
                 generatedImage.onerror = null;
                 generatedImage.onload = null;
                 
-                // Check if image exists before loading
-                const imageExists = await checkImageExists(selectedItem.imageUrl);
-                
-                if (!imageExists) {
-                    // Image doesn't exist, show placeholder message
-                    generatedImage.style.display = 'none';
-                    if (resultPlaceholder) {
-                        resultPlaceholder.style.display = 'flex';
-                        resultPlaceholder.innerHTML = '<p>الصورة غير متوفرة حالياً. يرجى اختيار تصميم آخر.</p>';
-                    }
-                    return;
-                }
+                // The catalog only lists images that exist - no need to probe before loading
+                const responsive = await fetchResponsiveImage(selectedItem.imageUrl);
                 
                 // Set up error handler before loading (as backup)
                 generatedImage.onerror = function() {
@@ -421,7 +393,7 @@ document.addEventListener('DOMContentLoaded', function() {
                     }
                 };
                 
-                generatedImage.src = selectedItem.imageUrl;
+                applyResponsiveImage(generatedImage, selectedItem.imageUrl, responsive);
                 generatedImage.style.display = 'block';
                 generatedImage.scrollIntoView({ behavior: 'smooth', block: 'nearest' });
             }
@@ -0,0 +1,62 @@
+import pytest
+import requests
+
+import aladhan_client
+from aladhan_client import AladhanClient
+from benchmarks.fake_aladhan import start_server
+
+PARAMS = {'latitude': 30.04, 'longitude': 31.24, 'method': 5}
+
+
+@pytest.fixture
+def server():
+    server = start_server(latency_ms=0)
+    yield server
+    server.shutdown()
+
+
+def timeouts(endpoint):
+    values = aladhan_client.UPSTREAM_TIMEOUTS.collect().get((endpoint,))
+    return values[0] if values else 0
+
+
+def test_get_json_returns_payload(server):
+    client = AladhanClient(base_url=server.base_url, timeout=2)
+    payload = client.get_json('/v1/timings/01-03-2025', PARAMS)
+    assert payload['data']['timings']['Maghrib']
+
+
+def test_read_timeout_after_retries_is_a_timeout(server):
+    server.timeout_rate = 1.0
+    server.timeout_s = 1.0
+    client = AladhanClient(base_url=server.base_url, timeout=0.2, retries=2, backoff=0)
+    before = timeouts('timings')
+    with pytest.raises(requests.Timeout) as raised:
+        client.get_json('/v1/timings/01-03-2025', PARAMS)
+    assert isinstance(raised.value, requests.ReadTimeout)
+    assert timeouts('timings') == before + 1
+    assert client.errors == 1
+
+
+def test_refused_connection_is_not_a_timeout(server):
+    base_url = server.base_url
+    server.shutdown()
+    server.server_close()
+    client = AladhanClient(base_url=base_url, timeout=0.2, retries=1, backoff=0)
+    before = timeouts('timings')
+    with pytest.raises(requests.ConnectionError) as raised:
+        client.get_json('/v1/timings/01-03-2025', PARAMS)
+    assert not isinstance(raised.value, requests.Timeout)
+    assert timeouts('timings') == before
+    assert client.errors == 1
+
+
+def test_non_json_200_is_a_failed_response(server, monkeypatch):
+    client = AladhanClient(base_url=server.base_url, timeout=2)
+    response = requests.Response()
+    response.status_code = 200
+    response._content = b'<html>Service Unavailable</html>'
+    monkeypatch.setattr(client._session, 'get', lambda *args, **kwargs: response)
+    assert client.get_json('/v1/timings/01-03-2025', PARAMS) is None
+    assert client.maghrib(30.04, 31.24, '01-03-2025') is None
+    assert (client.requests_sent, client.errors) == (2, 2)
@@ -0,0 +1,109 @@
+import threading
+import time
+
+from cache import SQLiteStore, TTLCache
+
+
+class RacingCache(TTLCache):
+    """Runs ``between`` after the miss in get_or_load, before the in-flight check"""
+
+    between = None
+
+    def get(self, key, default=None):
+        value = super().get(key, default)
+        between, self.between = self.between, None
+        if between is not None:
+            between()
+        return value
+
+
+def test_get_or_load_caches_value():
+    cache = TTLCache(max_size=4, ttl=60)
+    calls = []
+    assert cache.get_or_load('k', lambda: calls.append(1) or 'v') == 'v'
+    assert cache.get_or_load('k', lambda: calls.append(1) or 'other') == 'v'
+    assert calls == [1]
+
+
+def test_load_finishing_after_miss_is_not_repeated():
+    cache = RacingCache(max_size=4, ttl=60)
+    loads = []
+
+    def loader():
+        loads.append(1)
+        return 'v'
+
+    # Another caller completes the whole load between our miss and our in-flight check
+    cache.between = lambda: TTLCache.get_or_load(cache, 'k', loader)
+    assert cache.get_or_load('k', loader) == 'v'
+    assert len(loads) == 1 and cache.stats()['loads'] == 1
+
+
+def test_concurrent_misses_share_one_load():
+    cache = TTLCache(max_size=4, ttl=60)
+    started = threading.Event()
+    release = threading.Event()
+    loads = []
+
+    def loader():
+        loads.append(1)
+        started.set()
+        release.wait(5)
+        return 'v'
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get_or_load('k', loader))) for _ in range(8)]
+    for t in threads:
+        t.start()
+    started.wait(5)
+    time.sleep(0.05)
+    release.set()
+    for t in threads:
+        t.join(5)
+    assert results == ['v'] * 8 and len(loads) == 1
+
+
+def test_loader_error_reaches_every_waiter():
+    cache = TTLCache(max_size=4, ttl=60)
+
+    def loader():
+        raise ValueError("upstream down")
+
+    for _ in range(2):
+        try:
+            cache.get_or_load('k', loader)
+        except ValueError:
+            pass
+        else:
+            raise AssertionError("error was swallowed")
+    assert cache.stats()['loads'] == 2
+
+
+def test_store_purges_expired_rows(tmp_path):
+    store = SQLiteStore(str(tmp_path / 'cache.db'), purge_interval=0)
+    store.set('old', 1, time.time() - 1)
+    store.set('live', 2, time.time() + 60)
+    store.set('forever', 3, None)
+    assert store.purge_expired() == 1
+    assert store.get('live') is not None and store.get('forever') is not None
+
+
+def test_store_purges_from_set_once_due(tmp_path):
+    store = SQLiteStore(str(tmp_path / 'cache.db'), purge_interval=3600)
+    store.set('old', 1, time.time() - 1)
+    store._next_purge = 0  # interval elapsed
+    store.set('new', 2, None)
+    count = store._connection().execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+    assert count == 1
+
+
+def test_cache_purge_expired_clears_memory_and_store(tmp_path):
+    cache = TTLCache(max_size=4, ttl=60, store=SQLiteStore(str(tmp_path / 'cache.db'), purge_interval=0))
+    cache.set('a', 1, ttl=60)
+    cache.set('b', 2, ttl=60)
+    for key in ('a', 'b'):
+        value, _ = cache._data[key]
+        cache._data[key] = (value, time.time() - 1)
+    cache.store.set('b', 2, time.time() - 1)
+    assert cache.purge_expired() == 1
+    assert cache.stats()['size'] == 0 and cache.store.get('a') is not None
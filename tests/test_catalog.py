@@ -0,0 +1,64 @@
+import json
+import struct
+import zlib
+
+from assets import AssetManifest, build_assets
+from catalog import CharacterCatalog
+
+
+def png(width, height):
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+    header = struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)
+    return b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', header) + chunk(b'IEND', b'')
+
+
+CATALOG = (('clubs', 'Clubs', (('ahly', 'Ahly', 'club-ahly.png'), ('zamalek', 'Zamalek', 'club-zamalek.png'))),)
+
+
+def make_static(tmp_path):
+    directory = tmp_path / 'images' / 'generated'
+    directory.mkdir(parents=True)
+    (directory / 'club-ahly.png').write_bytes(png(40, 30))
+    return str(tmp_path)
+
+
+def items(catalog):
+    body, _ = catalog.manifest()
+    return json.loads(body)['categories'][0]['items']
+
+
+def test_manifest_url_falls_back_to_static(tmp_path):
+    assets = AssetManifest(make_static(tmp_path))
+    assert assets.url('images/generated/club-ahly.png') == '/static/images/generated/club-ahly.png'
+
+
+def test_manifest_url_and_original_after_build(tmp_path):
+    static_dir = make_static(tmp_path)
+    build_assets(static_dir)
+    assets = AssetManifest(static_dir)
+    url = assets.url('images/generated/club-ahly.png')
+    assert url.startswith('/assets/images/generated/club-ahly.') and url != '/assets/images/generated/club-ahly.png'
+    assert assets.original(url[len('/assets/'):]) == 'images/generated/club-ahly.png'
+
+
+def test_catalog_lists_existing_images_only(tmp_path):
+    static_dir = make_static(tmp_path)
+    catalog = CharacterCatalog(static_dir, AssetManifest(static_dir), catalog=CATALOG)
+    listed = items(catalog)
+    assert [item['id'] for item in listed] == ['ahly']
+    assert (listed[0]['width'], listed[0]['height'], listed[0]['format']) == (40, 30, 'png')
+
+
+def test_catalog_uses_fingerprinted_urls_once_built(tmp_path):
+    static_dir = make_static(tmp_path)
+    assets = AssetManifest(static_dir)
+    catalog = CharacterCatalog(static_dir, assets, catalog=CATALOG)
+    _, etag_before = catalog.manifest()
+    assert items(catalog)[0]['imageUrl'] == '/static/images/generated/club-ahly.png'
+
+    build_assets(static_dir)
+    assets.load()
+    assert items(catalog)[0]['imageUrl'] == assets.url('images/generated/club-ahly.png')
+    assert items(catalog)[0]['imageUrl'].startswith('/assets/')
+    assert catalog.manifest()[1] != etag_before
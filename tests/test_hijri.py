@@ -0,0 +1,84 @@
+from datetime import date, timedelta
+
+import pytest
+
+import hijri
+from hijri import RAMADAN, current_ramadan, ramadan_of, ramadan_window, to_gregorian, to_hijri
+
+
+@pytest.mark.parametrize('day, expected', [
+    # Published Umm al-Qura dates
+    (date(2024, 3, 11), (1445, 9, 1)),
+    (date(2024, 4, 10), (1445, 10, 1)),   # Eid al-Fitr 1445
+    (date(2025, 3, 1), (1446, 9, 1)),
+    (date(2025, 3, 30), (1446, 10, 1)),   # Eid al-Fitr 1446
+    (date(2026, 2, 18), (1447, 9, 1)),
+    (date(2026, 3, 19), (1447, 9, 30)),
+    (date(2026, 3, 20), (1447, 10, 1)),
+    (date(2023, 7, 19), (1445, 1, 1)),    # 1 Muharram 1445
+])
+def test_to_hijri_known_dates(day, expected):
+    assert to_hijri(day) == expected
+
+
+@pytest.mark.parametrize('day, expected', [
+    (date(2024, 7, 7), (1446, 1, 1)),     # 1 Muharram 1446
+    (date(2022, 4, 2), (1443, 9, 1)),     # Ramadan 1443
+    (date(2023, 3, 23), (1444, 9, 1)),    # Ramadan 1444
+])
+def test_tabular_months_within_a_day(day, expected):
+    # Months without a known start come from the tabular calendar
+    assert abs((to_gregorian(*expected) - day).days) <= 1
+
+
+def test_tabular_ramadan_close_to_known_windows():
+    for hijri_year, (start, _) in hijri.UMM_AL_QURA_RAMADAN.items():
+        arithmetic = date.fromordinal(hijri._tabular_ordinal(hijri_year, RAMADAN, 1))
+        assert abs((arithmetic - start).days) <= 2, hijri_year
+
+
+def test_round_trip_and_continuity_over_supported_years():
+    day = date(hijri.MIN_YEAR, 1, 1)
+    previous = to_hijri(day)
+    while day < date(hijri.MAX_YEAR, 12, 31):
+        day += timedelta(days=1)
+        current = to_hijri(day)
+        assert to_gregorian(*current) == day, day
+        # Next day of the month, or the first day of the next month after a 29/30-day month
+        if current[2] == 1:
+            assert current[:2] == hijri._shift_month(previous[0], previous[1], 1), day
+            assert previous[2] in (29, 30), day
+        else:
+            assert current == (previous[0], previous[1], previous[2] + 1), day
+        previous = current
+
+
+def test_ramadan_window_starts_in_its_year():
+    # Every year the app serves has a window
+    for year in range(hijri.MIN_YEAR, hijri.MAX_YEAR + 1):
+        start, end = ramadan_window(year)
+        assert start.year == year and (end - start).days in (28, 29), year
+
+
+def test_ramadan_window_takes_the_first_of_two():
+    assert ramadan_window(2030) == ramadan_of(1451)
+    assert ramadan_window(2030)[0].month == 1
+
+
+@pytest.mark.parametrize('today, hijri_year', [
+    (date(2026, 2, 17), 1447),   # day before Ramadan
+    (date(2026, 2, 18), 1447),
+    (date(2026, 3, 19), 1447),   # last day
+    (date(2026, 3, 20), 1448),   # Eid: the next Ramadan
+    (date(2026, 10, 18), 1448),
+    (date(2030, 1, 20), 1451),
+    (date(2030, 6, 1), 1452),    # second Ramadan of 2030
+    (date(2030, 12, 26), 1452),
+    (date(2030, 12, 31), 1452),
+    (date(2031, 1, 5), 1452),    # 11 Ramadan 1452, started the previous year
+])
+def test_current_ramadan(today, hijri_year):
+    start, end = current_ramadan(today)
+    assert (start, end) == ramadan_of(hijri_year)
+    assert today <= end
+    assert to_hijri(start) == (hijri_year, RAMADAN, 1)
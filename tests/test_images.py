@@ -0,0 +1,42 @@
+import io
+import os
+
+import pytest
+
+from images import ImagePipeline
+from imagestore import ImageStore
+
+Image = pytest.importorskip('PIL.Image')
+
+
+def jpeg(width, height):
+    buffer = io.BytesIO()
+    Image.new('RGB', (width, height), (200, 100, 50)).save(buffer, 'JPEG')
+    return buffer.getvalue()
+
+
+def test_static_images_stay_under_the_root(tmp_path):
+    static = tmp_path / 'static'
+    (static / 'images').mkdir(parents=True)
+    (static / 'images' / 'a.jpg').write_bytes(jpeg(500, 250))
+    (static / 'secret.jpg').write_bytes(jpeg(10, 10))
+    pipeline = ImagePipeline(str(static), str(tmp_path / 'cache'))
+    assert pipeline.source_path('images/a.jpg')
+    assert pipeline.source_path('secret.jpg') is None
+    assert pipeline.source_path('images/../secret.jpg') is None
+    assert pipeline.widths_for('images/a.jpg') == (160, 320, 480, 640)
+
+
+def test_store_keys_get_derivatives_through_locate(tmp_path):
+    store = ImageStore(str(tmp_path / 'media'))
+    key = store.put_bytes(jpeg(800, 600))
+    pipeline = ImagePipeline(store.root, str(tmp_path / 'cache'), locate=store.path)
+    assert pipeline.dimensions(key) == (800, 600)
+    path = pipeline.derivative(key, 320, 'jpeg')
+    with Image.open(path) as image:
+        assert image.size == (320, 240)
+    assert pipeline.placeholder(key).startswith('data:image/jpeg;base64,')
+    # Malformed or missing keys are not servable
+    assert pipeline.derivative('../' + key, 320, 'jpeg') is None
+    assert pipeline.derivative('0' * 64 + '.jpg', 320, 'jpeg') is None
+    assert os.listdir(tmp_path / 'cache')
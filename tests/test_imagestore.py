@@ -0,0 +1,79 @@
+import os
+import threading
+import time
+
+import pytest
+
+from imagestore import ImageStore
+
+PNG = b'\x89PNG\r\n\x1a\n' + b'\x00' * 100
+GIF = b'GIF89a' + b'\x01' * 200
+
+
+def age(path, seconds):
+    then = time.time() - seconds
+    os.utime(path, (then, then))
+
+
+def test_put_deduplicates_and_rejects_non_images(tmp_path):
+    store = ImageStore(str(tmp_path))
+    key = store.put([PNG[:5], PNG[5:]])
+    assert store.put_bytes(PNG) == key and store.deduplicated == 1
+    assert key.endswith('.png') and os.path.isfile(store.path(key))
+    assert store.path('../x.png') is None
+    with pytest.raises(ValueError):
+        store.put_bytes(b'not an image')
+    assert store.rejected == 1 and os.listdir(store.tmp_dir) == []
+
+
+def test_collect_removes_orphans_then_evicts_oldest(tmp_path):
+    store = ImageStore(str(tmp_path), max_bytes=1000)
+    a = store.put_bytes(PNG)
+    b = store.put_bytes(GIF)
+    later = time.time() + 7200
+    # Nothing referenced, but both are younger than the grace period
+    assert store.collect(set(), now=time.time())['orphans'] == 0
+
+    # Both referenced and over budget (308 > 250 bytes): the older one goes
+    store.max_bytes = 250
+    age(store.path(a), 600)
+    summary = store.collect({a, b}, now=later)
+    assert summary['evicted'] == [a] and summary['bytes'] == len(GIF)
+    assert store.collect(set(), now=later + 7200)['orphans'] == 1
+    assert list(store.entries()) == []
+
+
+def test_file_reused_after_the_scan_is_kept(tmp_path):
+    store = ImageStore(str(tmp_path))
+    key = store.put_bytes(PNG)
+    age(store.path(key), 7200)
+    scanned = list(store.entries())
+
+    # put() of the same bytes lands between the collector's scan and its deletes
+    original_entries = store.entries
+    store.entries = lambda: iter(scanned)
+    assert store.put_bytes(PNG) == key
+    summary = store.collect(set(), grace=3600)
+    store.entries = original_entries
+
+    assert summary['orphans'] == 0 and os.path.isfile(store.path(key))
+    # Once it is old again it is collected
+    age(store.path(key), 7200)
+    assert store.collect(set(), grace=3600)['orphans'] == 1
+
+
+def test_put_waits_while_the_collector_deletes(tmp_path):
+    store = ImageStore(str(tmp_path))
+    key = store.put_bytes(PNG)
+    done = threading.Event()
+
+    def put():
+        store.put_bytes(PNG)
+        done.set()
+
+    with store._store_lock(exclusive=True):
+        thread = threading.Thread(target=put)
+        thread.start()
+        assert not done.wait(0.2)
+    thread.join(5)
+    assert done.is_set() and store.deduplicated == 1 and os.path.isfile(store.path(key))
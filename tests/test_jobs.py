@@ -0,0 +1,115 @@
+import threading
+import time
+
+import pytest
+
+from jobs import (CANCELLED, QUEUED, SUCCEEDED, TIMED_OUT, Job, JobAborted, JobQueue, SQLiteJobStore,
+                  _SQLJobStore)
+
+
+def wait_for(queue, job_id, statuses, timeout=5):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = queue.get(job_id)
+        if job.status in statuses:
+            return job
+        queue.wait(0.05)
+    raise AssertionError(f"job {job_id} is still {queue.get(job_id).status}")
+
+
+def test_job_succeeds():
+    queue = JobQueue(lambda job: {'echo': job.prompt}, workers=1)
+    job = queue.submit('hello')
+    assert wait_for(queue, job.id, (SUCCEEDED,)).result == {'echo': 'hello'}
+
+
+def test_timeout_is_reported_at_deadline_and_keeps_the_worker_busy():
+    active = []
+    peak = []
+    release = threading.Event()
+
+    def runner(job):
+        active.append(job.id)
+        peak.append(len(active))
+        try:
+            # Ignores its deadline until released - the worker must not start the next job
+            release.wait(5)
+            return 'late'
+        finally:
+            active.remove(job.id)
+
+    queue = JobQueue(runner, workers=1, default_timeout=0.2)
+    first = queue.submit('one')
+    second = queue.submit('two')
+    started = time.monotonic()
+    assert wait_for(queue, first.id, (TIMED_OUT,)).error_type == 'timeout'
+    assert time.monotonic() - started < 2
+    assert queue.get(second.id).status == 'queued'
+    release.set()
+    wait_for(queue, second.id, (TIMED_OUT, SUCCEEDED))
+    assert max(peak) == 1
+    assert queue.get(first.id).status == TIMED_OUT  # the late result was discarded
+
+
+def test_cancel_stops_a_cooperative_runner():
+    stopped = threading.Event()
+
+    def runner(job):
+        try:
+            while True:
+                job.check()
+                time.sleep(0.01)
+        finally:
+            stopped.set()
+
+    queue = JobQueue(runner, workers=1, default_timeout=30)
+    job = queue.submit('x')
+    wait_for(queue, job.id, ('running',))
+    assert queue.cancel(job.id).status == CANCELLED
+    assert stopped.wait(2)
+    assert queue.get(job.id).status == CANCELLED
+
+
+def test_check_raises_after_deadline():
+    queue = JobQueue(lambda job: None, workers=1)
+    job = queue.submit('x')
+    job.deadline = time.monotonic() - 1
+    with pytest.raises(JobAborted):
+        job.check()
+    assert job.remaining() == 0.0
+
+
+def test_sql_store_requires_execute():
+    class Incomplete(_SQLJobStore):
+        pass
+
+    with pytest.raises(TypeError):
+        Incomplete()
+
+
+def test_sqlite_store_is_shared_between_processes(tmp_path):
+    path = str(tmp_path / 'jobs.sqlite3')
+    worker_a = JobQueue(lambda job: 'done', store=SQLiteJobStore(path), workers=1)
+    worker_b = JobQueue(lambda job: 'done', store=SQLiteJobStore(path), workers=0)
+    job = worker_a.submit('x')
+    # worker_b has no local copy, so it reads the row worker_a writes
+    seen = wait_for(worker_b, job.id, (SUCCEEDED,))
+    assert seen.result == 'done'
+
+
+def test_sqlite_store_keeps_the_newest_finished_jobs(tmp_path):
+    store = SQLiteJobStore(str(tmp_path / 'jobs.sqlite3'), max_finished=3)
+    store.TRIM_EVERY = 5
+    pending = Job('waiting', id='p')
+    store.insert(pending)
+    jobs = []
+    for i in range(6):
+        job = Job('x', id=f'j{i}')
+        store.insert(job)
+        job.status, job.finished_at = SUCCEEDED, 1000.0 + i
+        store.update(job)
+        jobs.append(job)
+    # The fifth finish trimmed to the newest three; the sixth is kept until the next trim
+    assert [store.get(j.id) is not None for j in jobs] == [False, False, True, True, True, True]
+    assert store.trim() == 1 and store.get('j2') is None
+    assert store.get('p').status == QUEUED
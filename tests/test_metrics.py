@@ -0,0 +1,80 @@
+import os
+
+import pytest
+
+from metrics import Counter, Gauge, Histogram, Registry, SQLiteShare, _ShardedMetric
+
+
+def make_registry(store=None, gauge_value=1):
+    registry = Registry()
+    hits = registry.register(Counter('hits', 'Hits', ('route',)))
+    latency = registry.register(Histogram('latency', 'Latency', buckets=(0.1, 1.0)))
+    registry.register(Gauge('pool', 'Pool size', lambda: gauge_value))
+    registry.store = store
+    return registry, hits, latency
+
+
+def sample(text, line_prefix):
+    return [line for line in text.splitlines() if line.startswith(line_prefix)]
+
+
+def test_local_render_labels_the_worker():
+    registry, hits, latency = make_registry()
+    hits.inc('home')
+    latency.observe(0.05)
+    text = registry.render()
+    assert f'hits_total{{route="home",worker="{os.getpid()}"}} 1' in text
+    assert sample(text, 'latency_count') == [f'latency_count{{worker="{os.getpid()}"}} 1']
+
+
+def test_shared_render_sums_workers(tmp_path):
+    store = SQLiteShare(str(tmp_path / 'metrics.db'), alive=lambda pid: True)
+    registry, hits, latency = make_registry(store)
+    hits.inc('home', amount=2)
+    latency.observe(0.05)
+    # Another live worker's snapshot
+    other = 999999
+    store.publish(other, [('counter', 'hits', ('home',), [3.0]), ('histogram', 'latency', (), [1, 1, 0, 2.5]),
+                          ('gauge', 'pool', (), [4])])
+
+    text = registry.render()
+    assert sample(text, 'hits_total') == ['hits_total{route="home"} 5']
+    assert 'latency_bucket{le="0.1"} 2' in text
+    assert 'latency_count 3' in text
+    pid = os.getpid()
+    assert sample(text, 'pool{') == [f'pool{{worker="{pid}"}} 1', f'pool{{worker="{other}"}} 4']
+
+
+def test_exited_workers_are_folded_into_the_total(tmp_path):
+    running = set()
+    store = SQLiteShare(str(tmp_path / 'metrics.db'), alive=running.__contains__)
+    store.publish(101, [('counter', 'hits', ('home',), [3.0]), ('gauge', 'pool', (), [4])])
+    store.publish(102, [('counter', 'hits', ('home',), [2.0])])
+    assert store.retire() == [101, 102]
+    running.add(104)
+    store.publish(103, [('counter', 'hits', ('home',), [1.0])])
+    store.publish(104, [('counter', 'hits', ('home',), [7.0])])
+    assert store.retire() == [103]
+
+    assert sorted(store.read()) == [(SQLiteShare.RETIRED, 'hits', ('home',), [6.0]), (104, 'hits', ('home',), [7.0])]
+
+
+def test_exited_worker_keeps_the_sum_monotonic(tmp_path):
+    running = {os.getpid(), 424242}
+    store = SQLiteShare(str(tmp_path / 'metrics.db'), alive=running.__contains__)
+    registry, hits, _ = make_registry(store)
+    hits.inc('home', amount=2)
+    store.publish(424242, [('counter', 'hits', ('home',), [5.0])])
+    assert 'hits_total{route="home"} 7' in registry.render()
+
+    # The other worker exits; its last snapshot stays in the sum
+    running.discard(424242)
+    assert 'hits_total{route="home"} 7' in registry.render()
+
+
+def test_sharded_metric_requires_new_values():
+    class Incomplete(_ShardedMetric):
+        kind = 'counter'
+
+    with pytest.raises(TypeError):
+        Incomplete('x', 'X')
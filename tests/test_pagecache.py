@@ -0,0 +1,80 @@
+import gzip
+import threading
+import time
+
+from pagecache import PageCache
+
+BIG = b'<p>' + b'x' * 4096 + b'</p>'
+
+
+def renderer(body, calls):
+    def render():
+        calls.append(body)
+        return body
+    return render
+
+
+def test_hit_returns_the_cached_page():
+    cache = PageCache(max_size=2, ttl=0)
+    calls = []
+    page = cache.get(('page', 1), renderer(BIG, calls))
+    assert cache.get(('page', 1), renderer(b'other', calls)) is page
+    assert calls == [BIG] and cache.stats()['hits'] == 1
+
+
+def test_compressed_variant_is_built_once():
+    page = PageCache(ttl=0).get(('page', 1), lambda: BIG)
+    data, encoding = page.variant(lambda e: e == 'gzip')
+    assert encoding == 'gzip' and gzip.decompress(data) == BIG
+    assert page.variant(lambda e: e == 'gzip')[0] is data
+    assert page.variant(lambda e: False) == (BIG, None)
+
+
+def test_small_pages_are_not_compressed():
+    page = PageCache(ttl=0).get(('tiny', 1), lambda: b'<p></p>')
+    assert page.variant(lambda e: True) == (b'<p></p>', None)
+
+
+def test_nested_render_and_invalidate_by_prefix():
+    cache = PageCache(max_size=2, ttl=0)
+    # The /home shell rendered inside the full page
+    outer = cache.get(('outer', 1), lambda: cache.get(('page', 2), lambda: b'inner').body + b'!')
+    assert outer.body == b'inner!' and cache.stats()['size'] == 2
+    cache.invalidate('page')
+    assert cache.stats()['size'] == 1
+    cache.invalidate()
+    assert cache.stats()['size'] == 0
+
+
+def test_lru_bound_and_ttl():
+    cache = PageCache(max_size=2, ttl=0)
+    for n in range(3):
+        cache.get(('page', n), lambda: b'x')
+    calls = []
+    cache.get(('page', 0), renderer(b'again', calls))
+    assert calls == [b'again'] and cache.stats()['size'] == 2
+
+    cache = PageCache(ttl=0.05)
+    cache.get(('page', 1), lambda: b'old')
+    time.sleep(0.06)
+    assert cache.get(('page', 1), lambda: b'new').body == b'new'
+
+
+def test_concurrent_misses_render_once():
+    cache = PageCache(ttl=0)
+    calls = []
+    release = threading.Event()
+
+    def render():
+        calls.append(1)
+        release.wait(5)
+        return BIG
+
+    threads = [threading.Thread(target=cache.get, args=(('page', 1), render)) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.05)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+    assert calls == [1] and cache.stats()['misses'] == 1 and cache.stats()['hits'] == 3
@@ -0,0 +1,51 @@
+from datetime import date
+
+import pytest
+
+import prayer_times
+
+CAIRO = (30.0444, 31.2357, 'Africa/Cairo')
+RIYADH = (24.7136, 46.6753, 'Asia/Riyadh')
+RABAT = (33.9716, -6.8498, 'Africa/Casablanca')
+LONGYEARBYEN = (78.2232, 15.6267, 'Arctic/Longyearbyen')
+
+# Maghrib for Ramadan 1447 with the settings we send aladhan (method=4,
+# school=0). Rabat is on GMT during Ramadan, which only the timezone
+# database knows about.
+KNOWN = [
+    (CAIRO, date(2026, 2, 19), '17:47'),
+    (CAIRO, date(2026, 3, 18), '18:05'),
+    (RIYADH, date(2026, 2, 19), '17:50'),
+    (RIYADH, date(2026, 3, 18), '18:04'),
+    (RABAT, date(2026, 2, 19), '18:15'),
+    (RABAT, date(2026, 3, 18), '18:37'),
+]
+
+
+@pytest.mark.parametrize('location, day, expected', KNOWN)
+def test_maghrib_matches_aladhan(location, day, expected):
+    lat, lng, tz_name = location
+    assert prayer_times.get_maghrib(lat, lng, day, tz_name) == expected
+    assert prayer_times.get_maghrib(lat, lng, day.isoformat(), tz_name) == expected
+
+
+def test_no_maghrib_when_the_sun_does_not_set():
+    lat, lng, tz_name = LONGYEARBYEN
+    for day in (date(2026, 6, 21), date(2026, 12, 21)):
+        assert prayer_times.maghrib_minutes(lat, lng, day, tz_name) is None
+        assert prayer_times.get_maghrib(lat, lng, day, tz_name) == '--:--'
+
+
+def test_matrix_agrees_with_single_lookups():
+    locations = [CAIRO, RIYADH, RABAT, LONGYEARBYEN, (21.4225, 39.8262, 'Asia/Riyadh')]
+    days = prayer_times.date_range(date(2026, 2, 18), date(2026, 3, 19))
+    rows = prayer_times.maghrib_matrix(locations, days)
+    assert rows == [
+        [prayer_times.maghrib_minutes(lat, lng, d, tz_name) for d in days]
+        for lat, lng, tz_name in locations
+    ]
+
+
+def test_table_formats_by_name_and_date():
+    countries = {'Cairo': {'lat': CAIRO[0], 'lng': CAIRO[1], 'tz': CAIRO[2]}}
+    assert prayer_times.maghrib_table(countries, ['2026-02-19']) == {'Cairo': {'2026-02-19': '17:47'}}
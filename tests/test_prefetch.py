@@ -0,0 +1,102 @@
+import threading
+import time
+from datetime import date, datetime, timedelta
+from zoneinfo import ZoneInfo
+
+import pytest
+
+import prayer_times
+from prefetch import FakeClock, PrefetchScheduler, SQLiteLease, SystemClock
+
+LOCATIONS = {
+    'Cairo': {'lat': 30.0444, 'lng': 31.2357, 'tz': 'Africa/Cairo'},
+    'Rabat': {'lat': 34.0209, 'lng': -6.8416, 'tz': 'Africa/Casablanca'},
+}
+STEP = 30
+
+
+@pytest.fixture(scope='module')
+def simulation(tmp_path_factory):
+    """Two workers sharing a lease, driven for two days on a fake clock"""
+    clock = FakeClock(datetime(2026, 2, 20, tzinfo=ZoneInfo('UTC')).timestamp())
+    calls = []
+    flaky = {'Rabat': 1}  # first Rabat refresh fails and must be retried
+
+    def refresh(name, location):
+        calls.append((name, clock.now()))
+        if flaky.get(name):
+            flaky[name] -= 1
+            return False
+        return True
+
+    path = str(tmp_path_factory.mktemp('prefetch') / 'lease.db')
+    workers = [
+        PrefetchScheduler(refresh, LOCATIONS, SQLiteLease(path, ttl=60), clock, lead_minutes=90, retry_interval=300)
+        for _ in range(2)
+    ]
+    for _ in range(int(2 * 24 * 3600 / STEP)):
+        for worker in workers:
+            worker.run_pending()
+        clock.advance(STEP)
+    return clock, calls, workers
+
+
+def test_exactly_one_leader(simulation):
+    _, _, workers = simulation
+    assert sum(w.is_leader for w in workers) == 1
+
+
+@pytest.mark.parametrize('name', sorted(LOCATIONS))
+def test_refresh_runs_before_each_peak(simulation, name):
+    _, calls, _ = simulation
+    location = LOCATIONS[name]
+    tz = ZoneInfo(location['tz'])
+    runs = [datetime.fromtimestamp(t, tz) for n, t in calls if n == name]
+    for day in (date(2026, 2, 20), date(2026, 2, 21)):
+        maghrib = prayer_times.maghrib_minutes(location['lat'], location['lng'], day, location['tz'])
+        peak = datetime(day.year, day.month, day.day, tzinfo=tz) + timedelta(minutes=maghrib - 90)
+        assert any(peak <= r < peak + timedelta(seconds=STEP) for r in runs), f"{name} missed {day}"
+
+
+def test_failed_refresh_is_retried(simulation):
+    _, calls, _ = simulation
+    rabat = [t for n, t in calls if n == 'Rabat']
+    assert rabat[1] - rabat[0] == pytest.approx(300, abs=STEP)
+
+
+def test_lease_fails_over_after_expiry(simulation):
+    clock, _, workers = simulation
+    leader = next(w for w in workers if w.is_leader)
+    follower = next(w for w in workers if w is not leader)
+    clock.advance(61)
+    follower.run_pending()
+    assert follower.is_leader
+
+
+def test_slow_refresh_keeps_the_lease(tmp_path):
+    path = str(tmp_path / 'lease.db')
+    running = threading.Event()
+    active = []
+    overlaps = []
+
+    def refresh(name, location):
+        if active:
+            overlaps.append(name)
+        active.append(name)
+        running.set()
+        time.sleep(1.0)  # three lease TTLs
+        active.remove(name)
+        return True
+
+    location = {'Cairo': LOCATIONS['Cairo']}
+    first = PrefetchScheduler(refresh, location, SQLiteLease(path, ttl=0.3), SystemClock())
+    second = PrefetchScheduler(refresh, location, SQLiteLease(path, ttl=0.3), SystemClock())
+    thread = threading.Thread(target=first.run_pending)
+    thread.start()
+    assert running.wait(2)
+    while thread.is_alive():
+        second.run_pending()
+        time.sleep(0.05)
+    thread.join()
+    assert not second.is_leader and overlaps == []
+    assert first.is_leader
@@ -0,0 +1,150 @@
+import threading
+
+import pytest
+from flask import Flask
+
+from ratelimit import Limiter, MemoryStore, SQLiteStore, create_store, parse_limit
+
+
+class Clock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def store(request, tmp_path):
+    if request.param == 'memory':
+        return MemoryStore()
+    return SQLiteStore(str(tmp_path / 'ratelimit.db'))
+
+
+def test_parse_limit():
+    assert parse_limit('10 per minute')[:2] == (10, 60)
+    assert parse_limit('200/day')[:2] == (200, 86400)
+    assert parse_limit('5 per 10 seconds')[:2] == (5, 10)
+    for text in ('0 per minute', 'ten per minute', '5 per fortnight'):
+        with pytest.raises(ValueError):
+            parse_limit(text)
+
+
+def test_gcra_burst_then_steady_rate(store):
+    limit = parse_limit('3 per minute')  # one request every 20 seconds
+    now = 1000.0
+    decisions = [store.hit('k', limit, now) for _ in range(4)]
+    assert [d.allowed for d in decisions] == [True, True, True, False]
+    assert [d.remaining for d in decisions[:3]] == [2, 1, 0]
+    assert decisions[3].retry_after == pytest.approx(20.0)
+
+    # Still refused just before the next slot, admitted once it comes
+    assert store.hit('k', limit, now + 19.5).retry_after == pytest.approx(0.5)
+    admitted = store.hit('k', limit, now + 20)
+    assert admitted.allowed and admitted.remaining == 0 and admitted.retry_after == 0.0
+
+    # After 100 s idle the bucket has refilled past full: the burst is back
+    assert store.hit('k', limit, now + 120).remaining == 2
+    # Keys are independent
+    assert store.hit('other', limit, now).remaining == 2
+
+
+def test_refused_requests_do_not_use_up_the_bucket(store):
+    limit = parse_limit('2 per 10 seconds')
+    for _ in range(2):
+        store.hit('k', limit, 0.0)
+    for _ in range(5):
+        assert not store.hit('k', limit, 1.0).allowed
+    # Refusals did not push the next slot further out
+    assert store.hit('k', limit, 5.0).allowed
+
+
+def test_sqlite_store_is_shared_and_admits_exactly_the_limit(tmp_path):
+    path = str(tmp_path / 'ratelimit.db')
+    limit = parse_limit('100 per hour')
+    admitted = []
+
+    def client():
+        # One store per thread, like one per worker process
+        store = SQLiteStore(path)
+        admitted.append(sum(store.hit('k', limit, 0.0).allowed for _ in range(50)))
+
+    threads = [threading.Thread(target=client) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sum(admitted) == 100
+
+
+def test_create_store(tmp_path):
+    assert isinstance(create_store('memory://'), MemoryStore)
+    store = create_store(f"sqlite://{tmp_path}/rl.db")
+    assert isinstance(store, SQLiteStore) and store.path == f"{tmp_path}/rl.db"
+    with pytest.raises(ValueError):
+        create_store('ftp://nowhere')
+
+
+class BrokenStore:
+    def hit(self, key, limit, now):
+        raise OSError("disk I/O error")
+
+
+def make_app(store=None, clock=None):
+    app = Flask(__name__)
+    limiter = Limiter(app, default_limits=['2 per minute'], store=store or MemoryStore(), clock=clock or Clock())
+
+    @app.route('/default')
+    def default():
+        return 'ok'
+
+    @app.route('/own')
+    @limiter.limit('1 per minute')
+    def own():
+        return 'ok'
+
+    @app.route('/exempt')
+    @limiter.exempt
+    def exempt():
+        return 'ok'
+
+    return app, limiter
+
+
+def test_route_limits_replace_the_defaults_and_exempt_routes_are_free():
+    app, limiter = make_app()
+    client = app.test_client()
+    assert [client.get('/default').status_code for _ in range(3)] == [200, 200, 429]
+    # Counted per route: /own has its own, stricter limit instead of the default
+    assert [client.get('/own').status_code for _ in range(2)] == [200, 429]
+    assert all(client.get('/exempt').status_code == 200 for _ in range(10))
+    assert limiter.stats()['checks'] == 5 and limiter.stats()['rejected'] == 2
+
+
+def test_rejection_is_json_with_retry_after():
+    clock = Clock()
+    app, _ = make_app(clock=clock)
+    client = app.test_client()
+    client.get('/own')
+    clock.now += 12.3
+    response = client.get('/own')
+    assert response.status_code == 429
+    assert response.headers['Retry-After'] == '48'
+    assert response.get_json()['success'] is False
+    clock.now += 48
+    assert client.get('/own').status_code == 200
+
+
+def test_clients_are_counted_separately():
+    app, _ = make_app()
+    client = app.test_client()
+    assert client.get('/own', environ_base={'REMOTE_ADDR': '10.0.0.1'}).status_code == 200
+    assert client.get('/own', environ_base={'REMOTE_ADDR': '10.0.0.2'}).status_code == 200
+    assert client.get('/own', environ_base={'REMOTE_ADDR': '10.0.0.1'}).status_code == 429
+
+
+def test_store_failure_lets_requests_through():
+    app, limiter = make_app(store=BrokenStore())
+    client = app.test_client()
+    assert [client.get('/own').status_code for _ in range(3)] == [200, 200, 200]
+    assert limiter.stats()['errors'] == 3 and limiter.stats()['checks'] == 0
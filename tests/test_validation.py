@@ -0,0 +1,22 @@
+from validation import prompt_validator, sanitize
+
+
+def test_sanitize_strips_and_escapes():
+    assert sanitize(' <b>"fish" & chips</b>\x00 ') == 'bfish &amp; chips/b'
+
+
+def test_sanitize_clamps_after_escaping():
+    url = '/media/x.png?a=1&b=2&c=3' + '&' * 600
+    clean = sanitize(url, max_length=500)
+    assert len(clean) <= 500
+    # Never half an entity at the end
+    assert clean.endswith('&amp;') and clean.replace('&amp;', '').find('&') == -1
+
+
+def test_sanitize_keeps_short_text():
+    assert sanitize('lantern & moon', max_length=20) == 'lantern &amp; moon'
+
+
+def test_validator_rejects_sql_metacharacters():
+    assert not prompt_validator.check("lantern'; DROP TABLE x").valid
+    assert prompt_validator.check('فانوس رمضان').valid
@@ -0,0 +1,107 @@
+import json
+import os
+import threading
+
+from writebehind import WriteBehindBuffer
+
+
+class RejectedRow(Exception):
+    """Stands in for a DataError: the database refuses the row itself"""
+
+
+class Database:
+    def __init__(self):
+        self.rows = []
+        self.down = False
+        self.calls = 0
+
+    def write(self, batch):
+        self.calls += 1
+        if self.down:
+            raise ConnectionError("database unavailable")
+        if any(record.get('bad') for record in batch):
+            raise RejectedRow("Data too long for column 'image_url'")
+        self.rows.extend(batch)
+
+
+def make_buffer(db, spill_dir, **options):
+    options.setdefault('permanent', lambda e: isinstance(e, RejectedRow))
+    buffer = WriteBehindBuffer(db.write, str(spill_dir), name='t', batch_size=3, flush_interval=3600, **options)
+    buffer._thread = threading.current_thread()  # flushed by hand, no background thread
+    return buffer
+
+
+def test_outage_keeps_records_and_crash_is_replayed(tmp_path):
+    db = Database()
+    db.down = True
+    first = make_buffer(db, tmp_path)
+    for i in range(5):
+        first.submit({'n': i})
+    assert first.flush() == 0 and first.stats()['buffered'] == 5
+    assert first.find('n', 4) == {'n': 4}
+
+    # "Crash": the process goes away with its segment still on disk
+    os.close(first._sealed[0].fd)
+    second = make_buffer(db, tmp_path)
+    assert second.replay() == 5
+    second.submit({'n': 5})
+    db.down = False
+    assert second.flush() == 6
+    assert [r['n'] for r in db.rows] == list(range(6))
+    assert db.rows[0]['replayed'] and 'replayed' not in db.rows[5]
+    assert second.stats()['batches'] == 2 and os.listdir(tmp_path) == []
+
+
+def test_rejected_record_is_isolated_and_dead_lettered(tmp_path):
+    db = Database()
+    buffer = make_buffer(db, tmp_path)
+    for i in range(7):
+        buffer.submit({'n': i, 'bad': i == 4})
+    assert buffer.flush() == 6
+    assert [r['n'] for r in db.rows] == [0, 1, 2, 3, 5, 6]
+    stats = buffer.stats()
+    assert stats['buffered'] == 0 and stats['dead_lettered'] == 1
+
+    with open(buffer.dead_letter_path, encoding='utf-8') as f:
+        dead = [json.loads(line) for line in f]
+    assert [d['record']['n'] for d in dead] == [4] and 'too long' in dead[0]['error']
+    # Only the dead-letter file is left; it is never replayed
+    assert os.listdir(tmp_path) == ['t.dead']
+    assert make_buffer(db, tmp_path).replay() == 0
+
+    # Nothing is retried on the next flush
+    calls = db.calls
+    assert buffer.flush() == 0 and db.calls == calls
+
+
+def test_connectivity_error_during_split_keeps_the_rest(tmp_path):
+    db = Database()
+    buffer = make_buffer(db, tmp_path)
+    for i in range(3):
+        buffer.submit({'n': i, 'bad': i == 0})
+    write = db.write
+
+    def flaky(batch):
+        # The database goes away right after the rejected row is isolated
+        if len(batch) < 3 and not batch[0].get('bad'):
+            raise ConnectionError("database unavailable")
+        write(batch)
+
+    buffer.write = flaky
+    assert buffer.flush() == 0
+    assert buffer.stats()['dead_lettered'] == 1
+    assert [r['n'] for r in buffer._pending] == [1, 2]
+
+    buffer.write = db.write
+    assert buffer.flush() == 2
+    assert [r['n'] for r in db.rows] == [1, 2]
+
+
+def test_errors_are_retried_without_a_permanent_predicate(tmp_path):
+    db = Database()
+    buffer = make_buffer(db, tmp_path, permanent=None)
+    buffer.submit({'n': 0, 'bad': True})
+    assert buffer.flush() == 0
+    stats = buffer.stats()
+    assert stats['buffered'] == 1 and stats['failures'] == 1 and stats['dead_lettered'] == 0
+    assert 'too long' in stats['last_error']
@@ -0,0 +1,204 @@
+"""
+Precomputed Ramadan iftar timetable.
+
+The timetable holds Maghrib for every country and every day of Ramadan as
+minutes since local midnight. It is written once by the build step
+(``flask --app app build-timetable``) in two forms:
+
+    iftar-<year>.json   readable, columnar JSON
+    iftar-<year>.bin    compact binary (struct-packed uint16 matrix)
+
+and loaded by /api/iftar-times, which serves slices of it.
+"""
+import hashlib
+import json
+import logging
+import os
+import struct
+from datetime import date, datetime, timedelta
+
+import prayer_times
+
+logger = logging.getLogger(__name__)
+
+FORMAT_VERSION = 1
+
+# Binary layout (little endian):
+#   header  : magic, format version, year, method, school, first day (ordinal), days, countries
+#   names   : per country, uint16 length + UTF-8 "name\tcity"
+#   matrix  : countries x days uint16 minutes since midnight (MISSING = no value)
+BINARY_MAGIC = b'IFTR'
+BINARY_HEADER = struct.Struct('<4sHHBBIHH')
+MISSING = 0xFFFF
+
+
+class Timetable:
+    """Maghrib matrix for a set of countries over a contiguous date range"""
+
+    def __init__(self, year, start, days, countries, minutes,
+                 method=prayer_times.METHOD, school=prayer_times.SCHOOL, meta=None):
+        self.year = year
+        self.start = start
+        self.days = days
+        self.countries = countries  # list of {'name', 'city', 'lat', 'lng', 'tz'}
+        self.minutes = minutes      # one row per country, None for missing values
+        self.method = method
+        self.school = school
+        self.meta = meta or {}
+        self._index = {c['name']: i for i, c in enumerate(countries)}
+        self._version = None
+
+    @property
+    def end(self):
+        return self.start + timedelta(days=self.days - 1)
+
+    @property
+    def dates(self):
+        return [self.start + timedelta(days=i) for i in range(self.days)]
+
+    @property
+    def version(self):
+        """Content version - changes whenever any value in the table changes"""
+        if self._version is None:
+            digest = hashlib.sha256(self.to_binary()).hexdigest()
+            self._version = f"{FORMAT_VERSION}-{digest[:16]}"
+        return self._version
+
+    def slice(self, start=None, end=None, names=None):
+        """
+        Return (dates, {name: [minutes, ...]}) for a sub-range and subset of countries.
+
+        The range is clipped to the timetable; unknown country names are skipped.
+        """
+        start = max(start or self.start, self.start)
+        end = min(end or self.end, self.end)
+        if start > end:
+            return [], {}
+        first = (start - self.start).days
+        last = (end - self.start).days + 1
+        dates = [self.start + timedelta(days=i) for i in range(first, last)]
+        names = names if names is not None else [c['name'] for c in self.countries]
+        rows = {}
+        for name in names:
+            i = self._index.get(name)
+            if i is not None:
+                rows[name] = self.minutes[i][first:last]
+        return dates, rows
+
+    def country(self, name):
+        i = self._index.get(name)
+        return self.countries[i] if i is not None else None
+
+    def to_dict(self):
+        return {
+            'format_version': FORMAT_VERSION,
+            'year': self.year,
+            'method': self.method,
+            'school': self.school,
+            'start': self.start.isoformat(),
+            'days': self.days,
+            'countries': self.countries,
+            'maghrib': self.minutes,
+            'meta': self.meta
+        }
+
+    def to_json(self):
+        return json.dumps(self.to_dict(), ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+    def to_binary(self):
+        parts = [BINARY_HEADER.pack(
+            BINARY_MAGIC, FORMAT_VERSION, self.year, self.method, self.school,
+            self.start.toordinal(), self.days, len(self.countries)
+        )]
+        for c in self.countries:
+            label = f"{c['name']}\t{c['city']}".encode('utf-8')
+            parts.append(struct.pack('<H', len(label)))
+            parts.append(label)
+        values = [MISSING if m is None else m for row in self.minutes for m in row]
+        parts.append(struct.pack(f'<{len(values)}H', *values))
+        return b''.join(parts)
+
+    @classmethod
+    def from_dict(cls, data):
+        if data.get('format_version') != FORMAT_VERSION:
+            raise ValueError(f"Unsupported timetable format: {data.get('format_version')}")
+        return cls(
+            year=data['year'],
+            start=date.fromisoformat(data['start']),
+            days=data['days'],
+            countries=data['countries'],
+            minutes=data['maghrib'],
+            method=data['method'],
+            school=data['school'],
+            meta=data.get('meta')
+        )
+
+    @classmethod
+    def from_binary(cls, blob):
+        magic, version, year, method, school, start, days, count = BINARY_HEADER.unpack_from(blob, 0)
+        if magic != BINARY_MAGIC or version != FORMAT_VERSION:
+            raise ValueError("Unsupported timetable binary")
+        offset = BINARY_HEADER.size
+        countries = []
+        for _ in range(count):
+            (length,) = struct.unpack_from('<H', blob, offset)
+            offset += 2
+            name, city = blob[offset:offset + length].decode('utf-8').split('\t', 1)
+            offset += length
+            countries.append({'name': name, 'city': city})
+        values = struct.unpack_from(f'<{count * days}H', blob, offset)
+        minutes = [
+            [None if v == MISSING else v for v in values[i * days:(i + 1) * days]]
+            for i in range(count)
+        ]
+        return cls(year, date.fromordinal(start), days, countries, minutes, method, school)
+
+
+def build_timetable(year, start, end, countries):
+    """Compute the full timetable for a Ramadan window in one batch"""
+    dates = prayer_times.date_range(start, end)
+    names = list(countries.keys())
+    locations = [(countries[n]['lat'], countries[n]['lng'], countries[n]['tz']) for n in names]
+    minutes = prayer_times.maghrib_matrix(locations, dates)
+    entries = [
+        {
+            'name': n,
+            'city': countries[n]['city'],
+            'lat': countries[n]['lat'],
+            'lng': countries[n]['lng'],
+            'tz': countries[n]['tz']
+        }
+        for n in names
+    ]
+    meta = {'generated_at': datetime.utcnow().replace(microsecond=0).isoformat() + 'Z'}
+    return Timetable(year, start, len(dates), entries, minutes, meta=meta)
+
+
+def artifact_paths(directory, year):
+    base = os.path.join(directory, f"iftar-{year}")
+    return base + '.json', base + '.bin'
+
+
+def save_timetable(timetable, directory):
+    """Write the JSON and binary artifacts; returns their paths"""
+    os.makedirs(directory, exist_ok=True)
+    json_path, bin_path = artifact_paths(directory, timetable.year)
+    for path, payload in ((json_path, timetable.to_json()), (bin_path, timetable.to_binary())):
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(payload)
+        os.replace(tmp_path, path)
+    return json_path, bin_path
+
+
+def load_timetable(directory, year):
+    """Load a previously built timetable, or None if missing/outdated"""
+    json_path, _ = artifact_paths(directory, year)
+    if not os.path.exists(json_path):
+        return None
+    try:
+        with open(json_path, 'rb') as f:
+            return Timetable.from_dict(json.loads(f.read()))
+    except (OSError, ValueError, KeyError) as e:
+        logger.warning("Ignoring timetable artifact", extra={'path': json_path, 'error': str(e)})
+        return None
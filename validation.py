@@ -0,0 +1,141 @@
+"""
+Prompt validation and sanitization.
+
+All rules are compiled once into a single alternation of named groups, so a
+prompt is checked in one regex pass no matter how many rules there are, and
+every hit reports which rule fired and where.
+
+A rule may declare a ``trigger``: a character class its matches can start
+with. When every rule has one, the combined pattern is gated by a lookahead
+on their union, so positions that cannot start any match (most of an Arabic
+prompt) are skipped without trying each branch.
+"""
+import re
+from collections import namedtuple
+
+MAX_PROMPT_LENGTH = 1000
+
+RuleHit = namedtuple('RuleHit', ['rule', 'match', 'start', 'end'])
+
+
+class ValidationResult:
+    """Outcome of validating a prompt"""
+
+    __slots__ = ('valid', 'error', 'hits')
+
+    def __init__(self, valid, error=None, hits=()):
+        self.valid = valid
+        self.error = error
+        self.hits = list(hits)
+
+    def __bool__(self):
+        return self.valid
+
+    def to_dict(self):
+        return {
+            'valid': self.valid,
+            'error': self.error,
+            'hits': [hit._asdict() for hit in self.hits]
+        }
+
+
+class PromptValidator:
+    """Single-pass rule engine; add_rule() extends it without adding passes"""
+
+    def __init__(self, rules=(), max_length=MAX_PROMPT_LENGTH,
+                 empty_message="الرجاء إدخال نص الوصف",
+                 length_message="النص طويل جداً (الحد الأقصى 1000 حرف)"):
+        self.max_length = max_length
+        self.empty_message = empty_message
+        self.length_message = length_message
+        self._rules = []
+        self._pattern = None
+        for rule in rules:
+            self.add_rule(*rule, compile=False)
+        self._compile()
+
+    def add_rule(self, name, pattern, message, trigger=None, compile=True):
+        """Register a rule; its pattern must not define named groups of its own"""
+        if not re.fullmatch(r'[A-Za-z_]\w*', name) or any(r[0] == name for r in self._rules):
+            raise ValueError(f"Invalid or duplicate rule name: {name}")
+        re.compile(pattern)
+        if trigger is not None:
+            re.compile(f"[{trigger}]")
+        self._rules.append((name, pattern, message, trigger))
+        if compile:
+            self._compile()
+
+    def _compile(self):
+        if not self._rules:
+            self._pattern = None
+            return
+        combined = '|'.join(f"(?P<{name}>{pattern})" for name, pattern, _, _ in self._rules)
+        triggers = [trigger for _, _, _, trigger in self._rules]
+        if all(triggers):
+            combined = f"(?=[{''.join(triggers)}])(?:{combined})"
+        self._pattern = re.compile(combined, re.IGNORECASE)
+        self._messages = {name: message for name, _, message, _ in self._rules}
+
+    @property
+    def rules(self):
+        return [name for name, _, _, _ in self._rules]
+
+    def check(self, prompt, collect_all=False):
+        """
+        Validate a prompt.
+
+        Stops at the first rule hit unless collect_all is True, in which case
+        every hit (still from one pass over the text) is reported.
+        """
+        if not prompt or not prompt.strip():
+            return ValidationResult(False, self.empty_message)
+        if len(prompt) > self.max_length:
+            return ValidationResult(False, self.length_message)
+        if self._pattern is None:
+            return ValidationResult(True)
+
+        if collect_all:
+            hits = [RuleHit(m.lastgroup, m.group(), m.start(), m.end())
+                    for m in self._pattern.finditer(prompt)]
+        else:
+            m = self._pattern.search(prompt)
+            hits = [RuleHit(m.lastgroup, m.group(), m.start(), m.end())] if m else []
+        if hits:
+            return ValidationResult(False, self._messages[hits[0].rule], hits)
+        return ValidationResult(True)
+
+
+# SQL injection patterns: (name, pattern, message, trigger)
+DEFAULT_RULES = (
+    ('sql_keyword',
+     r'\b(?:SELECT|INSERT|UPDATE|DELETE|DROP|CREATE|ALTER|EXEC|EXECUTE|UNION|SCRIPT)\b',
+     "النص المدخل غير صالح", 'SIUDCAE'),
+    ('sql_tautology', r'\b(?:OR|AND)\s+\d+\s*=\s*\d+', "النص المدخل غير صالح", 'OA'),
+    ('sql_metachar', r'\'|"|;|--|/\*|\*/', "النص المدخل غير صالح", '\'";/*\\-'),
+)
+
+prompt_validator = PromptValidator(DEFAULT_RULES)
+
+# Potentially dangerous characters
+_STRIP_PATTERN = re.compile('[<>"\']')
+
+
+def sanitize(text, max_length=MAX_PROMPT_LENGTH):
+    """Sanitize user input to prevent XSS and SQL Injection"""
+    if not text:
+        return ""
+    # Remove null bytes
+    text = text.replace('\x00', '')
+    if len(text) > max_length:
+        text = text[:max_length]
+    text = _STRIP_PATTERN.sub('', text)
+    # Escape HTML - after the strip above only '&' is left to escape
+    text = text.replace('&', '&amp;').strip()
+    if len(text) > max_length:
+        # Escaping lengthened it: clamp again without leaving half an '&amp;' at the end
+        text = text[:max_length]
+        cut = text.rfind('&', max_length - 4)
+        if cut != -1:
+            text = text[:cut]
+        text = text.rstrip()
+    return text
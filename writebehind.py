@@ -0,0 +1,325 @@
+"""
+Write-behind buffer for rows that do not need to be written inside a request.
+
+``submit(record)`` appends the record to an append-only spill file and to an
+in-memory buffer, then returns; a background thread hands the buffer to
+``write(records)`` in batches of up to ``batch_size`` once that many records
+are waiting or ``flush_interval`` seconds have passed. If ``write`` raises
+(the database is slow or down), the records stay buffered and the flush is
+retried after ``retry_interval`` seconds.
+
+Errors for which ``permanent(error)`` is true are about the records, not the
+database (a value too long for its column, a constraint violation), so
+retrying cannot help. The failing batch is split in halves until the
+rejected records are isolated; the rest are written and each rejected
+record is appended, with the error, to ``<name>.dead`` in ``spill_dir`` and
+dropped from the buffer.
+
+Each process writes its own spill segments under ``spill_dir`` and holds an
+flock on them. A segment is deleted once every record in it has been
+written, so whatever is left on disk was never confirmed. On ``start()`` a
+process claims the segments of processes that are gone (their locks were
+released) and replays them; those records are marked ``replayed`` because
+some may have reached the database just before the crash.
+"""
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: no locks - only segments found at startup are replayed
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+SEGMENT_SUFFIX = '.log'
+DEAD_LETTER_SUFFIX = '.dead'
+
+
+class _Segment:
+    """One spill file, locked by the process writing or replaying it"""
+
+    def __init__(self, path, fd, count=0):
+        self.path = path
+        self.fd = fd
+        self.count = count
+
+    @classmethod
+    def create(cls, path):
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return cls(path, fd)
+
+    @classmethod
+    def claim(cls, path):
+        """Lock another process's segment; None if its owner is alive or it is already gone"""
+        try:
+            fd = os.open(path, os.O_RDWR)
+        except FileNotFoundError:
+            return None
+        try:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            # Another process may have replayed and unlinked it while we waited
+            if os.fstat(fd).st_ino != os.stat(path).st_ino:
+                raise FileNotFoundError(path)
+        except (BlockingIOError, FileNotFoundError):
+            os.close(fd)
+            return None
+        return cls(path, fd)
+
+    def append(self, line, fsync=False):
+        os.write(self.fd, line)
+        if fsync:
+            os.fsync(self.fd)
+        self.count += 1
+
+    def read(self):
+        """Records in the file; a torn last line from a crash is skipped"""
+        records = []
+        with open(self.path, 'rb') as f:
+            for number, line in enumerate(f, 1):
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    logger.warning("Skipping corrupt spill record", extra={'file': self.path, 'line': number})
+        self.count = len(records)
+        return records
+
+    def remove(self):
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+        os.close(self.fd)
+
+
+class WriteBehindBuffer:
+    """Buffered, batched, crash-safe writes through ``write(records)``"""
+
+    def __init__(self, write, spill_dir, name='records', batch_size=100, flush_interval=1.0,
+                 retry_interval=5.0, fsync=False, permanent=None):
+        self.write = write
+        self.permanent = permanent  # error -> True if retrying the same records cannot succeed
+        self.spill_dir = spill_dir
+        self.name = name
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.retry_interval = retry_interval
+        self.fsync = fsync
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._reset()
+        self.submitted = 0
+        self.written = 0
+        self.batches = 0
+        self.failures = 0
+        self.replayed = 0
+        self.dead_lettered = 0
+        self.last_error = None
+
+    @property
+    def dead_letter_path(self):
+        return os.path.join(self.spill_dir, f"{self.name}{DEAD_LETTER_SUFFIX}")
+
+    def _dead_letter(self, record, error):
+        line = json.dumps({'record': record, 'error': str(error), 'at': time.time()},
+                          ensure_ascii=False, separators=(',', ':'), default=str) + '\n'
+        os.makedirs(self.spill_dir, exist_ok=True)
+        with open(self.dead_letter_path, 'a', encoding='utf-8') as f:
+            f.write(line)
+            if self.fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        logger.error("Write-behind record rejected", extra={
+            'buffer': self.name, 'file': self.dead_letter_path, 'error': str(error)
+        })
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._token = uuid.uuid4().hex[:8]
+        self._segment_seq = 0
+        self._current = None
+        self._sealed = []
+        self._pending = []
+        self._inflight = []
+        self._thread = None
+        self._retry_at = 0.0
+
+    def _check_fork(self):
+        # Segments, locks and the thread belong to the process that created them
+        # (gunicorn --preload forks after import)
+        if self._pid != os.getpid():
+            self._reset()
+
+    def _new_segment(self):
+        os.makedirs(self.spill_dir, exist_ok=True)
+        self._segment_seq += 1
+        filename = f"{self.name}-{self._pid}-{self._token}-{self._segment_seq}{SEGMENT_SUFFIX}"
+        return _Segment.create(os.path.join(self.spill_dir, filename))
+
+    def submit(self, record):
+        """Queue a record (a JSON-serialisable dict); it is on disk when this returns"""
+        line = (json.dumps(record, ensure_ascii=False, separators=(',', ':'), default=str) + '\n').encode('utf-8')
+        with self._lock:
+            self._check_fork()
+            if self._current is None:
+                self._current = self._new_segment()
+            self._current.append(line, self.fsync)
+            self._pending.append(record)
+            self.submitted += 1
+            full = len(self._pending) >= self.batch_size
+        self.start()
+        if full:
+            self._wakeup.set()
+
+    def find(self, key, value):
+        """Newest record not yet written whose ``key`` equals ``value``, or None"""
+        with self._lock:
+            for record in reversed(self._inflight + self._pending):
+                if record.get(key) == value:
+                    return record
+        return None
+
+    def replay(self):
+        """Claim the spill segments of dead processes and queue their records; returns how many"""
+        try:
+            names = sorted(os.listdir(self.spill_dir))
+        except FileNotFoundError:
+            return 0
+        prefix = f"{self.name}-"
+        own = f"{self.name}-{self._pid}-{self._token}-"
+        count = 0
+        for filename in names:
+            if not filename.startswith(prefix) or not filename.endswith(SEGMENT_SUFFIX) or filename.startswith(own):
+                continue
+            segment = _Segment.claim(os.path.join(self.spill_dir, filename))
+            if segment is None:
+                continue
+            records = segment.read()
+            for record in records:
+                record['replayed'] = True
+            with self._lock:
+                self._sealed.append(segment)
+                self._pending[:0] = records
+                self.replayed += len(records)
+            count += len(records)
+        if count:
+            logger.info("Replaying spilled records", extra={'buffer': self.name, 'records': count})
+        return count
+
+    def flush(self):
+        """Write everything buffered now; returns the number of records written"""
+        with self._flush_lock:
+            with self._lock:
+                self._check_fork()
+                if self._current is not None and self._current.count:
+                    self._sealed.append(self._current)
+                    self._current = None
+                self._inflight, self._pending = self._pending, []
+                records = self._inflight
+            written = 0
+            settled = 0  # leading records written or dead-lettered
+
+            def write(batch):
+                nonlocal written, settled
+                try:
+                    self.write(batch)
+                except Exception as e:
+                    if self.permanent is None or not self.permanent(e):
+                        raise
+                    if len(batch) == 1:
+                        self._dead_letter(batch[0], e)
+                        settled += 1
+                        with self._lock:
+                            self.dead_lettered += 1
+                            self.last_error = str(e)
+                        return
+                    # Split until the rejected records are isolated
+                    middle = len(batch) // 2
+                    write(batch[:middle])
+                    write(batch[middle:])
+                    return
+                written += len(batch)
+                settled += len(batch)
+                with self._lock:
+                    self.written += len(batch)
+                    self.batches += 1
+
+            try:
+                while settled < len(records):
+                    write(records[settled:settled + self.batch_size])
+            except Exception as e:
+                with self._lock:
+                    # Keep order: unsettled records go back ahead of newer ones
+                    self._pending[:0] = records[settled:]
+                    self._inflight = []
+                    self.failures += 1
+                    self.last_error = str(e)
+                    self._retry_at = time.monotonic() + self.retry_interval
+                logger.warning("Write-behind flush failed", extra={
+                    'buffer': self.name, 'written': written, 'buffered': len(records) - settled, 'error': str(e)
+                })
+                return written
+            with self._lock:
+                self._inflight = []
+                sealed, self._sealed = self._sealed, []
+            for segment in sealed:
+                segment.remove()
+            return written
+
+    def _loop(self):
+        while not self._stop.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            if time.monotonic() < self._retry_at:
+                continue
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Write-behind flusher error")
+
+    def start(self):
+        """Replay orphaned segments and start the flusher thread (idempotent)"""
+        with self._lock:
+            self._check_fork()
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._loop, name=f"write-behind-{self.name}", daemon=True)
+        try:
+            self.replay()
+        except OSError as e:
+            logger.error("Could not replay spilled records", extra={'buffer': self.name, 'error': str(e)})
+        self._thread.start()
+
+    def stop(self, timeout=5.0):
+        """Stop the flusher and make one last attempt to write the buffer"""
+        self._stop.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout=timeout)
+        self.flush()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'name': self.name,
+                'buffered': len(self._pending) + len(self._inflight),
+                'segments': len(self._sealed) + (1 if self._current is not None else 0),
+                'submitted': self.submitted,
+                'written': self.written,
+                'batches': self.batches,
+                'failures': self.failures,
+                'replayed': self.replayed,
+                'dead_lettered': self.dead_lettered,
+                'last_error': self.last_error
+            }
+